@@ -1,13 +1,10 @@
 import os
-#pickle and transfer function classes to load transfer functions
-import cPickle as pickle
-import TTH.MEAnalysis.TFClasses as TFClasses
 import sys
-sys.modules["TFClasses"] = TFClasses
 
-from TTH.MEAnalysis.MEAnalysis_heppy import sequence
-from TTH.MEAnalysis.samples_base import lfn_to_pfn
-from TTH.MEAnalysis.samples_vhbb import samples
+#With --startup-profile, the import and initialisation times are reported
+#at the end of the job, see TTH.MEAnalysis.Startup
+from TTH.MEAnalysis import Startup
+Startup.start(sys.argv)
 
 firstEvent = int(os.environ["SKIP_EVENTS"])
 nEvents = int(os.environ["MAX_EVENTS"])
@@ -15,41 +12,25 @@ nEvents = int(os.environ["MAX_EVENTS"])
 fns = os.environ["FILE_NAMES"].split()
 dataset = os.environ["DATASETPATH"]
 
-#Create a list of samples to run
-#fill the subFiles of the samples from
-#the supplied file names
-good_samp = []
-for ns in range(len(samples)):
-    if samples[ns].nickName.value() == dataset:
-        samples[ns].skip = False
-        samples[ns].subFiles = map(lfn_to_pfn, fns)
-        good_samp += [samples[ns]]
-    else:
-        samples[ns].skip = True
+#Configure only the sample of this job, see MEAnalysis_heppy
+os.environ["ME_SAMPLE"] = dataset
+from TTH.MEAnalysis.MEAnalysis_heppy import sequence, conf, output_services, selected_samples
+from TTH.MEAnalysis.samples_base import lfn_to_pfn
 
-assert(len(good_samp) == 1)
+assert(len(selected_samples) == 1)
 outFileName = os.environ["MY_SCRATCH"] + "/output.root"
 
 import PhysicsTools.HeppyCore.framework.config as cfg
-from PhysicsTools.HeppyCore.framework.services.tfile import TFileService
-output_service = cfg.Service(
-    TFileService,
-    'outputfile',
-    name="outputfile",
-    fname="tree.root",
-    option='recreate'
-)
 
-inputSamples = []
-for s in samples:
-    inputSample = cfg.Component(
-        'tth',
-        files = s.subFiles.value(),
-        tree_name = "tree"
-    )
-    inputSample.isMC = s.isMC.value()
-    if s.skip.value() == False:
-        inputSamples.append(inputSample)
+#the sample with the supplied file names
+s = selected_samples[0]
+inputSample = cfg.Component(
+    'tth',
+    files = map(lfn_to_pfn, fns),
+    tree_name = "tree"
+)
+inputSample.isMC = s.isMC.value()
+inputSamples = [inputSample]
 
 #finalization of the configuration object.
 from PhysicsTools.HeppyCore.framework.chain import Chain as Events
@@ -61,19 +42,31 @@ config = cfg.Config(
     sequence = sequence,
 
     #save output to these services
-    services = [output_service],
+    services = output_services,
 
     #This defines how events are loaded
     events_class = Events
 )
 
-from PhysicsTools.HeppyCore.framework.looper import Looper
-looper = Looper('Loop',
-    config,
-    nPrint = 0,
-    firstEvent=firstEvent,
-    nEvents = nEvents
-)
+#The job runs in a scratch directory which is lost if it is resubmitted, the
+#checkpoint is kept in ME_CHECKPOINT_DIR (per job, see meanalysis-heppy.sh)
+#and a resubmitted job resumes from it
+from TTH.MEAnalysis.MELooper import MELooper
+with Startup.stage("looper"):
+    looper = MELooper('Loop',
+        config,
+        nPrint = 0,
+        firstEvent=firstEvent,
+        nEvents = nEvents,
+        checkpointEvents = conf.general.get("checkpointEvents", 0),
+        checkpointMinutes = conf.general.get("checkpointMinutes", 0),
+        checkpointDir = os.environ.get("ME_CHECKPOINT_DIR", None),
+        activeBranchesOnly = conf.general.get("activeBranchesOnly", False),
+        memoryReportEvents = conf.general.get("memoryReportEvents", 0),
+        pipelineEvents = conf.general.get("pipelineEvents", 1)
+    )
 
 looper.loop()
 looper.write()
+
+Startup.report()
@@ -0,0 +1,239 @@
+"""
+Splits the datasets into jobs of equal predicted running time, instead of a
+fixed number of events per job.
+
+The running time is dominated by the MEM integrations, which depend strongly
+on the category and the jet and lepton multiplicity. The cost model is
+learned from existing output trees (mem_tth_time, mem_ttbb_time per method)
+in bins of the raw nJet and nselLeptons of the input trees, which are also
+used to predict the cost of the entries to split.
+
+1. learn the cost model from the output of a previous run over a dataset file
+python balanceJobs.py --action learn --model cost.json --dataset datasets/sig.dat \
+    /scratch/$USER/*.root
+
+2. compute the job ranges for a grid-control dataset file
+python balanceJobs.py --action split --model cost.json --dataset datasets/sig.dat \
+    --time-per-job 3600 --out jobs-sig.csv
+
+The output is a CSV with DATASETPATH, FILE_NAMES, SKIP_EVENTS, MAX_EVENTS per job,
+the environment read by MEAnalysis_heppy_gc.py. It can be used in place of the
+dataset splitter in the grid-control config as a parameter source:
+
+[UserTask]
+executable = meanalysis-heppy.sh
+
+[parameters]
+parameters = jobs
+jobs type = csv
+jobs source = jobs-sig.csv
+"""
+import argparse, json
+import numpy as np
+import ROOT
+
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.VHbbColumns import ChunkedTreeReader
+from TTH.MEAnalysis.samples_base import lfn_to_pfn
+
+#Cost of an event without MEM integrations [s]
+DEFAULT_EVENT_COST = 0.005
+
+def read_datasets(fn):
+    """
+    Reads a grid-control dataset file, returns a list of
+    (dataset name, [(lfn, nentries), ...]) in the order of the file.
+    """
+    datasets = []
+    for line in open(fn).readlines():
+        line = line.strip()
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        if line.startswith("["):
+            datasets += [(line[1:-1], [])]
+            continue
+        lfn, n = line.split("=")
+        datasets[-1][1].append((lfn.strip(), int(n)))
+    return datasets
+
+def read_branches(files, branches, chunk_size=100000):
+    """
+    Reads scalar branches of the input trees, returns a dict of
+    branch name -> array over all the entries of the files.
+    """
+    reader = ChunkedTreeReader(files, "tree", {}, branches, chunk_size)
+    cols = {br: [] for br in branches}
+    for start in range(0, reader.nentries, chunk_size):
+        chunk = reader.read(start, min(start + chunk_size, reader.nentries))
+        for br in branches:
+            cols[br] += [chunk.scalars[br]]
+    return {br: np.concatenate(cols[br]).astype(np.int64) for br in branches}
+
+def learn(filenames, inputs, methods):
+    """
+    Accumulates the MEM time per event in (cat, nJet, nselLeptons, method)
+    from output trees, where nJet and nselLeptons are the raw counts of the
+    input trees the outputs were produced from, matched by (run, lumi, evt).
+    Input events which were not analyzed or in which a method was not run
+    contribute zero time.
+
+    Returns the cost model as a dict:
+    "keys": list of [cat, nJet, nselLeptons, method, nevents, mean time, mean nperm]
+    "events": list of [nJet, nselLeptons, number of input events]
+    """
+    raw = read_branches(inputs, ["run", "lumi", "evt", "nJet", "nselLeptons"])
+    counts = {}
+    for (r, l, e, nj, nl) in zip(raw["run"], raw["lumi"], raw["evt"], raw["nJet"], raw["nselLeptons"]):
+        counts[(r, l, e)] = (nj, nl)
+    print "read {0} events from {1} input files".format(len(raw["run"]), len(inputs))
+
+    tt = ROOT.TChain("tree")
+    for fn in filenames:
+        tt.Add(fn)
+    tt.SetBranchStatus("*", 0)
+    for br in ["run", "lumi", "evt", "cat", "nmem_tth", "nmem_ttbb",
+        "mem_tth_time", "mem_ttbb_time", "mem_tth_nperm", "mem_ttbb_nperm"]:
+        tt.SetBranchStatus(br, 1)
+
+    #(cat, nJet, nselLeptons) -> number of events
+    nevents = {}
+    #(cat, nJet, nselLeptons, method) -> [sum of time, sum of nperm]
+    sums = {}
+    nmissing = 0
+    for iev in range(tt.GetEntries()):
+        tt.GetEntry(iev)
+        evid = (int(tt.run), int(tt.lumi), int(tt.evt))
+        if not counts.has_key(evid):
+            nmissing += 1
+            continue
+        k = (int(tt.cat), ) + counts[evid]
+        nevents[k] = nevents.get(k, 0) + 1
+        for coll in ["mem_tth", "mem_ttbb"]:
+            times = getattr(tt, coll + "_time")
+            nperms = getattr(tt, coll + "_nperm")
+            for i in range(min(int(getattr(tt, "n" + coll)), len(methods))):
+                km = k + (methods[i], )
+                if not sums.has_key(km):
+                    sums[km] = [0.0, 0.0]
+                sums[km][0] += times[i]
+                sums[km][1] += nperms[i]
+    print "read {0} events from {1} files, {2} not in the inputs".format(
+        tt.GetEntries(), len(filenames), nmissing
+    )
+
+    keys = []
+    for km, (t, nperm) in sorted(sums.items()):
+        n = nevents[km[:3]]
+        keys += [[int(x) for x in km[:3]] + [km[3], n, t / n, nperm / n]]
+
+    nev_jl = {}
+    for (nj, nl) in zip(raw["nJet"], raw["nselLeptons"]):
+        nev_jl[(nj, nl)] = nev_jl.get((nj, nl), 0) + 1
+    return {
+        "keys": keys,
+        "events": [[int(nj), int(nl), n] for (nj, nl), n in sorted(nev_jl.items())],
+    }
+
+def event_costs(model, event_cost):
+    """
+    Returns the expected time of an event by (nJet, nselLeptons), summing the
+    methods and averaging over the categories found with this multiplicity.
+    """
+    nev = {(nj, nl): n for (nj, nl, n) in model["events"]}
+    costs = {k: event_cost for k in nev.keys()}
+    for (cat, nj, nl, method, n, t, nperm) in model["keys"]:
+        costs[(nj, nl)] += t * float(n) / nev[(nj, nl)]
+    return costs
+
+def predict(costs, njets, nleps, event_cost):
+    """
+    Returns the predicted time of each entry from the raw nJet and nselLeptons.
+    Multiplicities not in the model take the cost of the closest lower jet
+    multiplicity with the same leptons.
+    """
+    ret = np.zeros(len(njets), dtype=np.float64)
+    for nj, nl in set(zip(njets, nleps)):
+        cands = [k for k in costs.keys() if k[1] == nl and k[0] <= nj]
+        c = costs[max(cands)] if len(cands) > 0 else event_cost
+        ret[(njets == nj) & (nleps == nl)] = c
+    return ret
+
+def split(files, cost, time_per_job):
+    """
+    Splits the consecutive entries of the files into jobs with a predicted
+    time of about time_per_job each.
+
+    files: list of (lfn, nentries)
+    cost: predicted time of each entry of all the files
+    Returns a list of ([lfn, ...], skip, nevents), where skip counts from the
+    start of the first file, as in the grid-control event splitting.
+    """
+    if len(cost) == 0:
+        return []
+    file_start = np.cumsum([0] + [n for (lfn, n) in files])
+    cumcost = np.cumsum(cost)
+    njobs = max(1, int(round(cumcost[-1] / time_per_job)))
+
+    #first entry of each job: where the cumulative cost crosses the job boundaries
+    bounds = np.searchsorted(cumcost, cumcost[-1] * np.arange(1, njobs) / float(njobs))
+    starts = np.unique(np.concatenate([[0], bounds]).astype(np.int64))
+
+    jobs = []
+    for ij, first in enumerate(starts):
+        last = starts[ij + 1] if ij + 1 < len(starts) else len(cost)
+        ifirst = np.searchsorted(file_start, first, side="right") - 1
+        ilast = np.searchsorted(file_start, last - 1, side="right") - 1
+        jobs += [(
+            [lfn for (lfn, n) in files[ifirst:ilast + 1]],
+            int(first - file_start[ifirst]),
+            int(last - first)
+        )]
+    return jobs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--action', choices=['learn', 'split'], type=str, required=True,
+        help="learn the cost model from output trees or split a dataset file into jobs"
+    )
+    parser.add_argument('--model', type=str, required=True, help="cost model file (json)")
+    parser.add_argument('--dataset', type=str, required=True,
+        help="grid-control dataset file to split, or the outputs were produced from"
+    )
+    parser.add_argument('--time-per-job', type=float, default=3600.0, help="target predicted time per job [s]")
+    parser.add_argument('--event-cost', type=float, default=DEFAULT_EVENT_COST, help="time of an event without MEM [s]")
+    parser.add_argument('--out', type=str, default="jobs.csv", help="output job list")
+    parser.add_argument('files', nargs='*', help="output trees to learn from")
+    args = parser.parse_args()
+
+    conf = Conf()
+
+    if args.action == "learn":
+        inputs = [lfn_to_pfn(lfn) for (dataset, files) in read_datasets(args.dataset) for (lfn, n) in files]
+        model = learn(args.files, inputs, conf.mem["methodsToRun"])
+        of = open(args.model, "w")
+        json.dump(model, of, indent=2)
+        of.close()
+        for k in model["keys"]:
+            print "cat={0} nJet={1} nselLeptons={2} {3:20s} n={4} time={5:.2f} nperm={6:.1f}".format(*k)
+
+    if args.action == "split":
+        model = json.load(open(args.model))
+        costs = event_costs(model, args.event_cost)
+
+        of = open(args.out, "w")
+        of.write("DATASETPATH,FILE_NAMES,SKIP_EVENTS,MAX_EVENTS\n")
+        for (dataset, files) in read_datasets(args.dataset):
+            raw = read_branches(
+                [lfn_to_pfn(lfn) for (lfn, n) in files], ["nJet", "nselLeptons"]
+            )
+            njets, nleps = raw["nJet"], raw["nselLeptons"]
+            assert len(njets) == sum([n for (lfn, n) in files]), "entries differ from {0}".format(args.dataset)
+            cost = predict(costs, njets, nleps, args.event_cost)
+            jobs = split(files, cost, args.time_per_job)
+            print "{0}: {1} events, predicted {2:.0f} s in {3} jobs".format(
+                dataset, len(cost), cost.sum(), len(jobs)
+            )
+            for (lfns, skip, nev) in jobs:
+                of.write("{0},{1},{2},{3}\n".format(dataset, " ".join(lfns), skip, nev))
+        of.close()
+        print "wrote", args.out
@@ -16,11 +16,16 @@ source /cvmfs/cms.cern.ch/cmsset_default.sh
 eval `scramv1 runtime -sh`
 cd $MY_SCRATCH
 
+OUTDIR=$HOME/tth/gc/${TASK_ID}/${DATASETPATH}/
+mkdir -p $OUTDIR 
+
+#the checkpoint of this job (Conf.general["checkpointEvents"], "checkpointMinutes"),
+#kept next to the output such that a resubmitted job resumes from it
+export ME_CHECKPOINT_DIR=$OUTDIR/checkpoint_${MY_JOBID}
+
 python ${CMSSW_BASE}/src/TTH/MEAnalysis/gc/MEAnalysis_heppy_gc.py
 echo "MEAnalysis is done"
 
-OUTDIR=$HOME/tth/gc/${TASK_ID}/${DATASETPATH}/
-mkdir -p $OUTDIR 
 echo "copying output"
 OFNAME=$OUTDIR/output_${MY_JOBID}.root
 cp $MY_SCRATCH/Loop/tree.root $OFNAME
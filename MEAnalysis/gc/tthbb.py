@@ -6,10 +6,14 @@ version = "Apr14"
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
 parser.add_argument('--action',
-    choices=['status', 'submit', 'report', 'hadd', 'replicate'], type=str,
+    choices=['status', 'submit', 'report', 'hadd', 'replicate', 'timing'], type=str,
     required=True,
     help="the action to perform"
 )
+parser.add_argument('--timing-reference',
+    type=str, default=None,
+    help="timing_<version>.root of an earlier release to compare with in --action timing"
+)
 
 args = parser.parse_args()
 
@@ -31,19 +35,10 @@ if not os.path.isfile(gc):
 
 print "Using grid-control", gc
 
-if args.action == "status":
-    for job in jobs:
-        print job
-        subprocess.call([gc, job, "-qs"])
-        subprocess.call([gc, job, "-r"])
-if args.action == "submit":
-    for job in jobs:
-        subprocess.call([gc, job, "-q"])
-if args.action == "report":
-    for job in jobs:
-        subprocess.call([gc, job, "-r"])
-if args.action == "hadd":
-    completed_files = []
+def output_datasets():
+    """
+    Returns the output files of the completed jobs as a dict dataset -> files.
+    """
     input_filenames = []
     for job, wd in zip(jobs, workdirs):
         donefiles = glob.glob(wd + "/output/*/output.txt")
@@ -55,10 +50,25 @@ if args.action == "hadd":
         spl = inf.split("/")
         spl = filter(lambda x: len(x)>0, spl)
         dataset = spl[-2]
-        fn = inf
         if not datasets.has_key(dataset):
             datasets[dataset] = []
         datasets[dataset] += [inf]
+    return datasets
+
+if args.action == "status":
+    for job in jobs:
+        print job
+        subprocess.call([gc, job, "-qs"])
+        subprocess.call([gc, job, "-r"])
+if args.action == "submit":
+    for job in jobs:
+        subprocess.call([gc, job, "-q"])
+if args.action == "report":
+    for job in jobs:
+        subprocess.call([gc, job, "-r"])
+if args.action == "hadd":
+    completed_files = []
+    datasets = output_datasets()
 
     for (dataset, input_filenames) in datasets.items():
         output_filename = "/scratch/" + os.environ["USER"] + "/" + dataset + ".root"
@@ -78,3 +88,47 @@ if args.action == "replicate":
         raise FileError("file to-replica.txt does not exist, create it using --action=hadd")
     replicate("to-replica.txt", "T3_CH_PSI", "/store/user/jpata/tth/" + version)
     replicate("to-replica.txt", "T2_EE_Estonia", "/store/user/jpata/tth/" + version)
+
+#Merge the timing reports (see TTH.MEAnalysis.Timing) of all the jobs,
+#per dataset and in total, and compare with an earlier release
+if args.action == "timing":
+    import ROOT
+    from TTH.MEAnalysis.Timing import TimingReport
+    total = TimingReport()
+    for (dataset, input_filenames) in sorted(output_datasets().items()):
+        report = TimingReport()
+        for inf in input_filenames:
+            r = TimingReport.read(inf)
+            if r is None:
+                print "no timing report in", inf
+                continue
+            report.merge(r)
+        print "dataset", dataset, "jobs", len(input_filenames)
+        print report.table()
+        total.merge(report)
+    print "total"
+    print total.table()
+
+    output_filename = "timing_{0}.root".format(version)
+    tf = ROOT.TFile(output_filename, "RECREATE")
+    tree = total.write(tf)
+    tf.Write()
+    tf.Close()
+    print "saved", output_filename
+
+    ref = None
+    if args.timing_reference:
+        ref = TimingReport.read(args.timing_reference)
+        if ref is None:
+            print "no timing report in", args.timing_reference
+    if ref is not None:
+        print "{0:<40} {1:>14} {2:>14} {3:>8}".format("stage", "ms/call", "ref ms/call", "ratio")
+        for st in total.stages:
+            if not ref.by_name.has_key(st.name) or st.ncalls == 0:
+                continue
+            rst = ref.by_name[st.name]
+            t = 1000.0 * st.wall / st.ncalls
+            rt = 1000.0 * rst.wall / rst.ncalls if rst.ncalls > 0 else 0.0
+            print "{0:<40} {1:>14.3f} {2:>14.3f} {3:>8.2f}".format(
+                st.name, t, rt, t / rt if rt > 0 else 0.0
+            )
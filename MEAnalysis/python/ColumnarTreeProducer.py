@@ -0,0 +1,280 @@
+"""
+Output tree writer filling the branches in blocks of events.
+
+AutoFillTreeProducer writes each event into the branch buffers of its heppy
+Tree: it resets all the buffers to their defaults, evaluates the
+NTupleVariables one value at a time and calls TTree::Fill.
+
+ColumnarTreeProducer declares the same branches in the same way (the
+variables and collections of the configuration, with the same types and leaf
+lists), so the output trees are identical. The values of blockSize events
+are stored in one numpy record array, with one column per branch:
+- the values of the objects of a collection are read with one
+  operator.attrgetter per object, for the variables which return an
+  attribute (lambda x : x.pt), and kept as rows until the block is written
+- the rows of the block are transposed and set with one indexed assignment
+  per column
+- the branches point to a single record, the block is copied entry by entry
+  to the record and filled by a compiled loop (fill_block), in one call
+- a written block is reset to the defaults in one operation
+The baskets are sized to hold the entries of a block.
+
+The buffered entries are written to the tree by flush, at the end of the
+loop and before each checkpoint of MELooper.
+
+Used with Conf.general["treeWriter"] = "columnar", see metree. The writers
+are compared by test/test_tree_writers.py and timed by
+test/benchmark_tree_writers.py.
+"""
+import dis
+import operator
+import numpy as np
+import ROOT
+from PhysicsTools.Heppy.analyzers.core.AutoFillTreeProducer import AutoFillTreeProducer
+
+#Limits of the basket size of a branch in bytes
+MIN_BASKET_SIZE = 16000
+MAX_BASKET_SIZE = 1024 * 1024
+
+#Fills the tree with n records of recsize bytes from the block, the branches
+#point to the record at the address row
+FILL_BLOCK_CODE = """
+namespace tthbb {
+long fill_block(TTree* tree, Long64_t block, Long64_t row, long recsize, long n) {
+    for (long i = 0; i < n; i++) {
+        memcpy((char*)row, (char*)block + i * recsize, recsize);
+        tree->Fill();
+    }
+    return n;
+}
+}
+"""
+
+def compiled_fill_block():
+    """
+    Returns the compiled fill_block, None if the interpreter cannot declare
+    it (ROOT 5), the entries are then filled from python.
+    """
+    if not hasattr(compiled_fill_block, "func"):
+        compiled_fill_block.func = None
+        try:
+            if ROOT.gInterpreter.Declare(FILL_BLOCK_CODE):
+                compiled_fill_block.func = ROOT.tthbb.fill_block
+        except Exception as e:
+            print "ColumnarTreeProducer: filling the entries from python,", e
+    return compiled_fill_block.func
+
+def attribute_name(func):
+    """
+    Returns the attribute returned by the function of one argument if it is
+    of the form lambda x : x.attr, None otherwise.
+    """
+    code = getattr(func, "func_code", None)
+    if code is None or code.co_argcount != 1 or func.func_closure:
+        return None
+    ops = [ord(c) for c in code.co_code]
+    if len(ops) == 7 and ops[:3] == [dis.opmap["LOAD_FAST"], 0, 0] and \
+        ops[3] == dis.opmap["LOAD_ATTR"] and ops[6] == dis.opmap["RETURN_VALUE"]:
+        return code.co_names[ops[4] + 256 * ops[5]]
+    return None
+
+def values_getter(functions):
+    """
+    Returns a function of an object returning the tuple of the values of the
+    functions. If all the functions return an attribute, this is a single
+    operator.attrgetter, without calling the functions.
+    """
+    names = [attribute_name(f) for f in functions]
+    if len(names) > 1 and not None in names:
+        return operator.attrgetter(*names)
+    return lambda obj: tuple([f(obj) for f in functions])
+
+class EntryFiller(object):
+    """
+    The fill method of the heppy Tree, writing to entry i of the block,
+    used by fillCoreVariables.
+    """
+    def __init__(self, block):
+        self.block = block
+        self.i = 0
+
+    def fill(self, name, value):
+        self.block[name][self.i] = value
+
+def collection_objects(coll, objects):
+    """
+    Returns the stored objects of the NTupleCollection, as AutoFillTreeProducer.
+    """
+    if getattr(coll, "filter", None) is not None:
+        objects = [o for o in objects if coll.filter(o)]
+    if getattr(coll, "sortAscendingBy", None) is not None:
+        objects = sorted(objects, key=coll.sortAscendingBy)
+    if getattr(coll, "sortDescendingBy", None) is not None:
+        objects = sorted(objects, key=coll.sortDescendingBy, reverse=True)
+    return objects[:coll.maxlen]
+
+class ColumnGroup(object):
+    """
+    The columns of the variables of an event, global object or collection,
+    with the value rows of the buffered events.
+    """
+    def __init__(self, block, names, functions):
+        self.columns = [block[name] for name in names]
+        self.getter = values_getter(functions)
+        self.rows = []
+        #number of objects of each buffered event (collections)
+        self.counts = []
+
+    def set_rows(self, index):
+        """
+        Sets the columns at the index (array or tuple of arrays) to the rows.
+        """
+        if len(self.rows) > 0:
+            for col, values in zip(self.columns, zip(*self.rows)):
+                col[index] = values
+        self.rows = []
+        self.counts = []
+
+class ColumnarTreeProducer(AutoFillTreeProducer):
+    """
+    AutoFillTreeProducer writing blocks of events, see the module documentation.
+    Only vector trees (vectorTree = True) are supported.
+
+    blockSize (int): number of buffered events
+    """
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(ColumnarTreeProducer, self).__init__(cfg_ana, cfg_comp, looperName)
+        if not getattr(cfg_ana, "vectorTree", False):
+            raise ValueError("ColumnarTreeProducer writes only vector trees")
+        self.block_size = max(1, getattr(cfg_ana, "blockSize", 1000))
+        self.block = None
+        self.nbuffered = 0
+
+    def declareVariables(self, setup):
+        super(ColumnarTreeProducer, self).declareVariables(setup)
+        self.make_block()
+
+    def make_block(self):
+        """
+        Creates the block and the record of the branches declared in the
+        heppy Tree, and points the branches to the record.
+        """
+        tree = self.tree
+        fields = []
+        for name, arr in tree.vars.items():
+            fields += [(name, arr.dtype)]
+        for name, arr in tree.vecvars.items():
+            fields += [(name, arr.dtype, arr.shape)]
+        dtype = np.dtype(fields, align=True)
+
+        self.defaults = np.zeros(1, dtype=dtype)
+        for name in tree.vars.keys():
+            self.defaults[name] = tree.defaults[name]
+        for name in tree.vecvars.keys():
+            self.defaults[name] = tree.vecdefaults[name]
+        self.block = np.empty(self.block_size, dtype=dtype)
+        self.block[:] = self.defaults[0]
+        self.nbuffered = 0
+        self.entry = EntryFiller(self.block)
+        self.fill_block = compiled_fill_block()
+
+        self.row = np.zeros(1, dtype=dtype)
+        #contiguous views of the fields of the record, kept alive with the branches
+        self.row_views = {}
+        for name in dtype.names:
+            fdtype, offset = dtype.fields[name][:2]
+            view = np.ndarray(fdtype.shape or (1, ), fdtype.base, buffer=self.row, offset=offset)
+            self.row_views[name] = view
+            tree.tree.SetBranchAddress(name, view)
+            basket = self.block_size * fdtype.itemsize
+            tree.tree.GetBranch(name).SetBasketSize(
+                int(min(MAX_BASKET_SIZE, max(MIN_BASKET_SIZE, basket)))
+            )
+
+        #the variables with a branch, the others are not stored for this
+        #component (mcOnly)
+        def group(prefix, variables):
+            names = [prefix + v.name for v in variables if prefix + v.name in dtype.names]
+            functions = [v.function for v in variables if prefix + v.name in dtype.names]
+            if len(names) == 0:
+                return None
+            return ColumnGroup(self.block, names, functions)
+
+        isMC = self.cfg_comp.isMC
+        self.global_group = group("", self.globalVariables)
+        self.object_groups = []
+        for on, o in self.globalObjects.items():
+            g = group(o.name + "_", o.objectType.allVars(isMC))
+            if g is not None:
+                self.object_groups += [(on, g)]
+        self.collection_groups = []
+        for cn, c in self.collections.items():
+            if not "n" + c.name in dtype.names:
+                continue
+            g = group(c.name + "_", c.objectType.allVars(isMC))
+            if g is None:
+                g = ColumnGroup(self.block, [], [])
+            self.collection_groups += [(cn, c, self.block["n" + c.name], g)]
+
+    def fillTree(self, event):
+        """
+        Adds the event to the block, writes the block if it is full. The
+        entries always start from the defaults of the branches.
+        """
+        self.entry.i = self.nbuffered
+        self.fillCoreVariables(self.entry, event, self.cfg_comp.isMC)
+        #the values are read now, the objects may change with the next event
+        if self.global_group is not None:
+            self.global_group.rows.append(self.global_group.getter(event))
+        for on, g in self.object_groups:
+            g.rows.append(g.getter(getattr(event, on)))
+        for cn, c, ncol, g in self.collection_groups:
+            objs = collection_objects(c, getattr(event, cn))
+            g.counts.append(len(objs))
+            g.rows.extend(map(g.getter, objs))
+        self.nbuffered += 1
+        if self.nbuffered == self.block_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered entries to the tree.
+        """
+        if self.block is None or self.nbuffered == 0:
+            return
+        n = self.nbuffered
+        block = self.block
+        if self.global_group is not None:
+            self.global_group.set_rows(slice(0, n))
+        for on, g in self.object_groups:
+            g.set_rows(slice(0, n))
+        for cn, c, ncol, g in self.collection_groups:
+            counts = np.array(g.counts, dtype=np.int64)
+            ncol[:n] = counts
+            #(entry, position in the collection) of each object
+            entries = np.repeat(np.arange(n), counts)
+            starts = np.cumsum(counts) - counts
+            positions = np.arange(len(entries)) - np.repeat(starts, counts)
+            g.set_rows((entries, positions))
+
+        if self.fill_block is not None:
+            self.fill_block(
+                self.tree.tree, block.ctypes.data, self.row.ctypes.data,
+                block.dtype.itemsize, n
+            )
+        else:
+            ttree = self.tree.tree
+            row = self.row
+            for i in xrange(n):
+                row[0] = block[i]
+                ttree.Fill()
+        block[:n] = self.defaults[0]
+        self.nbuffered = 0
+
+    def endLoop(self, setup):
+        self.flush()
+        super(ColumnarTreeProducer, self).endLoop(setup)
+
+    def write(self, setup):
+        self.flush()
+        super(ColumnarTreeProducer, self).write(setup)
@@ -0,0 +1,143 @@
+"""
+Columnar storage of the input tree entries, see VHbbColumns.
+
+The scalar branches of a chunk of entries are numpy arrays, the collections
+(jets, leptons, ...) are flat content arrays per field plus per-event
+offsets. The analyzers get lightweight per-event views on top of these arrays.
+"""
+import numpy as np
+
+def as_column(values):
+    """
+    Converts branch values to a float64 or int64 array, such that the
+    elements behave like python floats and ints downstream.
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in "iub":
+        return arr.astype(np.int64)
+    return arr.astype(np.float64)
+
+class JaggedArray(object):
+    """
+    A jagged collection stored as a flat content array and per-event offsets.
+    Event i owns content[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, content, offsets):
+        self.content = content
+        self.offsets = offsets
+
+    @staticmethod
+    def from_counts(content, counts):
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return JaggedArray(content, offsets)
+
+    @property
+    def counts(self):
+        return np.diff(self.offsets)
+
+    @property
+    def starts(self):
+        return self.offsets[:-1]
+
+    @property
+    def stops(self):
+        return self.offsets[1:]
+
+    def local_index(self):
+        """
+        Returns the index of every content element inside its own event.
+        """
+        return np.arange(len(self.content)) - np.repeat(self.starts, self.counts)
+
+    def parents(self):
+        """
+        Returns the event index of every content element.
+        """
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.content[self.offsets[i]:self.offsets[i+1]]
+
+class Chunk(object):
+    """
+    The columns for entries [start, stop) of the input tree.
+
+    scalars (dict): branch name -> array of length stop-start
+    collections (dict): collection name -> (offsets, {field: flat content array})
+    """
+    def __init__(self, start, stop, scalars, collections):
+        self.start = start
+        self.stop = stop
+        self.scalars = scalars
+        self.collections = collections
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def contains(self, entry):
+        return self.start <= entry < self.stop
+
+    def jagged(self, collection, field):
+        """
+        Returns the field of a collection for the whole chunk as a JaggedArray.
+        """
+        offsets, fields = self.collections[collection]
+        return JaggedArray(fields[field], offsets)
+
+    def event(self, entry):
+        return EventView(self, entry - self.start)
+
+class ObjectView(object):
+    """
+    A single object (jet, lepton, ...) of a columnar collection.
+    The input fields are read from the chunk arrays, any attribute set by the
+    analyzers (e.g. btagFlag) is stored on the view itself.
+    """
+    def __init__(self, fields, index):
+        self.__dict__["_fields"] = fields
+        self.__dict__["_index"] = index
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["_fields"][name][self.__dict__["_index"]]
+        except KeyError:
+            raise AttributeError(name)
+
+class EventView(object):
+    """
+    Per-event view of a chunk. The scalar branches are available as attributes,
+    the collections via objects(name) and as the branches of the input tree,
+    e.g. nJet and Jet_pt (the jet pts of the event), such that the view can
+    replace the tree as event.input.
+    """
+    def __init__(self, chunk, index):
+        self.chunk = chunk
+        self.index = index
+
+    def __getattr__(self, name):
+        chunk = self.__dict__["chunk"]
+        index = self.__dict__["index"]
+        if chunk.scalars.has_key(name):
+            return chunk.scalars[name][index]
+        #the branches of the collections, as read from the input tree
+        if name.startswith("n") and chunk.collections.has_key(name[1:]):
+            offsets = chunk.collections[name[1:]][0]
+            return offsets[index+1] - offsets[index]
+        collection, _, field = name.partition("_")
+        if chunk.collections.has_key(collection) and chunk.collections[collection][1].has_key(field):
+            offsets, fields = chunk.collections[collection]
+            return fields[field][offsets[index]:offsets[index+1]]
+        raise AttributeError(name)
+
+    def objects(self, collection):
+        if not self.chunk.collections.has_key(collection):
+            return []
+        offsets, fields = self.chunk.collections[collection]
+        return [
+            ObjectView(fields, i)
+            for i in range(offsets[self.index], offsets[self.index+1])
+        ]
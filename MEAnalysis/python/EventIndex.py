@@ -0,0 +1,167 @@
+"""
+Index of the (run, lumi, event) numbers of the input trees.
+
+The index is built by reading only the run, lumi and evt branches of each
+file once, and maps an event id to the file and the entry in that file.
+It is used to process an event whitelist by jumping to the listed entries
+instead of reading all the events of the sample. The index stores the
+modification time and size of each file, and is rebuilt when a file changed.
+
+To build the index of a list of files, run
+python TTH/MEAnalysis/python/EventIndex.py index.npz file1.root file2.root ...
+"""
+import os
+import numpy as np
+import ROOT
+
+#root_numpy is optional, without it the branches are read entry by entry
+try:
+    from root_numpy import root2array
+except ImportError:
+    root2array = None
+
+ID_BRANCHES = ["run", "lumi", "evt"]
+
+def source_stamp(fn):
+    """
+    Returns (modification time, size) of a file, local or opened with
+    ROOT (remote files).
+    """
+    if os.path.isfile(fn):
+        st = os.stat(fn)
+        return np.array([st.st_mtime, st.st_size], dtype=np.float64)
+    tf = ROOT.TFile.Open(fn)
+    if tf == None or tf.IsZombie():
+        raise IOError("cannot open {0}".format(fn))
+    ret = np.array([tf.GetModificationDate().Convert(), tf.GetSize()], dtype=np.float64)
+    tf.Close()
+    return ret
+
+def read_ids(fn, tree_name="tree"):
+    """
+    Returns an array [nentries, 3] of (run, lumi, evt) of a file.
+    """
+    if root2array is not None:
+        arr = root2array(fn, tree_name, branches=ID_BRANCHES)
+        return np.column_stack([arr[b].astype(np.int64) for b in ID_BRANCHES])
+
+    tf = ROOT.TFile.Open(fn)
+    tt = tf.Get(tree_name)
+    tt.SetBranchStatus("*", 0)
+    for b in ID_BRANCHES:
+        tt.SetBranchStatus(b, 1)
+    ids = np.zeros((tt.GetEntries(), 3), dtype=np.int64)
+    for i in range(tt.GetEntries()):
+        tt.GetEntry(i)
+        ids[i] = (tt.run, tt.lumi, tt.evt)
+    tf.Close()
+    return ids
+
+class EventIndex(object):
+    """
+    files (list of string): the indexed files
+    ids (array [nevents, 3]): run, lumi, evt of all the entries of all the files
+    ifile (array [nevents]): index of the file of each entry in files
+    entry (array [nevents]): entry in the file
+    stamps (array [nfiles, 2]): modification time and size of the files
+    """
+    def __init__(self, files, ids, ifile, entry, stamps):
+        self.files = list(files)
+        self.ids = ids
+        self.ifile = ifile
+        self.entry = entry
+        self.stamps = stamps
+        #event id -> indices of its entries, more than one if the event is
+        #duplicated in the input
+        self.lookup = {}
+        for i, (run, lumi, evt) in enumerate(ids):
+            self.lookup.setdefault((int(run), int(lumi), int(evt)), []).append(i)
+
+    @staticmethod
+    def build(files, tree_name="tree"):
+        ids, ifile, entry, stamps = [], [], [], []
+        for i, fn in enumerate(files):
+            print "indexing", fn
+            stamps += [source_stamp(fn)]
+            fids = read_ids(fn, tree_name)
+            ids += [fids]
+            ifile += [np.full(len(fids), i, dtype=np.int64)]
+            entry += [np.arange(len(fids), dtype=np.int64)]
+        return EventIndex(files,
+            np.concatenate(ids) if len(ids) > 0 else np.zeros((0, 3), dtype=np.int64),
+            np.concatenate(ifile) if len(ifile) > 0 else np.zeros(0, dtype=np.int64),
+            np.concatenate(entry) if len(entry) > 0 else np.zeros(0, dtype=np.int64),
+            np.array(stamps, dtype=np.float64).reshape(len(files), 2),
+        )
+
+    def save(self, fn):
+        np.savez(fn, files=np.array(self.files), ids=self.ids, ifile=self.ifile,
+            entry=self.entry, stamps=self.stamps
+        )
+
+    @staticmethod
+    def load(fn):
+        """
+        Returns the saved index, None if it has no file stamps (older format).
+        """
+        d = np.load(fn)
+        if not "stamps" in d.files:
+            return None
+        return EventIndex([str(f) for f in d["files"]], d["ids"], d["ifile"], d["entry"], d["stamps"])
+
+    @staticmethod
+    def for_files(files, index_file, tree_name="tree"):
+        """
+        Loads the index from index_file if it was built for the same files,
+        with the same modification times and sizes, otherwise builds it and
+        saves it to index_file.
+        """
+        if os.path.isfile(index_file):
+            index = EventIndex.load(index_file)
+            if index is not None and index.files == list(files) and index.up_to_date():
+                return index
+            print "rebuilding the event index", index_file
+        index = EventIndex.build(files, tree_name)
+        index.save(index_file)
+        return index
+
+    def up_to_date(self):
+        """
+        True if none of the files changed since the index was built.
+        """
+        stamps = np.array([source_stamp(fn) for fn in self.files], dtype=np.float64)
+        return np.array_equal(self.stamps, stamps.reshape(len(self.files), 2))
+
+    def find(self, event_id):
+        """
+        Returns (file, entry in file) of the first entry of the event, or
+        None if not indexed.
+        """
+        idx = self.lookup.get(tuple(event_id), None)
+        if idx is None:
+            return None
+        i = idx[0]
+        return self.files[self.ifile[i]], int(self.entry[i])
+
+    def chain_entries(self, event_ids):
+        """
+        Returns the sorted entries of the events in the chain of self.files,
+        as used by the looper. Events not in the index are skipped, events
+        listed more than once are processed once, all the entries of an
+        event duplicated in the input are processed.
+        """
+        ret = set([])
+        for event_id in event_ids:
+            idx = self.lookup.get(tuple(event_id), None)
+            if idx is None:
+                print "event {0} not found in the index".format(event_id)
+                continue
+            #the entries are indexed in the order of the files, as in the chain
+            ret.update(idx)
+        return sorted(ret)
+
+if __name__ == "__main__":
+    import sys
+    index = EventIndex.build(sys.argv[2:])
+    index.save(sys.argv[1])
+    print "indexed {0} events in {1} files".format(len(index.ids), len(index.files))
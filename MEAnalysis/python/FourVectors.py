@@ -0,0 +1,99 @@
+"""
+Arrays of four-vectors stored as numpy arrays of px, py, pz, E.
+
+Replaces the creation of a ROOT.TLorentzVector per jet, lepton or MET in the
+analyzers. The arithmetic follows TLorentzVector.
+"""
+import numpy as np
+
+def cartesian(pt, eta, phi, mass):
+    """
+    Returns px, py, pz, E as TLorentzVector::SetPtEtaPhiM.
+    """
+    pt, eta, phi, mass = [np.asarray(x, dtype=np.float64) for x in [pt, eta, phi, mass]]
+    px = pt * np.cos(phi)
+    py = pt * np.sin(phi)
+    pz = pt * np.sinh(eta)
+    p2 = px*px + py*py + pz*pz
+    E = np.where(mass >= 0, np.sqrt(p2 + mass*mass), np.sqrt(np.maximum(p2 - mass*mass, 0.0)))
+    return px, py, pz, E
+
+def invariant_mass(px, py, pz, E):
+    """
+    Returns the invariant mass as TLorentzVector::M, negative if m^2 < 0.
+    """
+    m2 = E*E - (px*px + py*py + pz*pz)
+    return np.where(m2 < 0.0, -np.sqrt(np.abs(m2)), np.sqrt(np.abs(m2)))
+
+class FourVectorArray(object):
+    """
+    A struct of arrays px, py, pz, E, with the derived quantities computed
+    on all the vectors at once.
+    """
+    def __init__(self, px, py, pz, E):
+        self.px = np.asarray(px, dtype=np.float64)
+        self.py = np.asarray(py, dtype=np.float64)
+        self.pz = np.asarray(pz, dtype=np.float64)
+        self.E = np.asarray(E, dtype=np.float64)
+
+    @staticmethod
+    def from_ptetaphim(pt, eta, phi, mass):
+        return FourVectorArray(*cartesian(pt, eta, phi, mass))
+
+    @staticmethod
+    def from_objects(objs, fields=("pt", "eta", "phi", "mass")):
+        """
+        Creates the vectors from a list of objects with pt, eta, phi, mass
+        attributes (or the attributes given in fields, e.g. mcPt, mcEta, ...).
+        """
+        return FourVectorArray.from_ptetaphim(*[
+            [getattr(o, f) for o in objs] for f in fields
+        ])
+
+    def __len__(self):
+        return len(self.px)
+
+    def __getitem__(self, idx):
+        return FourVectorArray(self.px[idx], self.py[idx], self.pz[idx], self.E[idx])
+
+    def __add__(self, other):
+        return FourVectorArray(
+            self.px + other.px, self.py + other.py,
+            self.pz + other.pz, self.E + other.E
+        )
+
+    @property
+    def pt(self):
+        return np.sqrt(self.px*self.px + self.py*self.py)
+
+    @property
+    def p(self):
+        return np.sqrt(self.px*self.px + self.py*self.py + self.pz*self.pz)
+
+    @property
+    def eta(self):
+        """
+        Pseudorapidity as TVector3::PseudoRapidity, +-10e10 along the beam.
+        """
+        pt = self.pt
+        with np.errstate(divide="ignore", invalid="ignore"):
+            eta = np.arcsinh(self.pz / pt)
+        return np.where(pt > 0, eta, np.where(self.pz == 0, 0.0, np.sign(self.pz) * 10e10))
+
+    @property
+    def phi(self):
+        return np.arctan2(self.py, self.px)
+
+    @property
+    def mass2(self):
+        return self.E*self.E - (self.px*self.px + self.py*self.py + self.pz*self.pz)
+
+    @property
+    def mass(self):
+        return invariant_mass(self.px, self.py, self.pz, self.E)
+
+    def sum(self):
+        """
+        Returns the total four-vector as a FourVectorArray of length 1.
+        """
+        return FourVectorArray([self.px.sum()], [self.py.sum()], [self.pz.sum()], [self.E.sum()])
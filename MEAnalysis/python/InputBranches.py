@@ -0,0 +1,105 @@
+"""
+Declared input branches of the analyzers.
+
+An analyzer declares what it reads from the input tree with a method
+inputs(self), returning (collections, scalars):
+    collections (dict): collection name -> list of object fields, read from
+        the branches n<collection> and <collection>_<field>
+    scalars (list): per-event branches, e.g. run, met_pt
+Analyzers which cannot be changed (e.g. the heppy tree producer) may declare
+the same as input_collections, input_scalars in their cfg.Analyzer.
+
+The event builders (VHbbTree.EventAnalyzer, VHbbColumns.ColumnarEventAnalyzer)
+get the union of the declarations with set_inputs(collections, scalars) and
+build only the declared fields, and the looper reads only these branches.
+The disabled branches of a tree keep the value of the last entry in which
+they were read, so the looper gives the analyzers the tree wrapped in a
+DeclaredInput, on which reading a disabled branch raises AttributeError.
+"""
+
+def analyzer_inputs(analyzer):
+    """
+    Returns the (collections, scalars) declared by an analyzer, None if it
+    does not declare its inputs.
+    """
+    if hasattr(analyzer, "inputs"):
+        return analyzer.inputs()
+    cfg_ana = getattr(analyzer, "cfg_ana", None)
+    if hasattr(cfg_ana, "input_collections") or hasattr(cfg_ana, "input_scalars"):
+        return (
+            getattr(cfg_ana, "input_collections", {}),
+            getattr(cfg_ana, "input_scalars", [])
+        )
+    return None
+
+def merge(inputs):
+    """
+    Returns the union of a list of (collections, scalars).
+    """
+    collections = {}
+    scalars = set([])
+    for (colls, scals) in inputs:
+        for name, fields in colls.items():
+            collections[name] = collections.get(name, set([])) | set(fields)
+        scalars |= set(scals)
+    return (
+        {name: sorted(fields) for (name, fields) in collections.items()},
+        sorted(scalars)
+    )
+
+def branch_names(collections, scalars):
+    brs = list(scalars)
+    for name, fields in collections.items():
+        brs += ["n" + name]
+        brs += ["{0}_{1}".format(name, f) for f in fields]
+    return sorted(set(brs))
+
+def activate(tree, branches):
+    """
+    Disables all the branches of the tree except the given ones which exist.
+    Returns the list of the enabled branches.
+    """
+    available = set([b.GetName() for b in tree.GetListOfBranches()])
+    tree.SetBranchStatus("*", 0)
+    enabled = [b for b in branches if b in available]
+    for b in enabled:
+        tree.SetBranchStatus(b, 1)
+    return enabled
+
+class DeclaredInput(object):
+    """
+    The input tree, on which the branches which are not enabled raise
+    AttributeError instead of returning a stale value. All the other
+    attributes are those of the tree.
+    """
+    def __init__(self, tree, enabled):
+        self.__dict__["_tree"] = tree
+        self.__dict__["_disabled"] = set(
+            [b.GetName() for b in tree.GetListOfBranches()]
+        ) - set(enabled)
+
+    def __getattr__(self, name):
+        if name in self.__dict__["_disabled"]:
+            raise AttributeError(
+                "input branch {0} is not declared by any analyzer".format(name)
+            )
+        return getattr(self.__dict__["_tree"], name)
+
+class DeclaredEvents(object):
+    """
+    Wraps the events of the looper (heppy Chain), such that each entry is
+    returned as the DeclaredInput of the tree.
+    """
+    def __init__(self, events, enabled):
+        self.events = events
+        self.input = DeclaredInput(getattr(events, "chain", events), enabled)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __getitem__(self, iEv):
+        self.events[iEv]
+        return self.input
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["events"], name)
@@ -58,6 +58,9 @@ class Conf:
             "pt": 30,
             "eta": 2.5,
 
+            #The minimum number of jets passing the pt, eta cuts
+            "minJets": 4,
+
             #The default b-tagging algorithm (branch name)
             "btagAlgo": "btagCSV",
 
@@ -74,7 +77,24 @@ class Conf:
 
             #if btagCSV, untagged/tagged selection for W mass and MEM is done by CSVM cut
             #if btagLR, selection is done by the btag likelihood ratio permutation
-            "untaggedSelection": "btagCSV"
+            "untaggedSelection": "btagCSV",
+
+            #The CSV PDFs (TTH.MEAnalysis.btag_pdfs) used for the b-tag likelihood ratio:
+            #old, new_eta_1bin or new_pt_eta_bin_3d
+            "btagPDFKind": "new_eta_1bin",
+
+            #If True, the likelihood ratios with the old and new_pt_eta_bin_3d PDFs
+            #are also computed (btag_LR_4b_2b_old, btag_LR_4b_2b_alt), otherwise these are 0
+            "btagPDFValidation": False,
+
+            #The size of the shifts of the systematic variations (Conf.general["systematics"]):
+            #JES: relative jet energy scale, JER: relative change of the difference
+            #to the generated jet, CSV: absolute shift of the b-tagging discriminators
+            "systematicShifts": {
+                "JES": 0.03,
+                "JER": 0.1,
+                "CSV": 0.05,
+            },
         }
 
         self.general = {
@@ -90,12 +110,66 @@ class Conf:
             #"verbosity": ["eventboundary", "input", "matching", "gen", "reco"],
             "verbosity": [],
 
-            #Process only these events (will scan through file to find)
+            #Read the input branches in chunks of this many events into numpy arrays
+            #(TTH.MEAnalysis.VHbbColumns). If 0, the per-object VHbbTree classes are used.
+            "chunkSize": 0,
+
+            #Save the output tree and the counters every checkpointEvents entries or
+            #checkpointMinutes minutes (0 disables), such that a job which is
+            #restarted in the same directory resumes after the last saved entry.
+            #Only the output trees, counters and timing are restored, see MELooper.
+            #The grid-control jobs keep the checkpoint in ME_CHECKPOINT_DIR.
+            "checkpointEvents": 0,
+            "checkpointMinutes": 0,
+
+            #Read only the input branches declared by the analyzers (inputs()),
+            #all the others are disabled with SetBranchStatus and raise
+            #AttributeError when read from event.input
+            "activeBranchesOnly": False,
+
+            #Sample the memory growth of each analyzer every this many events and
+            #write memory.txt to the output directory (TTH.MEAnalysis.Memory), 0 disables
+            "memoryReportEvents": 0,
+
+            #Systematic variations of the jets, processed in the same pass as the nominal,
+            #out of JESUp, JESDown, JERUp, JERDown, CSVUp, CSVDown (TTH.MEAnalysis.systematics).
+            #The outputs are stored with the suffix _<variation>, the MEM is integrated only
+            #if the jet assignment or the category differs from the nominal.
+            #Only in the "full" workflow.
+            "systematics": [],
+
+            #"full": selection and MEM in one pass
+            #"skim": selection only, writes tree.root without the MEM and skim.root
+            #   with the events with cat_btag == "H" and the MEM inputs
+            #"mem": MEM only, on the skims in skimFiles (formatted with the sample name),
+            #   the results are attached to tree.root by mem_join.py
+            #see TTH.MEAnalysis.Skim
+            "workflow": "full",
+            "skimFiles": "Loop_{0}/skim.root",
+
+            #Submit the MEM integrations of this many events before waiting for the
+            #first one, such that the worker pool or the MEM server integrates
+            #several events at the same time, see MELooper
+            "pipelineEvents": 1,
+
+            #The writer of the output trees, "autofill" (AutoFillTreeProducer) or
+            #"columnar" (TTH.MEAnalysis.ColumnarTreeProducer, buffering treeBlockSize
+            #events in numpy arrays), the trees are the same
+            "treeWriter": "autofill",
+            "treeBlockSize": 1000,
+
+            #The events are preselected if any of these trigger bits (input branches) is set,
+            #if empty, no trigger is required
+            "triggerBits": [],
+
+            #Process only these events, the entries are found using the index of
+            #(run, lumi, event) in eventIndexFile, built on the first use
             #"eventWhitelist": [
             #    (1, 1201, 120035),
             #    #(1, 626, 62574),
             #    #(1, 180, 17914)
-            #]
+            #],
+            #"eventIndexFile": "eventindex_{0}.npz",
         }
 
         self.mem = {
@@ -105,6 +179,54 @@ class Conf:
             "calcME": True,
             #"calcME": False,
 
+            #Where the MEM integrations are run:
+            #"local": in this process, or in a pool of nWorkers processes
+            #"server": in the MEM server of the user (python MEMServer.py), listening
+            #   on serverSocket, which queues the integrations of all the jobs
+            #"stub": deterministic outputs without integration, for tests
+            "backend": "local",
+            #None: in a directory of $TMPDIR accessible only to the user
+            "serverSocket": None,
+            #The key shared by the server and the jobs, readable only by the user.
+            #None: ~/.tthbb13_mem_key, the environment variable TTHBB13_MEM_KEY overrides it
+            "serverKeyFile": None,
+
+            #Number of worker processes running the MEM integrations of an event.
+            #Each worker holds its own integrator, if 1 the MEM is run in-process.
+            "nWorkers": 1,
+
+            #sqlite file caching the MEM results by a hash of the integrator inputs,
+            #such that re-processing the same events skips the integration.
+            #Remove the file if the MEMConfig settings are changed. None disables the cache.
+            "cacheFile": None,
+
+            #Maximum number of cached results, the least recently used ones are removed
+            "cacheMaxEntries": 1000000,
+
+            #Adaptive number of integration points: integrate with startFactor times the
+            #points of the MEMConfig, then multiply the points by step while the
+            #tth/(tth + weight*ttbb) discriminant is not known to the target precision
+            #and the relative errors of tth and ttbb are above it, up to maxFactor.
+            #The points used are stored as mem_*_calls.
+            "adaptive": {
+                "enabled": False,
+                "startFactor": 0.25,
+                "step": 2.0,
+                "maxFactor": 2.0,
+                "precision": 0.05,
+                "weight": 0.02,
+            },
+
+            #Pass to the MEM only the jet-quark assignments compatible with these
+            #H (bb), W (qq) and top (bqq) mass windows, see TTH.MEAnalysis.permutations.
+            #The number of removed assignments is stored as mem_*_nperm_pruned.
+            "permutationPruning": {
+                "enabled": False,
+                "higgs": (50.0, 200.0),
+                "W": (60.0, 100.0),
+                "top": (100.0, 250.0),
+            },
+
             #Which categories to analyze the matrix element in
             "MECategories": ["cat1", "cat2", "cat3", "cat6"],
             #"MECategories": ["cat1"],
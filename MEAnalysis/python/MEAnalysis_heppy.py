@@ -1,58 +1,68 @@
 #!/usr/bin/env python
 import os
-import PhysicsTools.HeppyCore.framework.config as cfg
-import ROOT
+import sys
+import glob
 import imp
 
-import itertools
-
-#pickle and transfer function classes to load transfer functions 
-import cPickle as pickle
-import TTH.MEAnalysis.TFClasses as TFClasses
+#With --startup-profile, the import and initialisation times are reported
+#at the end of the job, see TTH.MEAnalysis.Startup
+from TTH.MEAnalysis import Startup
+Startup.start(sys.argv)
 
-#Import the default list of samples
-from TTH.MEAnalysis.samples_vhbb import samples, sample_version, lfn_to_pfn
+import PhysicsTools.HeppyCore.framework.config as cfg
 
 #Create configuration object based on environment variables
 #if one runs with ME_CONF=/path/to/conffile.py, then the configuration is loaded from that file
 #otherwise, the default config is used
-if os.environ.has_key("ME_CONF"):
-    print "Loading ME config from", os.environ["ME_CONF"]
-    meconf = imp.load_source("meconf", os.environ["ME_CONF"])
-    from meconf import Conf
-else:
-    print "Loading ME config from TTH.MEAnalysis.MEAnalysis_cfg_heppy"
-    from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+with Startup.stage("configuration"):
+    if os.environ.has_key("ME_CONF"):
+        print "Loading ME config from", os.environ["ME_CONF"]
+        meconf = imp.load_source("meconf", os.environ["ME_CONF"])
+        from meconf import Conf
+    else:
+        print "Loading ME config from TTH.MEAnalysis.MEAnalysis_cfg_heppy"
+        from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
 
-#Creates a new configuration object based on MEAnalysis_cfg_heppy
-conf = Conf()
+    #Creates a new configuration object based on MEAnalysis_cfg_heppy
+    conf = Conf()
+
+#The transfer functions are loaded by the first analyzer which uses them,
+#see TFClasses.load_tf_matrix
 
-#Load transfer functions from pickle file
-pi_file = open(conf.general["transferFunctionsPickle"] , 'rb')
-conf.tf_matrix = pickle.load(pi_file)
-pi_file.close()
-    
 #Load the input sample dictionary
 #Samples are configured in the Conf object, by default, we use samples_vhbb
-print "loading samples from", conf.general["sampleFile"]
-samplefile = imp.load_source("samplefile", conf.general["sampleFile"])
-from samplefile import samples_dict
-
-#input component
-#several input components can be declared,
-#and added to the list of selected components
-inputSamples = []
-for sn in sorted(samples_dict.keys()):
-    s = samples_dict[sn]
-    inputSample = cfg.Component(
-        s.nickName.value(),
-        files = map(lfn_to_pfn, s.subFiles.value()),
-        tree_name = "tree"
-    )
-    inputSample.isMC = s.isMC.value()
-    inputSample.perJob = s.perJob.value()
-    #use sample only if not skipped and subFiles defined
-    if s.skip.value() == False and len(s.subFiles.value())>0:
+#if one runs with ME_SAMPLE=nickName, only this sample is configured, also if it is skipped
+selected_sample = os.environ.get("ME_SAMPLE", None)
+with Startup.stage("samples"):
+    from TTH.MEAnalysis.samples_base import lfn_to_pfn
+    print "loading samples from", conf.general["sampleFile"]
+    samplefile = imp.load_source("samplefile", conf.general["sampleFile"])
+    from samplefile import samples_dict
+
+    selected_samples = []
+    for sn in sorted(samples_dict.keys()):
+        s = samples_dict[sn]
+        if selected_sample is not None:
+            if s.nickName.value() == selected_sample:
+                selected_samples += [s]
+        #use sample only if not skipped and subFiles defined
+        elif s.skip.value() == False and len(s.subFiles.value())>0:
+            selected_samples += [s]
+    if selected_sample is not None and len(selected_samples) == 0:
+        raise ValueError("sample {0} not found in {1}".format(selected_sample, conf.general["sampleFile"]))
+
+    #input component
+    #several input components can be declared,
+    #and added to the list of selected components
+    inputSamples = []
+    for s in selected_samples:
+        inputSample = cfg.Component(
+            s.nickName.value(),
+            files = map(lfn_to_pfn, s.subFiles.value()),
+            tree_name = "tree"
+        )
+        inputSample.isMC = s.isMC.value()
+        inputSample.perJob = s.perJob.value()
         inputSamples.append(inputSample)
 
 print "Processing samples", inputSamples
@@ -62,10 +72,20 @@ print "Processing samples", inputSamples
 from TTH.MEAnalysis.VHbbTree import *
 
 #This analyzer reads branches from event.input (the TTree/TChain) to event.XYZ (XYZ is e.g. jets, leptons etc)
-evs = cfg.Analyzer(
-    EventAnalyzer,
-    'events',
-)
+#If chunkSize is set, the branches are read in chunks into numpy arrays instead of
+#constructing the VHbbTree objects field by field
+if conf.general.get("chunkSize", 0) > 0:
+    from TTH.MEAnalysis.VHbbColumns import ColumnarEventAnalyzer
+    evs = cfg.Analyzer(
+        ColumnarEventAnalyzer,
+        'events',
+        chunkSize = conf.general["chunkSize"]
+    )
+else:
+    evs = cfg.Analyzer(
+        EventAnalyzer,
+        'events',
+    )
 
 #Here we define all the main analyzers
 import TTH.MEAnalysis.MECoreAnalyzers as MECoreAnalyzers
@@ -77,6 +97,13 @@ evtid_filter = cfg.Analyzer(
     _conf = conf
 )
 
+#Rejects events using the input branches, before the event objects are created
+presel = cfg.Analyzer(
+    MECoreAnalyzers.PreselectionAnalyzer,
+    'presel',
+    _conf = conf
+)
+
 #This class performs lepton selection and SL/DL disambiguation
 leps = cfg.Analyzer(
     MECoreAnalyzers.LeptonAnalyzer,
@@ -134,13 +161,22 @@ gentth = cfg.Analyzer(
     _conf = conf
 )
 
-from TTH.MEAnalysis.metree import getTreeProducer
-treeProducer = getTreeProducer(conf)
+#The workflow, see TTH.MEAnalysis.Skim:
+#"full": selection and MEM in one pass
+#"skim": selection only, the events to integrate are written to skim.root
+#"mem": MEM only, on the skims of the "skim" pass
+workflow = conf.general.get("workflow", "full")
+#the skim does not contain the variations of the jets
+if workflow != "full" and len(conf.general.get("systematics", [])) > 0:
+    raise ValueError("systematics are only processed in the full workflow, not in {0}".format(workflow))
 
-# definition of a sequence of analyzers,
-# the analyzers will process each event in this order
-sequence = cfg.Sequence([
+from TTH.MEAnalysis.metree import getTreeProducer, getSkimTreeProducer, getMEMTreeProducer
+treeProducer = getTreeProducer(conf, mem = (workflow == "full"))
+
+#the analyzers up to the MEM
+selection = [
     evtid_filter,
+    presel,
     evs,
     leps,
     jets,
@@ -149,9 +185,11 @@ sequence = cfg.Sequence([
     wtag,
     mecat,
     gentth,
-    mem_analyzer,
-    treeProducer
-])
+]
+#The columnar reader replaces event.input by the chunk view, it runs first
+if conf.general.get("chunkSize", 0) > 0:
+    selection.remove(evs)
+    selection.insert(0, evs)
 
 #Book the output file
 from PhysicsTools.HeppyCore.framework.services.tfile import TFileService
@@ -162,6 +200,48 @@ output_service = cfg.Service(
     fname='tree.root',
     option='recreate'
 )
+output_services = [output_service]
+
+# definition of a sequence of analyzers,
+# the analyzers will process each event in this order
+if workflow == "full":
+    sequence = cfg.Sequence(selection + [
+        mem_analyzer,
+        treeProducer
+    ])
+elif workflow == "skim":
+    from TTH.MEAnalysis.Skim import SkimFilterAnalyzer
+    skim_filter = cfg.Analyzer(
+        SkimFilterAnalyzer,
+        'skim',
+        _conf = conf
+    )
+    sequence = cfg.Sequence(selection + [
+        treeProducer,
+        skim_filter,
+        getSkimTreeProducer(conf)
+    ])
+    output_services += [cfg.Service(
+        TFileService,
+        'skimfile',
+        name="skimfile",
+        fname='skim.root',
+        option='recreate'
+    )]
+elif workflow == "mem":
+    from TTH.MEAnalysis.Skim import SkimEventAnalyzer
+    skim_evs = cfg.Analyzer(
+        SkimEventAnalyzer,
+        'events'
+    )
+    sequence = cfg.Sequence([
+        evtid_filter,
+        skim_evs,
+        mem_analyzer,
+        getMEMTreeProducer(conf)
+    ])
+else:
+    raise ValueError("unknown workflow: {0}".format(workflow))
 
 #finalization of the configuration object.
 from PhysicsTools.HeppyCore.framework.chain import Chain as Events
@@ -173,7 +253,7 @@ config = cfg.Config(
     sequence = sequence,
 
     #save output to these services
-    services = [output_service],
+    services = output_services,
 
     #This defines how events are loaded
     events_class = Events
@@ -186,6 +266,13 @@ if __name__ == "__main__":
     for samp in inputSamples:
         
         print "processing sample ", samp
+        loop_name = 'Loop_'+samp.name
+        if workflow == "mem":
+            #the skims written by the "skim" pass of this sample
+            samp.files = sorted(glob.glob(
+                conf.general.get("skimFiles", "Loop_{0}/skim.root").format(samp.name)
+            ))
+            loop_name = 'MEM_'+samp.name
         config = cfg.Config(
             #Run across these inputs
             components = [samp],
@@ -194,27 +281,44 @@ if __name__ == "__main__":
             sequence = sequence,
 
             #save output to these services
-            services = [output_service],
+            services = output_services,
 
             #This defines how events are loaded
             events_class = Events
         )
         
         #Configure the number of events to run
-        from PhysicsTools.HeppyCore.framework.looper import Looper
+        from TTH.MEAnalysis.MELooper import MELooper
         nEvents = samp.perJob
 
         
         kwargs = {}
-        if conf.general.get("eventWhitelist", None) is None:
-            kwargs["nEvents"] = nEvents
+        kwargs["nEvents"] = nEvents
         kwargs["firstEvent"] = conf.general.get("firstEvent", 0)
-        looper = Looper(
-            'Loop_'+samp.name,
-            config,
-            nPrint = 0,
-            **kwargs
-        )
+
+        #Process only the whitelisted events, found using the (run, lumi, event) index
+        if conf.general.get("eventWhitelist", None) is not None:
+            with Startup.stage("event index"):
+                from TTH.MEAnalysis.EventIndex import EventIndex
+                index = EventIndex.for_files(
+                    samp.files,
+                    conf.general.get("eventIndexFile", "eventindex_{0}.npz").format(samp.name)
+                )
+                kwargs["entries"] = index.chain_entries(conf.general["eventWhitelist"])
+
+        #resumes from the checkpoint in Loop_<sample> if the job was interrupted
+        with Startup.stage("looper " + samp.name):
+            looper = MELooper(
+                loop_name,
+                config,
+                nPrint = 0,
+                checkpointEvents = conf.general.get("checkpointEvents", 0),
+                checkpointMinutes = conf.general.get("checkpointMinutes", 0),
+                activeBranchesOnly = conf.general.get("activeBranchesOnly", False),
+                memoryReportEvents = conf.general.get("memoryReportEvents", 0),
+                pipelineEvents = conf.general.get("pipelineEvents", 1),
+                **kwargs
+            )
 
         #execute the code
         looper.loop()
@@ -222,6 +326,8 @@ if __name__ == "__main__":
         #write the output
         looper.write()
 
+    Startup.report()
+
     #print summaries
     # for analyzer in looper.analyzers:
     #     print analyzer.name, "counters = {\n", analyzer.counters, "}"
@@ -4,35 +4,31 @@ from PhysicsTools.HeppyCore.framework.analyzer import Analyzer
 import copy
 import math
 from TTH.MEAnalysis.VHbbTree import *
+from TTH.MEAnalysis.TFClasses import TFRegistry, load_tf_matrix
+from TTH.MEAnalysis import Startup
+import TTH.MEAnalysis.btag_likelihood as btag_likelihood
+import TTH.MEAnalysis.btag_pdfs as btag_pdfs
+import TTH.MEAnalysis.wmass as wmass
+import TTH.MEAnalysis.matching as matching
+import TTH.MEAnalysis.lepton_selection as lepton_selection
+import TTH.MEAnalysis.permutations as permutations
+import TTH.MEAnalysis.systematics as systematics
+from TTH.MEAnalysis.FourVectors import FourVectorArray
+from TTH.MEAnalysis.btag_pdfs import CSVPDFs
 
-#Load the MEM integrator libraries
-# ROOT.gSystem.Load("libFWCoreFWLite")
-# ROOT.gROOT.ProcessLine('AutoLibraryLoader::enable();')
-# ROOT.gSystem.Load("libFWCoreFWLite")
-ROOT.gSystem.Load("libCintex")
-ROOT.gROOT.ProcessLine('ROOT::Cintex::Cintex::Enable();')
-ROOT.gSystem.Load("libTTHMEIntegratorStandalone")
+#The MEM integrator library (loaded on the first use) and the integration runners
+from TTH.MEAnalysis.MEMIntegrator import MEM, MEMTask, MEMResult, build_mem_configs, make_runner, scaled_calls
+from TTH.MEAnalysis.MEMCache import MEMCache, CachedRunner
 
-from ROOT import MEM
-o = MEM.MEMOutput
-
-#Pre-define shorthands for permutation and integration variable vectors
-CvectorPermutations = getattr(ROOT, "std::vector<MEM::Permutations::Permutations>")
-CvectorPSVar = getattr(ROOT, "std::vector<MEM::PSVar::PSVar>")
-
-def lvec(self):
-    """
-    Converts an object with pt, eta, phi, mass to a TLorentzVector
-    """
-    lv = ROOT.TLorentzVector()
-    lv.SetPtEtaPhiM(self.pt, self.eta, self.phi, self.mass)
-    return lv
 
 
 class FilterAnalyzer(Analyzer):
     """
     A generic analyzer that may filter events.
     Counts events the number of processed and passing events.
+
+    The branches of the input tree which are read by an analyzer are declared
+    in inputs(), see InputBranches.
     """
     def beginLoop(self, setup):
         super(FilterAnalyzer, self).beginLoop(setup)
@@ -49,6 +45,9 @@ class EventIDFilterAnalyzer(FilterAnalyzer):
         self.conf = cfg_ana._conf
         self.event_whitelist = self.conf.general.get("eventWhitelist", None)
 
+    def inputs(self):
+        return {}, ["run", "lumi", "evt"]
+
     def beginLoop(self, setup):
         super(EventIDFilterAnalyzer, self).beginLoop(setup)
 
@@ -68,6 +67,69 @@ class EventIDFilterAnalyzer(FilterAnalyzer):
             self.counters["processing"].inc("passes")
         return passes
 
+class PreselectionAnalyzer(FilterAnalyzer):
+    """
+    Rejects events directly from the branches of the input tree, before the
+    event objects are constructed by VHbbTree.EventAnalyzer.
+
+    The requirements are necessary conditions of the selections done later,
+    derived from the same configuration:
+    - at least one lepton passing the loosest pt and eta cuts in Conf.leptons
+    - at least Conf.jets["minJets"] jets passing the pt and eta cuts in Conf.jets
+    - any of the trigger bits in Conf.general["triggerBits"], if given
+    """
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(PreselectionAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.conf = cfg_ana._conf
+
+        cuts = [
+            self.conf.leptons[l][a]
+            for l in ["mu", "el"] for a in ["tight", "loose"]
+        ]
+        self.lepton_pt = min([c["pt"] for c in cuts])
+        self.lepton_eta = max([c["eta"] for c in cuts])
+        self.jet_pt = self.conf.jets["pt"]
+        self.jet_eta = self.conf.jets["eta"]
+        self.min_jets = self.conf.jets.get("minJets", 4)
+        self.trigger_bits = self.conf.general.get("triggerBits", [])
+
+    def inputs(self):
+        return {
+            "selLeptons": ["pt", "eta"],
+            "Jet": ["pt", "eta"],
+        }, list(self.trigger_bits)
+
+    def beginLoop(self, setup):
+        super(PreselectionAnalyzer, self).beginLoop(setup)
+        for c in ["trigger", "leptons", "jets"]:
+            self.counters["processing"].register(c)
+
+    def count(self, tree, collection, ptcut, etacut):
+        n = getattr(tree, "n" + collection)
+        pt = getattr(tree, collection + "_pt")
+        eta = getattr(tree, collection + "_eta")
+        return sum([1 for i in range(n) if pt[i] > ptcut and abs(eta[i]) < etacut])
+
+    def process(self, event):
+        self.counters["processing"].inc("processed")
+        tree = event.input
+
+        if len(self.trigger_bits) > 0:
+            if not any([getattr(tree, b) for b in self.trigger_bits]):
+                return False
+        self.counters["processing"].inc("trigger")
+
+        if tree.nselLeptons < 1 or self.count(tree, "selLeptons", self.lepton_pt, self.lepton_eta) < 1:
+            return False
+        self.counters["processing"].inc("leptons")
+
+        if tree.nJet < self.min_jets or self.count(tree, "Jet", self.jet_pt, self.jet_eta) < self.min_jets:
+            return False
+        self.counters["processing"].inc("jets")
+
+        self.counters["processing"].inc("passes")
+        return True
+
 class LeptonAnalyzer(FilterAnalyzer):
     """
     Analyzes leptons and applies single-lepton and di-lepton selection.
@@ -78,15 +140,28 @@ class LeptonAnalyzer(FilterAnalyzer):
     Conf.leptons[channel][cuttype] where channel=mu,ele, cuttype=tight,loose,(+veto)
     the lepton cuts must specify pt, eta and isolation cuts.
 
+    The selections are evaluated as masks over the lepton arrays, once per
+    chunk if the inputs are read by VHbbColumns.ColumnarEventAnalyzer,
+    see TTH.MEAnalysis.lepton_selection.
+
     Returns:
     event.good_leptons (list of VHbbTree.selLeptons): contains the leptons that pass the SL XOR DL selection.
-        Leptons are ordered by flavour and pt.
+        Leptons are ordered by flavour, in the input order.
     event.is_sl, is_dl (bool): specifies if the event passes SL or DL selection.
-
+    event.lepton_selection (lepton_selection.LeptonSelection): the leptons passing
+        each selection, e.g. event.lepton_selection.mu_tight, created on access
+    event.n_<selection>, event.n_lep_<cuttype> (int): the number of leptons passing
+        each selection, e.g. n_mu_tight, n_lep_loose_veto
     """
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(LeptonAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.conf = cfg_ana._conf
+        self.fields = lepton_selection.fields_needed(self.conf.leptons)
+        self.chunk = None
+
+    def inputs(self):
+        fields = ["phi", "mass"] + self.fields
+        return {"selLeptons": fields}, []
 
     def beginLoop(self, setup):
         super(LeptonAnalyzer, self).beginLoop(setup)
@@ -97,74 +172,53 @@ class LeptonAnalyzer(FilterAnalyzer):
 
         self.counters.addCounter("leptons")
         self.counters["leptons"].register("any")
-        for l in ["mu", "el"]:
-            for a in ["tight", "loose"]:
-                for b in ["", "_veto"]:
-                    lt = l + "_" + a + b
-                    self.counters["leptons"].register(lt)
+        for lt in lepton_selection.SELECTIONS:
+            self.counters["leptons"].register(lt)
+
+    def event_masks(self, event):
+        """
+        Returns the selection masks over event.selLeptons.
+        """
+        cols = getattr(event, "columns", None)
+        if cols is None or not cols.chunk.collections.has_key("selLeptons"):
+            fields = {f: [getattr(x, f) for x in event.selLeptons] for f in self.fields}
+            return lepton_selection.selection_masks(self.conf.leptons, fields)
+
+        #The masks of all the leptons in the chunk are computed at once
+        if not cols.chunk is self.chunk:
+            offsets, content = cols.chunk.collections["selLeptons"]
+            self.chunk = cols.chunk
+            self.chunk_offsets = offsets
+            self.chunk_masks = lepton_selection.selection_masks(self.conf.leptons, content)
+        start = self.chunk_offsets[cols.index]
+        stop = self.chunk_offsets[cols.index + 1]
+        return {k: m[start:stop] for (k, m) in self.chunk_masks.items()}
 
     def process(self, event):
         self.counters["processing"].inc("processed")
         self.counters["leptons"].inc("any", len(event.selLeptons))
 
-        event.mu = filter(
-            lambda x: abs(x.pdgId) == 13,
-            event.selLeptons,
-        )
-        event.el = filter(
-            lambda x: abs(x.pdgId) == 11,
-            event.selLeptons,
-        )
+        sel = lepton_selection.LeptonSelection(event.selLeptons, self.event_masks(event))
+        event.lepton_selection = sel
 
+        for lt in lepton_selection.SELECTIONS:
+            setattr(event, "n_" + lt, sel.counts[lt])
+            self.counters["leptons"].inc(lt, sel.counts[lt])
         for a in ["tight", "loose"]:
             for b in ["", "_veto"]:
-                sumleps = []
-                for l in ["mu", "el"]:
-                    lepcuts = self.conf.leptons[l][a+b]
-                    incoll = getattr(event, l)
-
-                    leps = filter(
-                        lambda x: (
-                            x.pt > lepcuts["pt"]
-                            and abs(x.eta) < lepcuts["eta"]
-                            and abs(getattr(x, self.conf.leptons[l]["isotype"])) < lepcuts["iso"]
-                        ), incoll
-                    )
-
-                    if b == "_veto":
-                        good = getattr(event, "{0}_{1}".format(l, a))
-                        leps = filter(lambda x: x not in good, leps)
-
-                    if a == "tight":
-                        leps = filter(
-                            lambda x: x.tightId,
-                            leps
-                        )
-                    elif a == "loose":
-                        leps = filter(
-                            lambda x: x.looseIdPOG,
-                            leps
-                        )
-                    lep = sorted(leps, key=lambda x: x.pt, reverse=True)
-                    sumleps += leps
-                    lt = l + "_" + a + b
-                    setattr(event, lt, leps)
-                    setattr(event, "n_"+lt, len(leps))
-                    self.counters["leptons"].inc(lt, len(leps))
-
-                setattr(event, "lep_{0}".format(a+b), sumleps)
-                setattr(event, "n_lep_{0}".format(a+b), len(sumleps))
-
+                setattr(event, "n_lep_{0}".format(a+b),
+                    sel.counts["mu_" + a + b] + sel.counts["el_" + a + b]
+                )
 
         event.is_sl = (event.n_lep_tight == 1 and event.n_lep_tight_veto == 0)
         event.is_dl = (event.n_lep_loose == 2 and event.n_lep_loose_veto == 0)
 
         if event.is_sl:
             self.counters["processing"].inc("sl")
-            event.good_leptons = event.mu_tight + event.el_tight
+            event.good_leptons = sel.mu_tight + sel.el_tight
         if event.is_dl:
             self.counters["processing"].inc("dl")
-            event.good_leptons = event.mu_loose + event.el_loose
+            event.good_leptons = sel.mu_loose + sel.el_loose
 
         passes = event.is_sl or event.is_dl
         if event.is_sl and event.is_dl:
@@ -181,11 +235,26 @@ class LeptonAnalyzer(FilterAnalyzer):
 class JetAnalyzer(FilterAnalyzer):
     """
     Performs jet selection and b-tag counting.
-    FIXME: doc
+
+    The selection is repeated for each systematic variation of
+    Conf.general["systematics"] on a view of the event with shifted jets,
+    event.variations[name] (see TTH.MEAnalysis.systematics).
+    The event passes if the nominal selection passes.
     """
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(JetAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.conf = cfg_ana._conf
+        self.variation_names = self.conf.general.get("systematics", [])
+        #the b-tagging discriminators shifted in the CSV variations
+        self.btag_algos = sorted(set(
+            [self.conf.jets["btagAlgo"]] +
+            [algo for (algo, wp) in self.conf.jets["btagWPs"].values()]
+        ))
+
+    def inputs(self):
+        fields = ["pt", "eta", "phi", "mass", "mcFlavour", "mcPt", "mcEta", "mcPhi", "mcM"]
+        fields += self.btag_algos
+        return {"Jet": fields}, []
 
     def beginLoop(self, setup):
         super(JetAnalyzer, self).beginLoop(setup)
@@ -195,11 +264,60 @@ class JetAnalyzer(FilterAnalyzer):
         for (btag_wp_name, btag_wp) in self.conf.jets["btagWPs"].items():
             self.counters["jets"].register(btag_wp_name)
 
+        #The transfer functions are loaded on the first event, see get_tf_registry
+        self.tf_registry = None
+
+    def met_correction(self, jets):
+        """
+        Returns the sums over the jets of (Erec - Egen) * px/p and * py/p,
+        added to the MET for met_jetcorr.
+        """
+        #four-vectors of the jets at reco and gen level
+        Prec = FourVectorArray.from_objects(jets)
+        Pgen = FourVectorArray.from_objects(jets, ("mcPt", "mcEta", "mcPhi", "mcM"))
+        dE = Prec.E - Pgen.E
+        return float((dE * Prec.px / Prec.p).sum()), float((dE * Prec.py / Prec.p).sum())
+
+    def get_tf_registry(self):
+        """
+        Returns the transfer functions and CDFs, compiled once for all jets
+        on the first call. The CDF threshold is set to the jet pt cut.
+        """
+        if self.tf_registry is None:
+            self.tf_registry = TFRegistry(load_tf_matrix(self.conf), self.conf.jets["pt"])
+        return self.tf_registry
 
     def process(self, event):
         self.counters["processing"].inc("processed")
         self.counters["jets"].inc("any", len(event.Jet))
 
+        #the jets are identified by their index in the variations
+        for i, jet in enumerate(event.Jet):
+            jet.jet_index = i
+
+        passes = self.select(event)
+        if passes:
+            self.counters["processing"].inc("passes")
+        self.counters["jets"].inc("good", len(event.good_jets))
+        for btag_wp_name in self.conf.jets["btagWPs"].keys():
+            self.counters["jets"].inc(btag_wp_name, getattr(event, "nB"+btag_wp_name))
+
+        event.variation_names = self.variation_names
+        event.variations = {}
+        for name in self.variation_names:
+            ev = systematics.VariedEvent(event, name)
+            ev.Jet = systematics.vary_jets(
+                event.Jet, name, self.conf.jets["systematicShifts"], self.btag_algos
+            )
+            ev.passes_jets = self.select(ev)
+            event.variations[name] = ev
+        return passes
+
+    def select(self, event):
+        """
+        Selects the jets of the event (or of a systematic variation) and
+        counts the b-tagged jets. Returns True if the event has enough jets.
+        """
         #pt-descending input jets
         if "input" in self.conf.general["verbosity"]:
             for j in event.Jet:
@@ -217,26 +335,21 @@ class JetAnalyzer(FilterAnalyzer):
 
 
         #Assing jet transfer functions
+        #The TF1 objects are shared between all jets, they are built once
+        tf_registry = self.get_tf_registry()
         for jet in event.good_jets:
-            jet_eta_bin = 0
-            if abs(jet.eta)>1.0:
-                jet_eta_bin = 1
+            jet.tf_eta_bin = TFRegistry.Eta_Bin(jet.eta)
 
             #If True, TF [0] - reco, x - gen
             #If False, TF [0] - gen, x - reco
             eval_gen = False
-            jet.tf_b = self.conf.tf_matrix['b'][jet_eta_bin].Make_Formula(eval_gen)
-            jet.tf_l = self.conf.tf_matrix['l'][jet_eta_bin].Make_Formula(eval_gen)
+            jet.tf_b = tf_registry.Get_TF('b', jet.tf_eta_bin, eval_gen)
+            jet.tf_l = tf_registry.Get_TF('l', jet.tf_eta_bin, eval_gen)
             #If [0] - gen, x - pt cutoff
-            jet.tf_b_lost = self.conf.tf_matrix['b'][jet_eta_bin].Make_CDF()
-            jet.tf_l_lost = self.conf.tf_matrix['l'][jet_eta_bin].Make_CDF()
-
-            #Set jet pt threshold for CDF
-            jet.tf_b_lost.SetParameter(0, self.conf.jets["pt"])
-            jet.tf_l_lost.SetParameter(0, self.conf.jets["pt"])
+            jet.tf_b_lost = tf_registry.Get_CDF('b', jet.tf_eta_bin)
+            jet.tf_l_lost = tf_registry.Get_CDF('l', jet.tf_eta_bin)
 
         event.numJets = len(event.good_jets)
-        self.counters["jets"].inc("good", len(event.good_jets))
 
         event.btagged_jets_bdisc = {}
         event.buntagged_jets_bdisc = {}
@@ -250,9 +363,6 @@ class JetAnalyzer(FilterAnalyzer):
                 lambda x: getattr(x, algo) <= wp,
                 event.good_jets
             )
-            self.counters["jets"].inc(btag_wp_name,
-                len(event.btagged_jets_bdisc[btag_wp_name])
-            )
             setattr(event, "nB"+btag_wp_name, len(event.btagged_jets_bdisc[btag_wp_name]))
 
         #Find jets that pass/fail the specified default b-tagging algo/working point
@@ -265,26 +375,12 @@ class JetAnalyzer(FilterAnalyzer):
             if abs(j.mcFlavour) == 5:
                 event.n_tagwp_tagged_true_bjets += 1
 
-        #Require at least 4 good jets in order to continue analysis
-        passes = len(event.good_jets) >= 4
-        if passes:
-            self.counters["processing"].inc("passes")
+        #Require at least Conf.jets["minJets"] good jets in order to continue analysis
+        passes = len(event.good_jets) >= self.conf.jets.get("minJets", 4)
 
         corrMet_px = event.met[0].px
         corrMet_py = event.met[0].py
-        sum_dEx = 0
-        sum_dEy = 0
-        for jet in event.good_jets:
-            Prec = lvec(jet)
-            Pgen = lvec(jet)
-            Pgen.SetPtEtaPhiM(jet.mcPt, jet.mcEta, jet.mcPhi, jet.mcM)
-            Erec = Prec.E()
-            Egen = Pgen.E()
-            dEx = (Erec-Egen) * Prec.Px()/Prec.P()
-            dEy = (Erec-Egen) * Prec.Py()/Prec.P()
-            #print Erec, Egen
-            sum_dEx += dEx
-            sum_dEy += dEy
+        sum_dEx, sum_dEy = self.met_correction(event.good_jets)
         corrMet_px += sum_dEx
         corrMet_py += sum_dEy
         #print (sum_dEx, sum_dEy), (corrMet_px, event.met[0].px), (corrMet_py, event.met[0].py)
@@ -296,113 +392,76 @@ class JetAnalyzer(FilterAnalyzer):
 
 class BTagLRAnalyzer(FilterAnalyzer):
     """
-    Performs b-tag likelihood ratio calculations
-    FIXME: doc
+    Performs b-tag likelihood ratio calculations with the CSV PDFs of
+    Conf.jets["btagPDFKind"]. The validation PDF kinds are only evaluated
+    if Conf.jets["btagPDFValidation"] is set.
     """
+    #PDF kind -> suffix of the likelihood ratios stored for validation
+    validation_kinds = {"old": "_old", "new_pt_eta_bin_3d": "_alt"}
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(BTagLRAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.conf = cfg_ana._conf
         self.bTagAlgo = self.conf.jets["btagAlgo"]
-        self.cplots_old = ROOT.TFile(self.conf.general["controlPlotsFileOld"])
-        self.cplots = ROOT.TFile(self.conf.general["controlPlotsFile"])
-
-        cplots_fmt = self.conf.general.get("controlPlotsFormat", "8tev")
-        self.csv_pdfs_old = {
-        }
-        for x in ["b", "c", "l"]:
-            for b in ["Bin0", "Bin1"]:
-                self.csv_pdfs_old[(x, b)] = self.cplots_old.Get(
-                    "csv_{0}_{1}__csv_rec".format(x, b)
-                )
-
-        self.csv_pdfs = {
-        }
-        for x in ["b", "c", "l"]:
-            for b in ["Bin0", "Bin1"]:
-                self.csv_pdfs[(x, b)] = self.cplots.Get(
-                    "csv_{0}_{1}__csv_rec".format(x, b)
-                )
-                self.csv_pdfs[(x, b)].Scale(1.0 / self.csv_pdfs[(x, b)].Integral())
-            self.csv_pdfs[(x, "pt_eta")] = self.cplots.Get(
-                "csv_{0}_pt_eta".format(x)
-            )
-            self.csv_pdfs[(x, "pt_eta")].Scale(1.0 / self.csv_pdfs[(x, "pt_eta")].Integral())
+        self.pdf_kind = self.conf.jets.get("btagPDFKind", "new_eta_1bin")
+        self.pdf_kinds = [self.pdf_kind]
+        if self.conf.jets.get("btagPDFValidation", False):
+            self.pdf_kinds += [k for k in sorted(self.validation_kinds.keys()) if k != self.pdf_kind]
+
+        #CSV PDFs as numpy lookup tables, read from the snapshots next to the
+        #control plot files (converted from the ROOT files if needed)
+        self.csv_pdfs = CSVPDFs.load(
+            self.conf.general["controlPlotsFileOld"],
+            self.conf.general["controlPlotsFile"]
+        )
 
     def get_pdf_prob(self, flavour, pt, eta, csv, kind):
+        ifl = btag_pdfs.FLAVOURS.index(flavour)
+        return self.csv_pdfs.probs(kind, [pt], [eta], [csv])[0, ifl]
 
-        _bin = "Bin1" if abs(eta)>1.0 else "Bin0"
-
-        if kind == "old":
-            h = self.csv_pdfs_old[(flavour, _bin)]
-        elif kind == "new_eta_1bin":
-            h = self.csv_pdfs[(flavour, _bin)]
-        elif kind == "new_pt_eta_bin_3d":
-            h = self.csv_pdfs[(flavour, "pt_eta")]
-
-        assert h != None, "flavour={0} kind={1}".format(flavour, kind)
-
-        if csv < 0:
-            csv = 0.0
-        if csv > 1.0:
-            csv = 1.0
-
-        if kind == "old" or kind == "new_eta_1bin":
-            nb = h.FindBin(csv)
-            #if csv = 1 -> goes into overflow and pdf = 0.0
-            #as a solution, take the next-to-last bin
-            if nb >= h.GetNbinsX():
-                nb = nb - 1
-            ret = h.GetBinContent(nb)
-        elif kind == "new_pt_eta_bin_3d":
-            nb = h.FindBin(pt, abs(eta), csv)
-            ret = h.GetBinContent(nb)
-        return ret
+    def inputs(self):
+        return {"Jet": ["pt", "eta", "mcFlavour", self.bTagAlgo]}, []
 
     def beginLoop(self, setup):
         super(BTagLRAnalyzer, self).beginLoop(setup)
 
     def evaluate_jet_prob(self, pt, eta, csv, kind):
-        return (
-            self.get_pdf_prob("b", pt, eta, csv, kind),
-            self.get_pdf_prob("c", pt, eta, csv, kind),
-            self.get_pdf_prob("l", pt, eta, csv, kind)
+        return tuple(self.csv_pdfs.probs(kind, [pt], [eta], [csv])[0])
+
+    def evaluate_jet_probs(self, jets, kind):
+        """
+        Returns the list of (b, c, l) PDF values for all the jets at once.
+        """
+        probs = self.csv_pdfs.probs(
+            kind,
+            [j.pt for j in jets],
+            [j.eta for j in jets],
+            [getattr(j, self.bTagAlgo) for j in jets]
         )
+        return [tuple(p) for p in probs]
 
     def btag_likelihood(self, probs, nB, nC):
-
-        perms = itertools.permutations(range(len(probs)))
-
-        P = 0.0
-        max_p = -1.0
-        nperms = 0
-        best_perm = None
-
-        np = len(probs)
-        for perm in perms:
-            p = 1.0
-
-            for i in range(0, nB):
-                p *= probs[perm[i]][0]
-            for i in range(nB, min(nB + nC, np)):
-                p *= probs[perm[i]][1]
-            for i in range(nB + nC, np):
-                p *= probs[perm[i]][2]
-
-            #print nperms, p, perm, max_p, best_perm
-            if p > max_p:
-                best_perm = perm
-                max_p = p
-
-            P += p
-            nperms += 1
-        P = P / float(nperms)
-        assert nperms > 0
-        return P, best_perm
-        #end permutation loop
+        """
+        Returns the b-tag likelihood averaged over the jet-flavour assignments
+        and the best permutation, see TTH.MEAnalysis.btag_likelihood.
+        """
+        return btag_likelihood.likelihood(probs, nB, nC)
 
     def process(self, event):
         self.counters["processing"].inc("processed")
-
+        self.compute(event, self.pdf_kinds)
+        #the validation PDFs are only evaluated for the nominal jets
+        for name, ev in systematics.variations(event):
+            if ev.passes_jets:
+                self.compute(ev, [self.pdf_kind])
+        self.counters["processing"].inc("passes")
+        return True
+
+    def compute(self, event, pdf_kinds):
+        """
+        Computes the b-tag likelihood ratios of the event (or of a systematic
+        variation) with the given PDF kinds and selects the b-tagged jets.
+        """
         #Take first 6 most b-tagged jets for btag LR
         jets_for_btag_lr = sorted(
             event.good_jets,
@@ -410,40 +469,22 @@ class BTagLRAnalyzer(FilterAnalyzer):
             reverse=True,
         )[0:6]
 
+        #Only the configured PDF kinds are evaluated
         jet_probs = {
-            kind: [
-                self.evaluate_jet_prob(j.pt, j.eta, getattr(j, self.bTagAlgo), kind)
-                for j in jets_for_btag_lr
-            ]
-            for kind in [
-            "old", "new_eta_1bin",
-            "new_pt_eta_bin_3d"
-            ]
+            kind: self.evaluate_jet_probs(jets_for_btag_lr, kind)
+            for kind in pdf_kinds
         }
 
-        # for nj, j in enumerate(jets_for_btag_lr):
-        #     print j.btagCSV, j.mcFlavour, jet_probs["old"][nj], jet_probs["new_eta_1bin"][nj], jet_probs["new_pt_eta_bin_3d"][nj]
-        #
-        jet_csvs = [
-            getattr(j, self.bTagAlgo)
-            for j in event.good_jets
-        ]
-
         ph = None
         best_4b_perm = 0
         best_2b_perm = 0
-        event.btag_lr_4b_old, ph = self.btag_likelihood(jet_probs["old"], 4, 0)
-        event.btag_lr_2b_old, v = self.btag_likelihood(jet_probs["old"], 2, 0)
-
-        event.btag_lr_4b, best_4b_perm = self.btag_likelihood(jet_probs["new_eta_1bin"], 4, 0)
-        event.btag_lr_4b_1c, ph = self.btag_likelihood(jet_probs["new_eta_1bin"], 4, 1)
-        event.btag_lr_2b_2c, ph = self.btag_likelihood(jet_probs["new_eta_1bin"], 2, 2)
-
-        event.btag_lr_2b, best_2b_perm = self.btag_likelihood(jet_probs["new_eta_1bin"], 2, 1)
-        event.btag_lr_2b_1c, best_2b_perm = self.btag_likelihood(jet_probs["new_eta_1bin"], 2, 1)
+        probs = jet_probs[self.pdf_kind]
+        event.btag_lr_4b, best_4b_perm = self.btag_likelihood(probs, 4, 0)
+        event.btag_lr_4b_1c, ph = self.btag_likelihood(probs, 4, 1)
+        event.btag_lr_2b_2c, ph = self.btag_likelihood(probs, 2, 2)
 
-        event.btag_lr_4b_alt, best_4b_perm_alt = self.btag_likelihood(jet_probs["new_pt_eta_bin_3d"], 4, 0)
-        event.btag_lr_2b_alt, best_2b_perm_alt = self.btag_likelihood(jet_probs["new_pt_eta_bin_3d"], 2, 0)
+        event.btag_lr_2b, best_2b_perm = self.btag_likelihood(probs, 2, 1)
+        event.btag_lr_2b_1c = event.btag_lr_2b
 
         def lratio(l1, l2):
             if l1+l2>0:
@@ -451,10 +492,17 @@ class BTagLRAnalyzer(FilterAnalyzer):
             else:
                 return 0.0
 
-        event.btag_LR_4b_2b_old = lratio(event.btag_lr_4b_old, event.btag_lr_2b_old)
         event.btag_LR_4b_2b = lratio(event.btag_lr_4b, event.btag_lr_2b)
-        event.btag_LR_4b_2b_alt = lratio(event.btag_lr_4b_alt, event.btag_lr_2b_alt)
-        #event.btag_LR_4b_2b_alt = 0
+
+        #The likelihood ratios of the validation kinds, 0 if not computed
+        for kind, suffix in self.validation_kinds.items():
+            lr_4b, lr_2b = 0.0, 0.0
+            if jet_probs.has_key(kind):
+                lr_4b, ph = self.btag_likelihood(jet_probs[kind], 4, 0)
+                lr_2b, ph = self.btag_likelihood(jet_probs[kind], 2, 0)
+            setattr(event, "btag_lr_4b" + suffix, lr_4b)
+            setattr(event, "btag_lr_2b" + suffix, lr_2b)
+            setattr(event, "btag_LR_4b_2b" + suffix, lratio(lr_4b, lr_2b))
 
         event.buntagged_jets_by_LR_4b_2b = [jets_for_btag_lr[i] for i in best_4b_perm[4:]]
         event.btagged_jets_by_LR_4b_2b = [jets_for_btag_lr[i] for i in best_4b_perm[0:4]]
@@ -479,12 +527,6 @@ class BTagLRAnalyzer(FilterAnalyzer):
             idx = event.good_jets.index(jet)
             event.good_jets[idx].btagFlag = 1.0
 
-        passes = True
-        if passes:
-            self.counters["processing"].inc("passes")
-
-        return passes
-
 class MECategoryAnalyzer(FilterAnalyzer):
     """
     Performs ME categorization
@@ -496,6 +538,9 @@ class MECategoryAnalyzer(FilterAnalyzer):
         self.cat_map = {"NOCAT":-1, "cat1": 1, "cat2": 2, "cat3": 3, "cat6":6}
         self.btag_cat_map = {"NOCAT":-1, "L": 0, "H": 1}
 
+    def inputs(self):
+        return {}, []
+
     def beginLoop(self, setup):
         super(MECategoryAnalyzer, self).beginLoop(setup)
 
@@ -504,7 +549,27 @@ class MECategoryAnalyzer(FilterAnalyzer):
 
     def process(self, event):
         self.counters["processing"].inc("processed")
+        cat = self.categorize(event)
+        self.counters["processing"].inc(cat)
+        for name, ev in systematics.variations(event):
+            if ev.passes_jets:
+                self.categorize(ev)
+            else:
+                self.set_category(ev, "NOCAT", "NOCAT")
+        self.counters["processing"].inc("passes")
+        return True
 
+    def set_category(self, event, cat, cat_btag):
+        event.cat = cat
+        event.cat_btag = cat_btag
+        event.catn = self.cat_map.get(cat, -1)
+        event.cat_btag_n = self.btag_cat_map.get(cat_btag, -1)
+
+    def categorize(self, event):
+        """
+        Sets the ME category of the event (or of a systematic variation),
+        returns it.
+        """
         cat = "NOCAT"
         pass_btag_lr = (self.conf.jets["untaggedSelection"] == "btagLR" and
             event.btag_LR_4b_2b > self.conf.mem["btagLRCut"][event.cat]
@@ -535,16 +600,8 @@ class MECategoryAnalyzer(FilterAnalyzer):
             event.wquark_candidate_jets = []
             cat = "cat6"
 
-        self.counters["processing"].inc(cat)
-        event.cat = cat
-        event.cat_btag = cat_btag
-        event.catn = self.cat_map.get(cat, -1)
-        event.cat_btag_n = self.btag_cat_map.get(cat_btag, -1)
-
-        passes = True
-        if passes:
-            self.counters["processing"].inc("passes")
-        return passes
+        self.set_category(event, cat, cat_btag)
+        return cat
 
 class WTagAnalyzer(FilterAnalyzer):
     """
@@ -557,45 +614,37 @@ class WTagAnalyzer(FilterAnalyzer):
         self.conf = cfg_ana._conf
         super(WTagAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
 
+    def inputs(self):
+        return {"Jet": ["pt", "eta", "phi", "mass"]}, []
+
     def beginLoop(self, setup):
         super(WTagAnalyzer, self).beginLoop(setup)
 
-    def pair_mass(self, j1, j2):
-        """
-        Calculates the invariant mass of a two-particle system.
-        """
-        lv1, lv2 = [lvec(j) for j in [j1, j2]]
-        tot = lv1 + lv2
-        return tot.M()
-
     def find_best_pair(self, jets):
         """
         Finds the pair of jets whose invariant mass is closest to mW=80 GeV.
         Returns the sorted vector of [(mass, jet1, jet2)], best first.
         """
-        ms = []
-
-        #Keep track of index pairs already calculated
-        done_pairs = set([])
-
-        #Double loop over all jets
-        for i in range(len(jets)):
-            for j in range(len(jets)):
-
-                #Make sure we haven't calculated this index pair yet
-                if (i,j) not in done_pairs and i!=j:
-                    m = self.pair_mass(jets[i], jets[j])
-                    ms += [(m, jets[i], jets[j])]
-
-                    #M(i,j) is symmetric, hence add both pairs
-                    done_pairs.add((i,j))
-                    done_pairs.add((j,i))
-        ms = sorted(ms, key=lambda x: abs(x[0] - 80.0))
-        return ms
+        i, j, m = wmass.pair_masses(
+            [x.pt for x in jets], [x.eta for x in jets],
+            [x.phi for x in jets], [x.mass for x in jets]
+        )
+        return [(float(m[k]), jets[i[k]], jets[j[k]]) for k in wmass.sort_pairs(m)]
 
     def process(self, event):
         self.counters["processing"].inc("processed")
-
+        self.find_candidates(event)
+        for name, ev in systematics.variations(event):
+            if ev.passes_jets:
+                self.find_candidates(ev)
+        self.counters["processing"].inc("passes")
+        return True
+
+    def find_candidates(self, event):
+        """
+        Computes the W mass and the W-quark candidate jets of the event (or of
+        a systematic variation).
+        """
         event.Wmass = 0.0
 
         #we keep a set of the Q quark candidate jets
@@ -603,33 +652,27 @@ class WTagAnalyzer(FilterAnalyzer):
 
         #Need at least 2 untagged jets to calculate W mass
         if len(event.buntagged_jets)>=2:
-            bpair = self.find_best_pair(event.buntagged_jets)
+            pairs = self.find_best_pair(event.buntagged_jets)
 
-            #Get the best mass
-            event.Wmass = bpair[0][0]
+            #All masses, best first
+            event.Wmasses = [m for (m, j1, j2) in pairs]
 
-            #All masses
-            event.Wmasses = [bpair[i][0] for i in range(len(bpair))]
+            #Get the best mass
+            event.Wmass = event.Wmasses[0]
 
             #Add at most 2 best pairs two W quark candidates
-            for i in range(min(len(bpair), 2)):
-                event.wquark_candidate_jets.add(bpair[i][1])
-                event.wquark_candidate_jets.add(bpair[i][2])
+            for (m, j1, j2) in pairs[:2]:
+                event.wquark_candidate_jets.add(j1)
+                event.wquark_candidate_jets.add(j2)
 
             if "reco" in self.conf.general["verbosity"]:
-                print "Wmass", event.Wmass, event.good_jets.index(bpair[1]), event.good_jets.index(bpair[2])
+                print "Wmass", event.Wmass, event.good_jets.index(pairs[0][1]), event.good_jets.index(pairs[0][2])
 
         #If we can't calculate W mass, untagged jets become the candidate
         else:
             for jet in event.buntagged_jets:
                 event.wquark_candidate_jets.add(jet)
 
-
-        passes = True
-        if passes:
-            self.counters["processing"].inc("passes")
-        return passes
-
 class GenRadiationModeAnalyzer(FilterAnalyzer):
     """
     Performs B/C counting in order to classify heavy flavour / light flavour events.
@@ -644,6 +687,12 @@ class GenRadiationModeAnalyzer(FilterAnalyzer):
         self.conf = cfg_ana._conf
         super(GenRadiationModeAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
 
+    def inputs(self):
+        return {
+            "Jet": ["pt", "eta", "mcFlavour"],
+            "GenBQuarkFromTop": ["eta", "phi"],
+        }, []
+
     def beginLoop(self, setup):
         super(GenRadiationModeAnalyzer, self).beginLoop(setup)
 
@@ -652,12 +701,15 @@ class GenRadiationModeAnalyzer(FilterAnalyzer):
 
         event.nMatchSimB = 0
         event.nMatchSimC = 0
-        lv_bs = map(lvec, event.GenBQuarkFromTop)
-        for jet in event.good_jets:
-            lv_j = lvec(jet)
 
-            if (lv_j.Pt() > 20 and abs(lv_j.Eta()) < 2.5):
-                if any([lv_b.DeltaR(lv_j) < 0.5 for lv_b in lv_bs]):
+        #index of the closest b quark from top within dR < 0.5 for each jet, -1 if none
+        match_idx, match_dr = matching.match_objects(
+            event.good_jets, event.GenBQuarkFromTop, 0.5
+        )
+        for jet, ib in zip(event.good_jets, match_idx):
+
+            if (jet.pt > 20 and abs(jet.eta) < 2.5):
+                if ib >= 0:
                     continue
                 absid = abs(jet.mcFlavour)
                 if absid == 5:
@@ -677,6 +729,13 @@ class GenTTHAnalyzer(FilterAnalyzer):
         self.conf = cfg_ana._conf
         super(GenTTHAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
 
+    def inputs(self):
+        fields = ["pt", "eta", "phi", "mass", "pdgId"]
+        return {
+            "GenWZQuark": fields, "GenBQuarkFromTop": fields, "GenBQuarkFromH": fields,
+            "GenLepFromTop": fields, "GenNuFromTop": fields,
+        }, []
+
     def beginLoop(self, setup):
         super(GenTTHAnalyzer, self).beginLoop(setup)
 
@@ -713,23 +772,17 @@ class GenTTHAnalyzer(FilterAnalyzer):
             event.n_cat_gen = 2
 
         #Get the total MET from the neutrinos
-        spx = 0
-        spy = 0
-        for nu in event.nu_top:
-            p4 = lvec(nu)
-            spx += p4.Px()
-            spy += p4.Py()
+        p4 = FourVectorArray.from_objects(event.nu_top)
+        spx = float(p4.px.sum())
+        spy = float(p4.py.sum())
         event.tt_met = [MET(px=spx, py=spy)]
 
 
         #Get the total ttH visible pt at gen level
-        spx = 0
-        spy = 0
-        for p in (event.l_quarks_w + event.b_quarks_t +
-            event.b_quarks_h + event.lep_top):
-            p4 = lvec(p)
-            spx += p4.Px()
-            spy += p4.Py()
+        p4 = FourVectorArray.from_objects(event.l_quarks_w + event.b_quarks_t +
+            event.b_quarks_h + event.lep_top)
+        spx = float(p4.px.sum())
+        spy = float(p4.py.sum())
         event.tth_px_gen = spx
         event.tth_py_gen = spy
         
@@ -753,25 +806,25 @@ class GenTTHAnalyzer(FilterAnalyzer):
             print "gen cat", event.cat_gen, event.n_cat_gen
 
         #Store for each jet, specified by it's index in the jet
-        #vector, if it is matched to any gen-level quarks
+        #vector, if it is matched to any gen-level quarks.
+        #Each jet is matched to the closest quark within dR < 0.3 among
+        #the quarks from W, top and higgs, all matched at once.
         matched_pairs = {}
-
-        def match_jets_to_quarks(jetcoll, quarkcoll, label, label_numeric):
-            for ij, j in enumerate(jetcoll):
-                for iq, q in enumerate(quarkcoll):
-                    l1 = lvec(q)
-                    l2 = lvec(j)
-                    dr = l1.DeltaR(l2)
-                    if dr < 0.3:
-                        if matched_pairs.has_key(ij):
-                            if matched_pairs[ij][1] > dr:
-                                matched_pairs[ij] = (label, iq, dr, label_numeric)
-                        else:
-                            matched_pairs[ij] = (label, iq, dr, label_numeric)
-        #print "GEN", len(event.GenWZQuark), len(event.GenBQuarkFromTop), len(event.GenBQuarkFromH)
-        match_jets_to_quarks(event.good_jets, event.l_quarks_w, "wq", 0)
-        match_jets_to_quarks(event.good_jets, event.b_quarks_t, "tb", 1)
-        match_jets_to_quarks(event.good_jets, event.b_quarks_h, "hb", 2)
+        quark_colls = [
+            ("wq", 0, event.l_quarks_w),
+            ("tb", 1, event.b_quarks_t),
+            ("hb", 2, event.b_quarks_h),
+        ]
+        quarks = []
+        quark_labels = []
+        for (label, label_numeric, quarkcoll) in quark_colls:
+            quarks += quarkcoll
+            quark_labels += [(label, iq, label_numeric) for iq in range(len(quarkcoll))]
+        match_idx, match_dr = matching.match_objects(event.good_jets, quarks, 0.3)
+        for ij in range(len(event.good_jets)):
+            if match_idx[ij] >= 0:
+                label, iq, label_numeric = quark_labels[match_idx[ij]]
+                matched_pairs[ij] = (label, iq, float(match_dr[ij]), label_numeric)
 
         #Number of reco jets matched to quarks from W, top, higgs
         event.nMatch_wq = 0
@@ -822,28 +875,19 @@ class GenTTHAnalyzer(FilterAnalyzer):
             for ij, jet in enumerate(event.good_jets):
                 if not matched_pairs.has_key(ij):
                     continue
-                mlabel, midx, mdr = matched_pairs[ij]
+                mlabel, midx, mdr, mlabel_num = matched_pairs[ij]
                 print "jet match", ij, mlabel, midx, mdr, jet.pt, matches[mlabel][midx].pt
 
         #reco-level tth-matched system
-        spx = 0.0
-        spy = 0.0
-        for jet in event.good_jets:
-            if not (jet.tth_match_label is None):
-                p4 = lvec(jet)
-                spx += p4.Px()
-                spy += p4.Py()
-        for lep in event.good_leptons:
-            p4 = lvec(lep)
-            match = False
-            for glep in event.lep_top:
-                p4g = lvec(glep)
-                if p4g.DeltaR(p4) < 0.3:
-                    match = True
-                    break
-            if match:
-                spx += p4.Px()
-                spy += p4.Py()
+        lep_match_idx, lep_match_dr = matching.match_objects(
+            event.good_leptons, event.lep_top, 0.3
+        )
+        p4 = FourVectorArray.from_objects(
+            [jet for jet in event.good_jets if not (jet.tth_match_label is None)] +
+            [lep for (lep, il) in zip(event.good_leptons, lep_match_idx) if il >= 0]
+        )
+        spx = float(p4.px.sum())
+        spy = float(p4.py.sum())
 
         event.tth_px_reco = spx
         event.tth_py_reco = spy
@@ -877,7 +921,7 @@ class MEAnalyzer(FilterAnalyzer):
     specified in event.wquark_candidate_jets.
 
     Based on the event njet/nlep/Wtag category, if a jet fmor the W is counted as missing,
-    it is integrated over using additional variables set by self.vars_to_integrate.
+    it is integrated over using additional variables (vars_to_integrate).
 
     The MEM top pair hypothesis (di-leptonic or single leptonic top pair) is chosen based
     on the reconstructed lepton multiplicity (event.good_leptons).
@@ -886,11 +930,19 @@ class MEAnalyzer(FilterAnalyzer):
     1. check if event passes event.cat and event.cat_btag
     2. loop over all MEM configurations i=[0...Nmem)
         2a. add all 4 b-tagged jets to integrator
-        2b. add all 0-3 untagged jets to integrator
+        2b. add all 0-3 untagged jets to integrator, optionally only those in
+            an assignment compatible with the H, W and top masses
+            (Conf.mem["permutationPruning"], see TTH.MEAnalysis.permutations)
         2c. add all leptons to integrator
         2d. decide SL/DL top pair hypo based on leptons
         2e. based on event.cat, add additional integration vars
-        2f. run ME integrator for both tth and ttbb hypos
+        2f. run ME integrator for both tth and ttbb hypos, in-process,
+            in a pool of Conf.mem["nWorkers"] worker processes or in the
+            MEM server of the host (Conf.mem["backend"], see MEMServer),
+            skipping the integrations found in the Conf.mem["cacheFile"]
+            result cache. The integrations are submitted in submit() and
+            the outputs are stored in collect(), such that the looper can
+            submit several events before collecting them.
         2g. save output in event.mem_output_tth[i] (or ttbb)
         2i. clean up event in integrator
 
@@ -906,201 +958,181 @@ class MEAnalyzer(FilterAnalyzer):
         self.conf = cfg_ana._conf
         super(MEAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
 
-        self.configs = {
-            "default": MEM.MEMConfig(),
-            "MissedWQ": MEM.MEMConfig(),
-            "oldTF": MEM.MEMConfig(),
-            "NumPointsDouble": MEM.MEMConfig(),
-            "NumPointsHalf": MEM.MEMConfig(),
-            "NoJacobian": MEM.MEMConfig(),
-            "NoDecayAmpl": MEM.MEMConfig(),
-            "NoPDF": MEM.MEMConfig(),
-            "NoScattAmpl": MEM.MEMConfig(),
-            "QuarkEnergy98": MEM.MEMConfig(),
-            "QuarkEnergy10": MEM.MEMConfig(),
-            "NuPhiRestriction": MEM.MEMConfig(),
-            "JetsPtOrder": MEM.MEMConfig(),
-            "JetsPtOrderIntegrationRange": MEM.MEMConfig(),
-            "Recoil": MEM.MEMConfig(),
-            "Sudakov": MEM.MEMConfig(),
-            "Minimize": MEM.MEMConfig(),
-        }
-        for k in self.configs.keys():
-            self.configs[k].transfer_function_method = MEM.TFMethod.External
+        #The MEM configurations and the runner, created on the first event,
+        #see setup_mem
+        self.configs = None
+        self.mem_runner = None
 
         self.memkeys = self.conf.mem["methodsToRun"]
 
-        self.configs["default"].defaultCfg()
-        self.configs["oldTF"].defaultCfg()
-        self.configs["MissedWQ"].defaultCfg()
-        self.configs["NumPointsDouble"].defaultCfg(2.0)
-        self.configs["NumPointsHalf"].defaultCfg(0.5)
-        self.configs["NoJacobian"].defaultCfg()
-        self.configs["NoDecayAmpl"].defaultCfg()
-        self.configs["NoPDF"].defaultCfg()
-        self.configs["NoScattAmpl"].defaultCfg()
-        self.configs["QuarkEnergy98"].defaultCfg()
-        self.configs["QuarkEnergy10"].defaultCfg()
-        self.configs["NuPhiRestriction"].defaultCfg()
-        self.configs["JetsPtOrder"].defaultCfg()
-        self.configs["JetsPtOrderIntegrationRange"].defaultCfg()
-        self.configs["Recoil"].defaultCfg()
-        self.configs["Sudakov"].defaultCfg()
-        self.configs["Minimize"].defaultCfg()
-
-        self.configs["oldTF"].transfer_function_method = MEM.TFMethod.Builtin
-        self.configs["NoJacobian"].int_code &= ~ MEM.IntegrandType.Jacobian
-        self.configs["NoDecayAmpl"].int_code &= ~ MEM.IntegrandType.DecayAmpl
-        self.configs["NoPDF"].int_code &= ~ MEM.IntegrandType.PDF
-        self.configs["NoScattAmpl"].int_code &=  ~ MEM.IntegrandType.ScattAmpl
-        self.configs["QuarkEnergy98"].j_range_CL = 0.98
-        self.configs["QuarkEnergy98"].b_range_CL = 0.98
-        self.configs["QuarkEnergy10"].j_range_CL = 0.10
-        self.configs["QuarkEnergy10"].b_range_CL = 0.10
-        self.configs["NuPhiRestriction"].m_range_CL = 99
-        self.configs["JetsPtOrder"].highpt_first  = 0
-        self.configs["JetsPtOrderIntegrationRange"].highpt_first  = 0
-        self.configs["JetsPtOrderIntegrationRange"].j_range_CL = 0.99
-        self.configs["JetsPtOrderIntegrationRange"].b_range_CL = 0.99
-        self.configs["Recoil"].int_code |= MEM.IntegrandType.Recoil
-        self.configs["Sudakov"].int_code |= MEM.IntegrandType.Sudakov
-        self.configs["Minimize"].do_minimize = 1
-        self.configs["Minimize"].int_code = 0
-
-        for cfn, cfg in self.configs.items():
-            cfg.mem_assumptions = set([])
-            #A function Event -> boolean which returns true if this ME should be calculated
-            cfg.do_calculate = lambda x: True
-            cfg.enabled = True
-        
-        self.configs["default"].do_calculate = (
-            lambda x: len(x.wquark_candidate_jets) >= 2
-        )
-        self.configs["MissedWQ"].mem_assumptions.add("missed_wq")
-
-        #Can't integrate in dilepton
-        self.configs["MissedWQ"].do_calculate = (
-            lambda x: len(x.good_leptons) == 1 and
-            len(x.wquark_candidate_jets) >= 1
-        )
-        #only in 6J SL
-        self.configs["Sudakov"].do_calculate = (
-            lambda x: len(x.good_jets) == 6 and
-            len(x.good_leptons) == 1
-        )
-
-        #Create the ME integrator.
-        #Arguments specify the verbosity
-        self.integrator = MEM.Integrand(
-            #0,
-            MEM.output,
-            self.configs["default"]
-        )
+        #Adaptive number of integration points, see is_decided
+        self.adaptive = self.conf.mem.get("adaptive", {"enabled": False})
 
-        #Create an emtpy std::vector<MEM::Permutations::Permutations>
-        self.permutations = CvectorPermutations()
+        #Kinematic pre-selection of the jet-quark assignments, see prune_assignments
+        self.pruning = self.conf.mem.get("permutationPruning", {"enabled": False})
 
-        #Assume that only jets passing CSV>0.5 are b quarks
-        self.permutations.push_back(MEM.Permutations.BTagged)
+    def inputs(self):
+        return {
+            "Jet": ["pt", "eta", "phi", "mass"],
+            "selLeptons": ["pt", "eta", "phi", "mass", "charge"],
+        }, ["met_pt", "met_phi"]
 
-        #Assume that only jets passing CSV<0.5 are l quarks
-        self.permutations.push_back(MEM.Permutations.QUntagged)
-
-        self.integrator.set_permutation_strategy(self.permutations)
+    def beginLoop(self, setup):
+        super(MEAnalyzer, self).beginLoop(setup)
+        self.counters.addCounter("memcache")
+        self.counters["memcache"].register("hit")
+        self.counters["memcache"].register("miss")
 
-        #Pieces of ME to calculate
-        # self.integrator.set_integrand(
-        #     MEM.IntegrandType.Constant
-        #     |MEM.IntegrandType.ScattAmpl
-        #     |MEM.IntegrandType.DecayAmpl
-        #     |MEM.IntegrandType.Jacobian
-        #     |MEM.IntegrandType.PDF
-        #     |MEM.IntegrandType.Transfer
-        # )
-        #self.integrator.set_sqrts(13000.);
+    def setup_mem(self):
+        """
+        Creates the MEM configurations and the runner, such that the MEM
+        library, the transfer functions and the worker processes are loaded
+        only when the first event reaches the MEM, see Startup.
+        """
+        if self.mem_runner is not None:
+            return
+        with Startup.stage("MEM configurations and runner"):
+            #The MEM configurations, see MEMIntegrator.build_mem_configs.
+            #These are used to decide which integrations to run, the integrations
+            #themselves are done by the runner with its own set of configurations.
+            self.configs = build_mem_configs()
+
+            #Create the MEM runner of Conf.mem["backend"], see MEMIntegrator.make_runner
+            self.mem_runner = make_runner(self.conf)
+
+            #Optionally reuse the results of identical integrations from the on-disk cache
+            cache_file = self.conf.mem.get("cacheFile", None)
+            if cache_file:
+                tf_fingerprint = TFRegistry(load_tf_matrix(self.conf), self.conf.jets["pt"]).Fingerprint()
+                self.mem_runner = CachedRunner(
+                    self.mem_runner,
+                    MEMCache(cache_file, self.conf.mem.get("cacheMaxEntries", 1000000)),
+                    tf_fingerprint
+                )
 
-        #Create an empty vector for the integration variables
-        self.vars_to_integrate = CvectorPSVar()
+    def endLoop(self, setup):
+        super(MEAnalyzer, self).endLoop(setup)
+        if self.mem_runner is not None:
+            self.mem_runner.close()
 
-    def add_obj(self, objtype, **kwargs):
+    def add_timing(self, report):
         """
-        Add an event object (jet, lepton, MET) to the ME integrator.
+        Adds the time of the integrations per MEM configuration and hypothesis
+        to the Timing.TimingReport of the looper.
+        """
+        #no event reached the MEM
+        if self.mem_runner is None:
+            return
+        hypo_names = {MEM.Hypothesis.TTH: "tth", MEM.Hypothesis.TTBB: "ttbb"}
+        for (confname, hypo), (n, wall, cpu) in sorted(self.mem_runner.timing.items()):
+            report.add_stage(
+                "{0}/mem_{1}_{2}".format(self.name, hypo_names.get(hypo, hypo), confname),
+                n, wall, cpu
+            )
 
-        objtype: specifies the object type
-        kwargs: p4s: spherical 4-momentum (pt, eta, phi, M) as a tuple
-                obsdict: dict of additional observables to pass to MEM
-                tf_dict: Dictionary of MEM.TFType->TF1 of transfer functions
+    def prune_assignments(self, event, fstate, hypo, mem_cfg):
         """
-        if kwargs.has_key("p4s"):
-            pt, eta, phi, mass = kwargs.pop("p4s")
-            v = ROOT.TLorentzVector()
-            v.SetPtEtaPhiM(pt, eta, phi, mass);
-        elif kwargs.has_key("p4c"):
-            v = ROOT.TLorentzVector(*kwargs.pop("p4c"))
-        obs_dict = kwargs.pop("obs_dict", {})
-        tf_dict = kwargs.pop("tf_dict", {})
-
-        o = MEM.Object(v, objtype)
-
-        #Add observables from observable dictionary
-        for k, v in obs_dict.items():
-            o.addObs(k, v)
-        for k, v in tf_dict.items():
-            o.addTransferFunction(k, v)
-        self.integrator.push_back_object(o)
+        Returns (wquark_jets, npruned): the W-quark candidates which are in a
+        jet-quark assignment compatible with the mass windows, and the number
+        of incompatible assignments. wquark_jets is None if no assignment
+        is compatible.
+        """
+        if len(event.btagged_jets) != 4:
+            return event.wquark_candidate_jets, 0
+        p4 = lambda jets: [(j.pt, j.eta, j.phi, j.mass) for j in jets]
+        #the candidates are a set, qused are indices in this list
+        qjets = sorted(event.wquark_candidate_jets, key=lambda j: -j.pt)
+        qused, npruned, ntotal = permutations.prune(
+            p4(event.btagged_jets), p4(qjets),
+            self.pruning,
+            use_higgs = (hypo == MEM.Hypothesis.TTH),
+            #both W quarks are reconstructed only in SL without missed_wq
+            use_w = (fstate == MEM.FinalState.LH and not "missed_wq" in mem_cfg.mem_assumptions)
+        )
+        if npruned == ntotal:
+            return None, npruned
+        return [qjets[i] for i in qused], npruned
 
-    def beginLoop(self, setup):
-        super(MEAnalyzer, self).beginLoop(setup)
+    def configure_mem(self, event, mem_cfg, wquark_jets=None):
+        """
+        Collects the inputs to the integrator for this event and MEM configuration.
+        Returns (jets, leptons, met, vars_to_integrate) as plain python values,
+        as in MEMIntegrator.MEMTask.
 
-    def configure_mem(self, event, mem_cfg):
-        self.integrator.set_cfg(mem_cfg)
-        self.vars_to_integrate.clear()
-        self.integrator.next_event()
+        wquark_jets: the light jets assumed to come from the W decay,
+            event.wquark_candidate_jets if None
+        """
         mem_cfg.enabled = True
+        vars_to_integrate = []
 
         missed_wq_cat = event.cat in ["cat2", "cat3"]
         can_integrate_wq = event.cat in ["cat1", "cat2", "cat3"]
         #One quark from W missed, integrate over its direction if possible
         if "missed_wq" in mem_cfg.mem_assumptions:
             if can_integrate_wq:
-                self.vars_to_integrate.push_back(MEM.PSVar.cos_qbar1)
-                self.vars_to_integrate.push_back(MEM.PSVar.phi_qbar1)
+                vars_to_integrate += [MEM.PSVar.cos_qbar1, MEM.PSVar.phi_qbar1]
             else:
                 mem_cfg.enabled = False
+
+        jets = []
         #Add heavy flavour jets that are assumed to come from top/higgs decay
         for jet in event.btagged_jets:
-            self.add_obj(
-                MEM.ObjectType.Jet,
-                p4s=(jet.pt, jet.eta, jet.phi, jet.mass),
-                obs_dict={MEM.Observable.BTAG: jet.btagFlag},
-                tf_dict={
-                    MEM.TFType.bReco: jet.tf_b, MEM.TFType.qReco: jet.tf_l,
-                    MEM.TFType.bLost: jet.tf_b, MEM.TFType.qLost: jet.tf_l
-                }
-            )
+            jets += [(jet.pt, jet.eta, jet.phi, jet.mass, jet.btagFlag, jet.tf_eta_bin)]
+
+        #Add light jets that are assumed to come from hadronic W decay,
+        #the candidates are a set, they are added in a deterministic order
+        #such that the same event gives the same MEMTask (see MEMCache)
+        if wquark_jets is None:
+            wquark_jets = event.wquark_candidate_jets
+        for jet in sorted(wquark_jets, key=lambda j: -j.pt):
+            jets += [(jet.pt, jet.eta, jet.phi, jet.mass, jet.btagFlag, jet.tf_eta_bin)]
+
+        leptons = [
+            (lep.pt, lep.eta, lep.phi, lep.mass, lep.charge)
+            for lep in event.good_leptons
+        ]
 
-        #Add light jets that are assumed to come from hadronic W decay
-        for jet in event.wquark_candidate_jets:
-            self.add_obj(
-                MEM.ObjectType.Jet,
-                p4s=(jet.pt, jet.eta, jet.phi, jet.mass),
-                obs_dict={MEM.Observable.BTAG: jet.btagFlag},
-                tf_dict={
-                    MEM.TFType.bReco: jet.tf_b, MEM.TFType.qReco: jet.tf_l,
-                    MEM.TFType.bLost: jet.tf_b, MEM.TFType.qLost: jet.tf_l
-                }
-            )
-        for lep in event.good_leptons:
-            self.add_obj(
-                MEM.ObjectType.Lepton,
-                p4s=(lep.pt, lep.eta, lep.phi, lep.mass),
-                obs_dict={MEM.Observable.CHARGE: lep.charge},
-            )
-        self.add_obj(
-            MEM.ObjectType.MET,
-            #MET is caused by massless object
-            p4s=(event.input.met_pt, 0, event.input.met_phi, 0),
-        )
+        met = (event.input.met_pt, event.input.met_phi)
+        return tuple(jets), tuple(leptons), met, tuple(vars_to_integrate)
+
+    def is_decided(self, r_tth, r_ttbb):
+        """
+        Returns True if the tth vs. ttbb discriminant p_tth / (p_tth + w*p_ttbb)
+        is known to Conf.mem["adaptive"]["precision"], or if the relative errors
+        of both hypotheses are below it.
+        """
+        precision = self.adaptive["precision"]
+        if r_tth.p <= 0 or r_ttbb.p <= 0:
+            #no probability to refine
+            return True
+        e1 = r_tth.p_err / r_tth.p
+        e2 = r_ttbb.p_err / r_ttbb.p
+        if max(e1, e2) <= precision:
+            return True
+        w = self.adaptive.get("weight", 0.02)
+        d = r_tth.p / (r_tth.p + w * r_ttbb.p)
+        return d * (1.0 - d) * math.sqrt(e1*e1 + e2*e2) <= precision
+
+    def run_tasks(self, tasks, res, factors, outputs=None):
+        """
+        Runs the integrations with the MEM runner and stores the outputs and
+        the calls_factor of the tasks by (hypo, confname).
+
+        outputs: the outputs of the tasks, if they were already collected
+        """
+        if outputs is None:
+            outputs = self.mem_runner.run_all(tasks)
+        for task, r in zip(tasks, outputs):
+            res[(task.hypo, task.confname)] = r
+            factors[(task.hypo, task.confname)] = task.calls_factor
+
+    def count_cache(self):
+        """
+        Counts the cache hits and misses of the last collected integrations.
+        """
+        if isinstance(self.mem_runner, CachedRunner):
+            self.counters["memcache"].inc("hit", self.mem_runner.nhits)
+            self.counters["memcache"].inc("miss", self.mem_runner.nmisses)
 
     #Check if event.nMatch_label >= conf.mem[cat][label]
     def require(self, required_match, label, event):
@@ -1118,15 +1150,28 @@ class MEAnalyzer(FilterAnalyzer):
         return passes
 
     def process(self, event):
-        self.counters["processing"].inc("processed")
+        self.submit(event)
+        return self.collect(event)
 
-        #Clean up any old MEM state
-        self.vars_to_integrate.clear()
-        self.integrator.next_event()
+    def submit(self, event):
+        """
+        Prepares the integrations of the event and of its systematic
+        variations and submits them to the MEM runner without waiting for
+        the outputs, see collect.
+        The looper calls submit for several events before collecting them
+        if pipelineEvents > 1, see MELooper.
+        """
+        self.counters["processing"].inc("processed")
+        self.setup_mem()
 
         #Initialize members for tree filler
         event.mem_results_tth = []
         event.mem_results_ttbb = []
+        variations = systematics.variations(event)
+        for name, ev in variations:
+            ev.mem_results_tth = []
+            ev.mem_results_ttbb = []
+        event.mem_pending = None
 
         #jets = sorted(event.good_jets, key=lambda x: x.pt, reverse=True)
         leptons = event.good_leptons
@@ -1139,6 +1184,36 @@ class MEAnalyzer(FilterAnalyzer):
             for l in leptons:
                 print "lep", l.pt, l.eta, l.phi, l.mass, l.charge
 
+        #In the adaptive mode, start with a fraction of the integration points
+        factor = 1.0
+        if self.adaptive["enabled"]:
+            factor = self.adaptive["startFactor"]
+
+        #The variations with the same jet assignment and category as the
+        #nominal get the nominal results, the others are integrated
+        if len(variations) > 0:
+            nominal_key = systematics.assignment_key(event)
+        pending = []
+        for name, ev in [(None, event)] + variations:
+            ev.mem_integrated = name is None or systematics.assignment_key(ev) != nominal_key
+            if not ev.mem_integrated:
+                continue
+            prepared = self.prepare(ev, factor)
+            if not prepared is None:
+                pending += [(ev, ) + prepared]
+
+        #Queue the integrations, run in-process, in the worker pool or in the server
+        tasks = sum([p[1] for p in pending], [])
+        event.mem_pending = (pending, self.mem_runner.submit(tasks), factor)
+        return True
+
+    def prepare(self, event, factor):
+        """
+        Returns (tasks, res, pruned) for the event (or a systematic variation):
+        the MEMTasks to run and the outputs and pruned jet-quark assignments
+        of the integrations which are not run, by (hypo, confname).
+        Returns None if the MEM is not calculated for the event.
+        """
         #Check if event passes reco-level requirements to calculate ME
         if event.cat_btag == "H":
             print "MEM RECO PASS", (event.input.run, event.input.lumi, event.input.evt,
@@ -1148,8 +1223,7 @@ class MEAnalyzer(FilterAnalyzer):
             )
         else:
             #Don't calculate ME
-            return True
-
+            return None
 
         #Here we optionally restrict the ME calculation to only matched events
         #Get the conf dict specifying which matches we require
@@ -1166,7 +1240,7 @@ class MEAnalyzer(FilterAnalyzer):
         for k, v in passd.items():
             if not v:
                 #print "Failed to match", k
-                return True
+                return None
 
         fstate = MEM.FinalState.TTH
         if len(event.good_leptons) == 2:
@@ -1175,6 +1249,8 @@ class MEAnalyzer(FilterAnalyzer):
             fstate = MEM.FinalState.LH
 
         res = {}
+        pruned = {}
+        tasks = []
         for hypo in [MEM.Hypothesis.TTH, MEM.Hypothesis.TTBB]:
             for confname in self.memkeys:
                 mem_cfg = self.configs[confname]
@@ -1183,20 +1259,93 @@ class MEAnalyzer(FilterAnalyzer):
                 if (self.conf.mem["calcME"] and
                         mem_cfg.do_calculate(event) and mem_cfg.enabled
                     ):
-                    print "MEM started", ("hypo", hypo), ("conf", confname)
-                    self.configure_mem(event, mem_cfg)
-                    r = self.integrator.run(
-                        fstate,
-                        hypo,
-                        self.vars_to_integrate
+                    wquark_jets = None
+                    if self.pruning["enabled"]:
+                        wquark_jets, pruned[(hypo, confname)] = self.prune_assignments(
+                            event, fstate, hypo, mem_cfg
+                        )
+                        #no compatible assignment, the probability is 0
+                        if wquark_jets is None:
+                            res[(hypo, confname)] = MEM.MEMOutput()
+                            continue
+                    jets, leptons, met, vars_to_integrate = self.configure_mem(
+                        event, mem_cfg, wquark_jets
                     )
-                    print "MEM done", ("hypo", hypo), ("conf", confname)
-
-                    res[(hypo, confname)] = r
+                    tasks += [MEMTask(
+                        confname, hypo, fstate,
+                        jets, leptons, met, vars_to_integrate, factor
+                    )]
                 else:
                     r = MEM.MEMOutput()
                     res[(hypo, confname)] = r
 
+        return tasks, res, pruned
+
+    def collect(self, event):
+        """
+        Waits for the integrations submitted for the event, runs the adaptive
+        refinement and stores the outputs in event.mem_results_tth (ttbb),
+        and those of the systematic variations in mem_results_tth_<variation>.
+        """
+        if event.mem_pending is None:
+            return True
+        pending, handle, factor = event.mem_pending
+        event.mem_pending = None
+
+        outputs = iter(self.mem_runner.collect(handle))
+        self.count_cache()
+        for (ev, tasks, res, pruned) in pending:
+            factors = {}
+            self.run_tasks(tasks, res, factors, [next(outputs) for t in tasks])
+            self.refine(tasks, res, factors, factor)
+            self.store(ev, res, factors, pruned)
+
+        for name, ev in systematics.variations(event):
+            if not ev.mem_integrated:
+                ev.mem_results_tth = event.mem_results_tth
+                ev.mem_results_ttbb = event.mem_results_ttbb
+            setattr(event, "mem_results_tth_" + name, ev.mem_results_tth)
+            setattr(event, "mem_results_ttbb_" + name, ev.mem_results_ttbb)
+        return True
+
+    def refine(self, tasks, res, factors, factor):
+        """
+        Repeats the undecided integrations with more points, up to maxFactor,
+        see is_decided.
+        """
+        while self.adaptive["enabled"] and len(tasks) > 0:
+            factor *= self.adaptive["step"]
+            if factor > self.adaptive["maxFactor"]:
+                break
+            undecided = [
+                confname for confname in set([t.confname for t in tasks])
+                if not self.is_decided(
+                    res[(MEM.Hypothesis.TTH, confname)],
+                    res[(MEM.Hypothesis.TTBB, confname)]
+                )
+            ]
+            tasks = [
+                t._replace(calls_factor=factor)
+                for t in tasks if t.confname in undecided
+            ]
+            if len(tasks) == 0:
+                break
+            self.run_tasks(tasks, res, factors)
+            self.count_cache()
+
+    def store(self, event, res, factors, pruned):
+        """
+        Stores the outputs in event.mem_results_tth (ttbb).
+        """
+        #Store the number of points of the last integration, 0 if not integrated,
+        #and the number of pruned jet-quark assignments
+        res = {
+            (hypo, confname): MEMResult(r, scaled_calls(
+                self.configs[confname].n_max_calls, factors.get((hypo, confname), 0.0)
+            ), pruned.get((hypo, confname), 0))
+            for ((hypo, confname), r) in res.items()
+        }
+
         if "default" in self.memkeys:
             p1 = res[(MEM.Hypothesis.TTH, "default")].p
             p2 = res[(MEM.Hypothesis.TTBB, "default")].p
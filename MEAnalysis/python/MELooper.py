@@ -0,0 +1,436 @@
+"""
+Heppy looper for the MEAnalysis jobs, with periodic checkpointing.
+
+Every checkpointEvents processed entries or checkpointMinutes minutes, the
+output trees are saved to their files (TTree::AutoSave) and the counters and
+averages of the analyzers are written with the last processed entry to the
+sidecar file <output dir>/checkpoint.pkl.
+
+If a looper is created with the name of an output directory containing a
+checkpoint of the same job (components, firstEvent, nEvents), the directory
+is reused: the checkpointed tree entries are copied to the new output trees,
+the counters are restored and the loop continues after the last processed
+entry. The output is then the same as that of an uninterrupted run.
+Only the output trees, the counters and averages of the analyzers and the
+timing are restored: other outputs, e.g. histograms of the output services,
+contain only the entries processed after the resume.
+
+With checkpointDir, the sidecar file and copies of the saved output files
+are kept in that directory instead of the output directory, e.g. on
+persistent storage for batch jobs running in a scratch directory which is
+lost when the job is resubmitted. The output directory is then recreated
+from the copies.
+
+The wall and CPU time of each analyzer and of the event loop are measured,
+see Timing. The report is printed at the end of the loop, written to
+timing.txt in the output directory and as the tree "timing" to the output
+tree file.
+
+Optionally, the memory growth of each analyzer is sampled every
+memoryReportEvents calls, see Memory, and reported in memory.txt.
+
+With pipelineEvents > 1, the entries are processed in batches: the first
+analyzer with submit/collect methods (MEAnalyzer) submits the integrations
+of all the events of the batch before the outputs of the first event are
+collected, such that the MEM server or worker pool integrates several events
+at the same time. The input entry of each event is read again before the
+analyzers after it are run.
+"""
+import os
+import time
+import glob
+import shutil
+import cPickle as pickle
+import ROOT
+
+from PhysicsTools.HeppyCore.framework.looper import Looper
+from PhysicsTools.HeppyCore.framework.event import Event
+from TTH.MEAnalysis import InputBranches
+from TTH.MEAnalysis.Timing import TimingReport, cpu_time
+from TTH.MEAnalysis.Memory import MemoryMonitor
+
+CHECKPOINT_FILE = "checkpoint.pkl"
+
+def copy_file(src, dst):
+    """
+    Copies src to dst through a temporary file, such that dst is either the
+    previous or the complete new copy.
+    """
+    d = os.path.dirname(dst)
+    if d != "" and not os.path.isdir(d):
+        os.makedirs(d)
+    shutil.copyfile(src, dst + ".tmp")
+    os.rename(dst + ".tmp", dst)
+
+def output_trees(analyzers):
+    """
+    Returns the (analyzer, TTree) of the analyzers writing a tree,
+    e.g. AutoFillTreeProducer.
+    """
+    ret = []
+    for analyzer in analyzers:
+        t = getattr(analyzer, "tree", None)
+        #heppy tree producers wrap the TTree in a Tree object
+        t = getattr(t, "tree", t)
+        if t is not None and hasattr(t, "AutoSave"):
+            ret += [(analyzer, t)]
+    return ret
+
+class MELooper(Looper):
+    """
+    Looper with checkpointing and resuming, see the module documentation.
+
+    checkpointEvents (int): checkpoint after this many entries, 0 to disable
+    checkpointMinutes (float): checkpoint after this many minutes, 0 to disable
+    resume (bool): continue from the checkpoint in the output directory, if any
+    checkpointDir (string): keep the checkpoint in this directory instead of
+        the output directory, see the module documentation
+    entries (list of int): process only these entries of the input chain
+        (e.g. from EventIndex), instead of nEvents entries from firstEvent
+    activeBranchesOnly (bool): read only the input branches declared by the
+        analyzers, see InputBranches. Reading another branch from event.input
+        raises AttributeError. If an analyzer reads the input itself
+        (reads_input), the chain reads no branches regardless.
+    memoryReportEvents (int): sample the memory of the analyzers every this
+        many calls, 0 to disable
+    pipelineEvents (int): number of events submitted to the pipelined
+        analyzer before collecting, see process_batch
+    """
+    def __init__(self, name, config, nEvents=None, firstEvent=0, nPrint=0,
+        checkpointEvents=0, checkpointMinutes=0, resume=True, entries=None,
+        activeBranchesOnly=False, memoryReportEvents=0, pipelineEvents=1,
+        checkpointDir=None, **kwargs):
+
+        self.checkpoint_events = checkpointEvents
+        self.pipeline_events = max(1, pipelineEvents)
+        self.timing = TimingReport()
+        self.memory_events = memoryReportEvents
+        self.memory = None
+        self.checkpoint_seconds = 60.0 * checkpointMinutes
+        self.checkpoint_dir = checkpointDir
+        self.selected_entries = None if entries is None else sorted(entries)
+        self.job_id = (
+            [(c.name, list(c.files)) for c in config.components],
+            firstEvent, nEvents, self.selected_entries
+        )
+
+        #The checkpointed output is moved aside before the output services
+        #recreate their files, it is copied to the new files in loop()
+        self.resume_state = None
+        ckpt = os.path.join(checkpointDir or name, CHECKPOINT_FILE)
+        if resume and os.path.isfile(ckpt):
+            state = pickle.load(open(ckpt, "rb"))
+            if state["job"] == self.job_id:
+                print "resuming {0} after entry {1}".format(name, state["entry"])
+                self.resume_state = state
+                self._move_checkpointed_files(state, name)
+            else:
+                print "checkpoint in {0} is from a different job, not resuming".format(name)
+
+        super(MELooper, self).__init__(name, config,
+            nEvents=nEvents, firstEvent=firstEvent, nPrint=nPrint, **kwargs
+        )
+
+        #analyzers reading the input tree themselves, e.g. in chunks
+        readers = [a for a in self.analyzers if getattr(a, "reads_input", False)]
+        if activeBranchesOnly or len(readers) > 0:
+            self._activate_inputs(readers)
+
+    def _activate_inputs(self, readers=[]):
+        """
+        Disables the input branches which are not declared by any analyzer
+        and passes the declared inputs to the event builders. If an analyzer
+        reads the input tree itself (reads_input, e.g.
+        VHbbColumns.ColumnarEventAnalyzer), the chain reads no branches.
+        """
+        inputs = [InputBranches.analyzer_inputs(a) for a in self.analyzers]
+        undeclared = [a.name for (a, inp) in zip(self.analyzers, inputs) if inp is None]
+        if len(undeclared) > 0:
+            print "analyzers {0} do not declare their inputs, reading all branches".format(undeclared)
+            return
+        collections, scalars = InputBranches.merge(inputs)
+        for analyzer in self.analyzers:
+            if hasattr(analyzer, "set_inputs"):
+                analyzer.set_inputs(collections, scalars)
+        #the heppy Chain wraps the TChain
+        tree = getattr(self.events, "chain", self.events)
+        if len(readers) > 0:
+            InputBranches.activate(tree, [])
+            print "input read by {0}, the chain reads no branches".format(
+                [a.name for a in readers]
+            )
+            return
+        enabled = InputBranches.activate(
+            tree, InputBranches.branch_names(collections, scalars)
+        )
+        print "reading {0} of {1} input branches".format(
+            len(enabled), len(tree.GetListOfBranches())
+        )
+        #the analyzers get the tree on which the disabled branches raise
+        self.events = InputBranches.DeclaredEvents(self.events, enabled)
+
+    def _prepareOutput(self, name):
+        if self.resume_state is not None:
+            return name
+        return super(MELooper, self)._prepareOutput(name)
+
+    def _build(self, cfg):
+        """
+        Builds the analyzer or service. The heppy analyzers create their
+        directory in the output directory, on resume it exists and its
+        files are moved to the new directory.
+        """
+        d = os.path.join(self.outDir, cfg.name)
+        if self.resume_state is None or not os.path.isdir(d):
+            return super(MELooper, self)._build(cfg)
+        os.rename(d, d + ".resume")
+        try:
+            return super(MELooper, self)._build(cfg)
+        finally:
+            if not os.path.isdir(d):
+                os.mkdir(d)
+            for fn in os.listdir(d + ".resume"):
+                os.rename(os.path.join(d + ".resume", fn), os.path.join(d, fn))
+            os.rmdir(d + ".resume")
+
+    @staticmethod
+    def _checkpointed_name(fn, state):
+        return "{0}.ckpt_{1}".format(fn, state["run_id"])
+
+    def _saved_name(self, fn, outdir):
+        """
+        Returns the copy in checkpointDir of the output file fn in outdir.
+        """
+        return os.path.join(self.checkpoint_dir, os.path.relpath(fn, outdir))
+
+    def _move_checkpointed_files(self, state, name):
+        if self.checkpoint_dir is not None:
+            #the output directory may be gone, the saved copies are used
+            for fn in state["files"]:
+                newfn = os.path.join(name, os.path.relpath(fn, state["outdir"]))
+                copy_file(
+                    self._saved_name(fn, state["outdir"]),
+                    self._checkpointed_name(newfn, state)
+                )
+            return
+        for fn in state["files"]:
+            cfn = self._checkpointed_name(fn, state)
+            #a previous resume failed before its first checkpoint, the
+            #checkpointed entries are still in the moved file
+            if os.path.isfile(cfn):
+                if os.path.isfile(fn):
+                    os.remove(fn)
+            else:
+                os.rename(fn, cfn)
+
+    def _restore(self):
+        """
+        Copies the checkpointed tree entries and restores the counters.
+        """
+        state = self.resume_state
+        for analyzer, tree in output_trees(self.analyzers):
+            fn = self._checkpointed_name(tree.GetCurrentFile().GetName(), state)
+            tf = ROOT.TFile(fn)
+            src = tf.Get(tree.GetName())
+            n = state["tree_entries"][analyzer.name]
+            assert src != None and src.GetEntries() >= n, "checkpointed tree missing in " + fn
+            tree.GetCurrentFile().cd()
+            tree.CopyEntries(src, n)
+            tf.Close()
+        for analyzer in self.analyzers:
+            if state["counters"].has_key(analyzer.name):
+                analyzer.counters = state["counters"][analyzer.name]
+            if state["averages"].has_key(analyzer.name):
+                analyzer.averages = state["averages"][analyzer.name]
+        if state.has_key("timing"):
+            self.timing.merge(state["timing"])
+
+    def checkpoint(self, iEv):
+        """
+        Saves the output trees and writes the sidecar file with the state
+        after processing the entry iEv.
+        """
+        files = []
+        tree_entries = {}
+        for analyzer, tree in output_trees(self.analyzers):
+            #the entries buffered by the writer, see ColumnarTreeProducer
+            if hasattr(analyzer, "flush"):
+                analyzer.flush()
+            tree.AutoSave("SaveSelf;FlushBaskets")
+            tree.GetCurrentFile().Flush()
+            files += [tree.GetCurrentFile().GetName()]
+            tree_entries[analyzer.name] = tree.GetEntries()
+
+        state = {
+            "job": self.job_id,
+            "run_id": self.run_id,
+            "outdir": self.outDir,
+            "entry": iEv,
+            "files": files,
+            "tree_entries": tree_entries,
+            "counters": {a.name: a.counters for a in self.analyzers},
+            "averages": {a.name: a.averages for a in self.analyzers if hasattr(a, "averages")},
+            "timing": self.timing_report(),
+        }
+        #the copies are made before the sidecar file, such that they have
+        #at least the checkpointed entries
+        if self.checkpoint_dir is not None:
+            if not os.path.isdir(self.checkpoint_dir):
+                os.makedirs(self.checkpoint_dir)
+            for fn in files:
+                copy_file(fn, self._saved_name(fn, self.outDir))
+        ckpt = os.path.join(self.checkpoint_dir or self.outDir, CHECKPOINT_FILE)
+        of = open(ckpt + ".tmp", "wb")
+        pickle.dump(state, of, pickle.HIGHEST_PROTOCOL)
+        of.close()
+        os.rename(ckpt + ".tmp", ckpt)
+
+        #the entries of earlier runs are now in the current output files
+        for fn in files:
+            for cfn in glob.glob(fn + ".ckpt_*"):
+                os.remove(cfn)
+
+    def timing_report(self):
+        """
+        Returns the timing of the analyzers and of the event loop, with the
+        stages added by the analyzers (add_timing, e.g. the MEM integrations).
+        """
+        report = TimingReport()
+        report.merge(self.timing)
+        for analyzer in self.analyzers:
+            if hasattr(analyzer, "add_timing"):
+                analyzer.add_timing(report)
+        return report
+
+    def entries(self):
+        """
+        Returns the tree entries to process.
+        """
+        if self.selected_entries is not None:
+            return [e for e in self.selected_entries if e < len(self.events)]
+        nEvents = self.nEvents
+        if nEvents is None or int(nEvents) > len(self.events):
+            nEvents = len(self.events)
+        last = min(self.firstEvent + int(nEvents), len(self.events))
+        return range(self.firstEvent, last)
+
+    def process_batch(self, entries):
+        """
+        Processes the entries, submitting the integrations of all of them
+        before collecting, see the module documentation.
+        Returns the last processed event.
+        """
+        pipelined = [i for (i, a) in enumerate(self.analyzers) if hasattr(a, "submit")]
+        if len(pipelined) == 0 or len(entries) == 1:
+            for iEv in entries:
+                self.process(iEv)
+            return self.event
+        ipipe = pipelined[0]
+        submitted = []
+        for iEv in entries:
+            event = Event(iEv, self.events[iEv], self.setup)
+            self.event = event
+            self.iEvent = iEv
+            passed = True
+            for analyzer in self.analyzers[:ipipe]:
+                if analyzer.process(event) == False:
+                    passed = False
+                    break
+            if passed and self.analyzers[ipipe].submit(event) != False:
+                submitted += [event]
+        for event in submitted:
+            #the later analyzers read the input tree of this entry
+            self.events[event.iEv]
+            self.event = event
+            self.iEvent = event.iEv
+            if self.analyzers[ipipe].collect(event) == False:
+                continue
+            for analyzer in self.analyzers[ipipe+1:]:
+                if analyzer.process(event) == False:
+                    break
+        return self.event
+
+    def loop(self):
+        self.run_id = "{0}_{1}".format(os.getpid(), int(time.time()))
+        entries = self.entries()
+        print "starting loop over {0} entries".format(len(entries))
+
+        for analyzer in self.analyzers:
+            analyzer.beginLoop(self.setup)
+
+        #the time of the whole event, including reading the input
+        loop_timing = self.timing.stage("loop")
+        for analyzer in self.analyzers:
+            self.timing.time_analyzer(analyzer)
+        #the memory sampling is outside of the timed call
+        if self.memory_events > 0:
+            self.memory = MemoryMonitor(self.memory_events)
+            for analyzer in self.analyzers:
+                self.memory.watch(analyzer)
+
+        if self.resume_state is not None:
+            self._restore()
+            entries = [e for e in entries if e > self.resume_state["entry"]]
+
+        nprocessed = 0
+        nlast = 0
+        tlast = time.time()
+        tstart = tlast
+        try:
+            for ibatch in range(0, len(entries), self.pipeline_events):
+                batch = entries[ibatch:ibatch + self.pipeline_events]
+                iEv = batch[-1]
+                if nprocessed % 100 < len(batch):
+                    print "event {0} ({1:.1f} ev/s)".format(batch[0], nprocessed / max(time.time() - tstart, 1e-6))
+                t0, c0 = time.time(), cpu_time()
+                self.process_batch(batch)
+                loop_timing.add(time.time() - t0, cpu_time() - c0, ncalls=len(batch))
+                if batch[0] < self.nPrint:
+                    print self.event
+
+                nprocessed += len(batch)
+                nlast += len(batch)
+                if ((self.checkpoint_events > 0 and nlast >= self.checkpoint_events) or
+                    (self.checkpoint_seconds > 0 and time.time() - tlast >= self.checkpoint_seconds)):
+                    self.checkpoint(iEv)
+                    nlast = 0
+                    tlast = time.time()
+        except UserWarning:
+            print "Stopped loop following a UserWarning exception"
+
+        print "number of events processed: {0}".format(nprocessed)
+        for analyzer in self.analyzers:
+            analyzer.endLoop(self.setup)
+        print self.timing_report().table()
+        if self.memory is not None:
+            print self.memory.report()
+            for st in self.memory.growing():
+                print "WARNING: memory of {0} grows by {1} kB".format(st.name, st.growth)
+
+    def write(self):
+        trees = output_trees(self.analyzers)
+        files = [tree.GetCurrentFile().GetName() for (a, tree) in trees]
+
+        report = self.timing_report()
+        of = open(os.path.join(self.outDir, "timing.txt"), "w")
+        of.write(report.table() + "\n")
+        of.close()
+        if self.memory is not None:
+            of = open(os.path.join(self.outDir, "memory.txt"), "w")
+            of.write(self.memory.report() + "\n")
+            of.close()
+        #written with the output tree when the output services are stopped
+        if len(trees) > 0:
+            self.timing_tree = report.write(trees[0][1].GetCurrentFile())
+
+        super(MELooper, self).write()
+
+        #the job is done, a rerun should not resume
+        ckpt = os.path.join(self.checkpoint_dir or self.outDir, CHECKPOINT_FILE)
+        if os.path.isfile(ckpt):
+            os.remove(ckpt)
+        for fn in files:
+            if self.checkpoint_dir is not None and os.path.isfile(self._saved_name(fn, self.outDir)):
+                os.remove(self._saved_name(fn, self.outDir))
+            for cfn in glob.glob(fn + ".ckpt_*"):
+                os.remove(cfn)
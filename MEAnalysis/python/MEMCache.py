@@ -0,0 +1,167 @@
+"""
+Persistent cache of MEM results, keyed by a hash of the integrator inputs.
+
+The key is computed from the MEMTask (jet p4s, b-tag flags and TF eta bins,
+lepton p4s and charges, MET, integration variables, MEM configuration name,
+final state, hypothesis and the scaling of the number of points) and the fingerprint of the transfer functions.
+The MEMOutput fields are stored in an sqlite database, which is bounded in
+the number of entries by evicting the least recently used results.
+
+Changing the settings of a MEMConfig in MEMIntegrator.build_mem_configs
+is not detected, the cache file must be removed in that case.
+"""
+import hashlib
+import sqlite3
+import time
+
+from TTH.MEAnalysis.MEMIntegrator import MEMOUTPUT_FIELDS, output_to_tuple, output_from_tuple
+
+#Integer-valued MEMOutput members, all others are stored as REAL
+INTEGER_FIELDS = ["error_code", "num_perm"]
+
+def task_key(task, tf_fingerprint):
+    """
+    Returns the cache key of a MEMTask. The numbers are converted to python
+    floats and ints, such that the key does not depend on their source type.
+    """
+    canonical = (
+        str(task.confname),
+        int(task.hypo),
+        int(task.fstate),
+        tuple([
+            tuple([float(x) for x in j[:5]] + [int(j[5])])
+            for j in task.jets
+        ]),
+        tuple([
+            tuple([float(x) for x in l[:4]] + [int(l[4])])
+            for l in task.leptons
+        ]),
+        tuple([float(x) for x in task.met]),
+        tuple([int(v) for v in task.vars_to_integrate]),
+        tf_fingerprint,
+    )
+    #the key of the default number of points is unchanged from older caches
+    if task.calls_factor != 1.0:
+        canonical += (float(task.calls_factor), )
+    return hashlib.sha1(repr(canonical)).hexdigest()
+
+class MEMCache(object):
+    """
+    On-disk store of MEMOutput fields, with least-recently-used eviction once
+    more than max_entries results are stored.
+    """
+    def __init__(self, filename, max_entries=1000000, commit_every=100):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.nuncommitted = 0
+
+        #several jobs may share the file, wait for their locks
+        self.db = sqlite3.connect(filename, timeout=600)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS mem (key TEXT PRIMARY KEY, " +
+            ", ".join([
+                "{0} {1}".format(f, "INTEGER" if f in INTEGER_FIELDS else "REAL")
+                for f in MEMOUTPUT_FIELDS
+            ]) +
+            ", last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS mem_last_used ON mem (last_used)")
+        self.db.commit()
+
+    def get(self, key):
+        """
+        Returns the tuple of MEMOutput fields for the key, or None.
+        """
+        row = self.db.execute(
+            "SELECT {0} FROM mem WHERE key=?".format(", ".join(MEMOUTPUT_FIELDS)),
+            (key, )
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE mem SET last_used=? WHERE key=?", (time.time(), key))
+        self._committed()
+        return tuple(row)
+
+    def put(self, key, values):
+        self.db.execute(
+            "INSERT OR REPLACE INTO mem VALUES (?, {0}, ?)".format(
+                ", ".join(["?"] * len(MEMOUTPUT_FIELDS))
+            ),
+            (key, ) + tuple(values) + (time.time(), )
+        )
+        self._committed()
+
+    def evict(self):
+        """
+        Removes the least recently used results above max_entries.
+        """
+        n = self.db.execute("SELECT COUNT(*) FROM mem").fetchone()[0]
+        if n > self.max_entries:
+            self.db.execute(
+                "DELETE FROM mem WHERE key IN " +
+                "(SELECT key FROM mem ORDER BY last_used ASC LIMIT ?)",
+                (n - self.max_entries, )
+            )
+
+    def _committed(self):
+        self.nuncommitted += 1
+        if self.nuncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.evict()
+        self.db.commit()
+        self.nuncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+class CachedRunner(object):
+    """
+    Wraps a MEM runner (see MEMIntegrator.make_runner): the tasks found
+    in the cache are not integrated, the others are run and stored.
+    The hits and misses of the last collected tasks are in nhits, nmisses.
+    """
+    def __init__(self, runner, cache, tf_fingerprint):
+        self.runner = runner
+        self.cache = cache
+        self.tf_fingerprint = tf_fingerprint
+        self.nhits = 0
+        self.nmisses = 0
+
+    def submit(self, tasks):
+        keys = [task_key(task, self.tf_fingerprint) for task in tasks]
+        cached = [self.cache.get(k) for k in keys]
+        to_run = [task for (task, c) in zip(tasks, cached) if c is None]
+        return keys, cached, self.runner.submit(to_run)
+
+    def collect(self, handle):
+        keys, cached, runner_handle = handle
+        outputs = iter(self.runner.collect(runner_handle))
+
+        self.nmisses = len([c for c in cached if c is None])
+        self.nhits = len(cached) - self.nmisses
+
+        ret = []
+        for (k, c) in zip(keys, cached):
+            if c is None:
+                r = next(outputs)
+                self.cache.put(k, output_to_tuple(r))
+            else:
+                r = output_from_tuple(c)
+            ret += [r]
+        return ret
+
+    def run_all(self, tasks):
+        return self.collect(self.submit(tasks))
+
+    @property
+    def timing(self):
+        #only the integrations which were run, the cache hits take no time
+        return self.runner.timing
+
+    def close(self):
+        self.runner.close()
+        self.cache.close()
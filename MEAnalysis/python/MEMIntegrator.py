@@ -0,0 +1,445 @@
+"""
+Runs the MEM integrations requested by MEAnalyzer.
+
+The inputs of one integration are described by a MEMTask, which contains only
+plain python values (no ROOT objects), such that the task can be sent to
+another process. A MEMRunner holds a MEM.Integrand with its own set of
+MEMConfigs and transfer functions and runs the tasks in-process, MEMPool
+distributes the tasks of an event to a pool of worker processes, each with
+its own MEMRunner. The tasks can also be sent to the MEM server of the host
+(see MEMServer) or to MEMStub, which returns deterministic outputs without
+integrating, see make_runner.
+
+All the runners provide submit(tasks), which returns a handle, and
+collect(handle), which returns the outputs, such that the tasks of several
+events can be in flight at the same time (see MELooper, pipelineEvents).
+"""
+import ROOT
+import time
+import hashlib
+import math
+import multiprocessing
+from collections import namedtuple
+
+from TTH.MEAnalysis.TFClasses import TFRegistry, load_tf_matrix
+from TTH.MEAnalysis.Timing import cpu_time
+from TTH.MEAnalysis import Startup
+
+#the ROOT.MEM namespace, once the library is loaded
+_mem_namespace = None
+
+def load_library():
+    """
+    Loads the MEM integrator library, returns the ROOT.MEM namespace.
+    """
+    global _mem_namespace
+    if _mem_namespace is None:
+        with Startup.stage("MEM integrator library"):
+            # ROOT.gSystem.Load("libFWCoreFWLite")
+            # ROOT.gROOT.ProcessLine('AutoLibraryLoader::enable();')
+            ROOT.gSystem.Load("libCintex")
+            ROOT.gROOT.ProcessLine('ROOT::Cintex::Cintex::Enable();')
+            ROOT.gSystem.Load("libTTHMEIntegratorStandalone")
+            _mem_namespace = ROOT.MEM
+    return _mem_namespace
+
+class LazyMEM(object):
+    """
+    The ROOT.MEM namespace, the library is loaded on the first access of a
+    member, such that the jobs which do not integrate do not load it.
+    """
+    def __getattr__(self, name):
+        return getattr(load_library(), name)
+
+MEM = LazyMEM()
+
+#The MEMOutput members which are transferred between processes and stored
+MEMOUTPUT_FIELDS = ["p", "p_err", "chi2", "time", "error_code", "efficiency", "num_perm"]
+
+#Inputs of one integration
+#confname (string): key of the MEMConfig, see build_mem_configs
+#hypo, fstate (int): MEM.Hypothesis and MEM.FinalState
+#jets: tuple of (pt, eta, phi, mass, btagFlag, tf_eta_bin)
+#leptons: tuple of (pt, eta, phi, mass, charge)
+#met: (pt, phi)
+#vars_to_integrate: tuple of MEM.PSVar
+#calls_factor (float): the number of integration points (MEMConfig.n_max_calls)
+#   is scaled by this factor, see MEAnalyzer (adaptive precision)
+MEMTask = namedtuple("MEMTask", [
+    "confname", "hypo", "fstate", "jets", "leptons", "met", "vars_to_integrate",
+    "calls_factor"
+])
+MEMTask.__new__.__defaults__ = (1.0, )
+
+def build_mem_configs():
+    """
+    Creates the dictionary of all the known MEM configurations.
+
+    Besides the MEM.MEMConfig settings, each configuration has
+    mem_assumptions (set of strings): e.g. missed_wq
+    do_calculate (Event -> bool): returns True if this ME should be calculated
+    enabled (bool): set to False if the assumptions cannot be fulfilled
+    """
+    configs = {
+        "default": MEM.MEMConfig(),
+        "MissedWQ": MEM.MEMConfig(),
+        "oldTF": MEM.MEMConfig(),
+        "NumPointsDouble": MEM.MEMConfig(),
+        "NumPointsHalf": MEM.MEMConfig(),
+        "NoJacobian": MEM.MEMConfig(),
+        "NoDecayAmpl": MEM.MEMConfig(),
+        "NoPDF": MEM.MEMConfig(),
+        "NoScattAmpl": MEM.MEMConfig(),
+        "QuarkEnergy98": MEM.MEMConfig(),
+        "QuarkEnergy10": MEM.MEMConfig(),
+        "NuPhiRestriction": MEM.MEMConfig(),
+        "JetsPtOrder": MEM.MEMConfig(),
+        "JetsPtOrderIntegrationRange": MEM.MEMConfig(),
+        "Recoil": MEM.MEMConfig(),
+        "Sudakov": MEM.MEMConfig(),
+        "Minimize": MEM.MEMConfig(),
+    }
+    for k in configs.keys():
+        configs[k].transfer_function_method = MEM.TFMethod.External
+
+    configs["default"].defaultCfg()
+    configs["oldTF"].defaultCfg()
+    configs["MissedWQ"].defaultCfg()
+    configs["NumPointsDouble"].defaultCfg(2.0)
+    configs["NumPointsHalf"].defaultCfg(0.5)
+    configs["NoJacobian"].defaultCfg()
+    configs["NoDecayAmpl"].defaultCfg()
+    configs["NoPDF"].defaultCfg()
+    configs["NoScattAmpl"].defaultCfg()
+    configs["QuarkEnergy98"].defaultCfg()
+    configs["QuarkEnergy10"].defaultCfg()
+    configs["NuPhiRestriction"].defaultCfg()
+    configs["JetsPtOrder"].defaultCfg()
+    configs["JetsPtOrderIntegrationRange"].defaultCfg()
+    configs["Recoil"].defaultCfg()
+    configs["Sudakov"].defaultCfg()
+    configs["Minimize"].defaultCfg()
+
+    configs["oldTF"].transfer_function_method = MEM.TFMethod.Builtin
+    configs["NoJacobian"].int_code &= ~ MEM.IntegrandType.Jacobian
+    configs["NoDecayAmpl"].int_code &= ~ MEM.IntegrandType.DecayAmpl
+    configs["NoPDF"].int_code &= ~ MEM.IntegrandType.PDF
+    configs["NoScattAmpl"].int_code &=  ~ MEM.IntegrandType.ScattAmpl
+    configs["QuarkEnergy98"].j_range_CL = 0.98
+    configs["QuarkEnergy98"].b_range_CL = 0.98
+    configs["QuarkEnergy10"].j_range_CL = 0.10
+    configs["QuarkEnergy10"].b_range_CL = 0.10
+    configs["NuPhiRestriction"].m_range_CL = 99
+    configs["JetsPtOrder"].highpt_first  = 0
+    configs["JetsPtOrderIntegrationRange"].highpt_first  = 0
+    configs["JetsPtOrderIntegrationRange"].j_range_CL = 0.99
+    configs["JetsPtOrderIntegrationRange"].b_range_CL = 0.99
+    configs["Recoil"].int_code |= MEM.IntegrandType.Recoil
+    configs["Sudakov"].int_code |= MEM.IntegrandType.Sudakov
+    configs["Minimize"].do_minimize = 1
+    configs["Minimize"].int_code = 0
+
+    for cfn, cfg in configs.items():
+        cfg.mem_assumptions = set([])
+        #A function Event -> boolean which returns true if this ME should be calculated
+        cfg.do_calculate = lambda x: True
+        cfg.enabled = True
+
+    configs["default"].do_calculate = (
+        lambda x: len(x.wquark_candidate_jets) >= 2
+    )
+    configs["MissedWQ"].mem_assumptions.add("missed_wq")
+
+    #Can't integrate in dilepton
+    configs["MissedWQ"].do_calculate = (
+        lambda x: len(x.good_leptons) == 1 and
+        len(x.wquark_candidate_jets) >= 1
+    )
+    #only in 6J SL
+    configs["Sudakov"].do_calculate = (
+        lambda x: len(x.good_jets) == 6 and
+        len(x.good_leptons) == 1
+    )
+    return configs
+
+def add_timing(timing, task, wall, cpu):
+    """
+    Accumulates the time of an integration in the dict
+    (confname, hypo) -> [number of integrations, wall time, CPU time].
+    """
+    k = (task.confname, task.hypo)
+    if not timing.has_key(k):
+        timing[k] = [0, 0.0, 0.0]
+    timing[k][0] += 1
+    timing[k][1] += wall
+    timing[k][2] += cpu
+
+def scaled_calls(base_calls, factor):
+    """
+    Returns the number of integration points of a task with calls_factor factor.
+    """
+    return int(round(base_calls * factor))
+
+class MEMResult(object):
+    """
+    The MEMOutput fields of an integration as a python object, with the number
+    of integration points (calls) which were used, 0 if not integrated, and
+    the number of jet-quark assignments removed before the integration
+    (nperm_pruned, see TTH.MEAnalysis.permutations).
+    """
+    def __init__(self, r, calls=0, nperm_pruned=0):
+        for f in MEMOUTPUT_FIELDS:
+            setattr(self, f, getattr(r, f))
+        self.calls = calls
+        self.nperm_pruned = nperm_pruned
+
+def output_to_tuple(r):
+    return tuple([getattr(r, f) for f in MEMOUTPUT_FIELDS])
+
+def output_from_tuple(t):
+    r = MEM.MEMOutput()
+    for f, v in zip(MEMOUTPUT_FIELDS, t):
+        setattr(r, f, v)
+    return r
+
+class MEMRunner(object):
+    """
+    Runs MEMTasks with an in-process MEM.Integrand.
+    The time spent in the integrations is accumulated in timing, see add_timing.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        self.timing = {}
+        self.configs = build_mem_configs()
+        self.base_calls = {k: c.n_max_calls for (k, c) in self.configs.items()}
+
+        #Transfer functions for the jets, referenced by the eta bin in the task
+        self.tf_registry = TFRegistry(load_tf_matrix(conf), conf.jets["pt"])
+
+        #Create the ME integrator.
+        #Arguments specify the verbosity
+        self.integrator = MEM.Integrand(
+            #0,
+            MEM.output,
+            self.configs["default"]
+        )
+
+        #Create an emtpy std::vector<MEM::Permutations::Permutations>
+        self.permutations = getattr(ROOT, "std::vector<MEM::Permutations::Permutations>")()
+
+        #Assume that only jets passing CSV>0.5 are b quarks
+        self.permutations.push_back(MEM.Permutations.BTagged)
+
+        #Assume that only jets passing CSV<0.5 are l quarks
+        self.permutations.push_back(MEM.Permutations.QUntagged)
+
+        self.integrator.set_permutation_strategy(self.permutations)
+
+        #Create an empty vector for the integration variables
+        self.vars_to_integrate = getattr(ROOT, "std::vector<MEM::PSVar::PSVar>")()
+
+    def add_obj(self, objtype, **kwargs):
+        """
+        Add an event object (jet, lepton, MET) to the ME integrator.
+
+        objtype: specifies the object type
+        kwargs: p4s: spherical 4-momentum (pt, eta, phi, M) as a tuple
+                obsdict: dict of additional observables to pass to MEM
+                tf_dict: Dictionary of MEM.TFType->TF1 of transfer functions
+        """
+        if kwargs.has_key("p4s"):
+            pt, eta, phi, mass = kwargs.pop("p4s")
+            v = ROOT.TLorentzVector()
+            v.SetPtEtaPhiM(pt, eta, phi, mass);
+        elif kwargs.has_key("p4c"):
+            v = ROOT.TLorentzVector(*kwargs.pop("p4c"))
+        obs_dict = kwargs.pop("obs_dict", {})
+        tf_dict = kwargs.pop("tf_dict", {})
+
+        o = MEM.Object(v, objtype)
+
+        #Add observables from observable dictionary
+        for k, v in obs_dict.items():
+            o.addObs(k, v)
+        for k, v in tf_dict.items():
+            o.addTransferFunction(k, v)
+        self.integrator.push_back_object(o)
+
+    def configure(self, task):
+        """
+        Sets the MEM configuration and pushes the task objects to the integrator.
+        """
+        cfg = self.configs[task.confname]
+        cfg.n_max_calls = scaled_calls(self.base_calls[task.confname], task.calls_factor)
+        self.integrator.set_cfg(cfg)
+        self.vars_to_integrate.clear()
+        self.integrator.next_event()
+
+        for v in task.vars_to_integrate:
+            self.vars_to_integrate.push_back(v)
+
+        for (pt, eta, phi, mass, btagFlag, tf_eta_bin) in task.jets:
+            tf_b = self.tf_registry.Get_TF('b', tf_eta_bin)
+            tf_l = self.tf_registry.Get_TF('l', tf_eta_bin)
+            self.add_obj(
+                MEM.ObjectType.Jet,
+                p4s=(pt, eta, phi, mass),
+                obs_dict={MEM.Observable.BTAG: btagFlag},
+                tf_dict={
+                    MEM.TFType.bReco: tf_b, MEM.TFType.qReco: tf_l,
+                    MEM.TFType.bLost: tf_b, MEM.TFType.qLost: tf_l
+                }
+            )
+        for (pt, eta, phi, mass, charge) in task.leptons:
+            self.add_obj(
+                MEM.ObjectType.Lepton,
+                p4s=(pt, eta, phi, mass),
+                obs_dict={MEM.Observable.CHARGE: charge},
+            )
+        met_pt, met_phi = task.met
+        self.add_obj(
+            MEM.ObjectType.MET,
+            #MET is caused by massless object
+            p4s=(met_pt, 0, met_phi, 0),
+        )
+
+    def run(self, task):
+        """
+        Runs the integration of one task, returns the MEM.MEMOutput.
+        """
+        print "MEM started", ("hypo", task.hypo), ("conf", task.confname)
+        t0, c0 = time.time(), cpu_time()
+        self.configure(task)
+        r = self.integrator.run(
+            task.fstate,
+            task.hypo,
+            self.vars_to_integrate
+        )
+        self.last_time = (time.time() - t0, cpu_time() - c0)
+        add_timing(self.timing, task, *self.last_time)
+        print "MEM done", ("hypo", task.hypo), ("conf", task.confname)
+        return r
+
+    def run_all(self, tasks):
+        """
+        Runs the tasks one after the other, returns the list of MEMOutputs.
+        """
+        return [self.run(task) for task in tasks]
+
+    def submit(self, tasks):
+        #in-process, the tasks are run when collected
+        return tasks
+
+    def collect(self, handle):
+        return self.run_all(handle)
+
+    def close(self):
+        pass
+
+class MEMStub(MEMRunner):
+    """
+    Returns deterministic outputs which depend only on the task inputs,
+    without integrating, for tests of the analysis and of the MEM backends.
+    The relative error decreases as 1/sqrt(calls_factor), such that the
+    adaptive integration (MEAnalyzer) converges.
+    """
+    def __init__(self, conf=None):
+        self.conf = conf
+        self.timing = {}
+        self.last_time = (0.0, 0.0)
+
+    @staticmethod
+    def output_tuple(task):
+        """
+        Returns the MEMOutput fields of the task, see MEMOUTPUT_FIELDS.
+        """
+        h = hashlib.sha1(repr((
+            str(task.confname), int(task.hypo), int(task.fstate),
+            tuple([tuple([float(x) for x in j]) for j in task.jets]),
+            tuple([tuple([float(x) for x in l]) for l in task.leptons]),
+            tuple([float(x) for x in task.met]),
+            tuple([int(v) for v in task.vars_to_integrate]),
+        ))).hexdigest()
+        u = int(h[:8], 16) / float(0xffffffff)
+        p = math.pow(10.0, -20.0 - 10.0 * u)
+        p_err = 0.1 * p / math.sqrt(task.calls_factor)
+        return (p, p_err, 1.0, 0.0, 0, 1.0, len(task.jets))
+
+    def run(self, task):
+        t0, c0 = time.time(), cpu_time()
+        r = output_from_tuple(self.output_tuple(task))
+        self.last_time = (time.time() - t0, cpu_time() - c0)
+        add_timing(self.timing, task, *self.last_time)
+        return r
+
+#The MEMRunner of a worker process, created by the pool initializer
+_worker_runner = None
+
+def _init_worker(conf, stub=False):
+    global _worker_runner
+    if stub:
+        _worker_runner = MEMStub(conf)
+    else:
+        _worker_runner = MEMRunner(conf)
+
+def _run_task(task):
+    r = _worker_runner.run(task)
+    return output_to_tuple(r), _worker_runner.last_time
+
+class MEMPool(object):
+    """
+    Runs MEMTasks in a pool of worker processes, each holding its own
+    MEM.Integrand, MEMConfigs and transfer functions.
+    The outputs are returned in the order of the submitted tasks, the times
+    measured in the workers are accumulated in timing.
+    """
+    def __init__(self, conf, nworkers, stub=False):
+        self.nworkers = nworkers
+        self.timing = {}
+        self.pool = multiprocessing.Pool(nworkers, _init_worker, (conf, stub))
+
+    def submit(self, tasks, callback=None):
+        """
+        Queues the tasks in the pool, returns immediately.
+        callback: called in a thread of the pool with the list of
+            (output tuple, (wall, cpu)) when all the tasks are done
+        """
+        return tasks, self.pool.map_async(_run_task, tasks, chunksize=1, callback=callback)
+
+    def collect(self, handle):
+        tasks, result = handle
+        outputs = result.get()
+        for task, (t, times) in zip(tasks, outputs):
+            add_timing(self.timing, task, *times)
+        return [output_from_tuple(t) for (t, times) in outputs]
+
+    def run_all(self, tasks):
+        return self.collect(self.submit(tasks))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+def make_runner(conf):
+    """
+    Returns the MEM runner of the backend Conf.mem["backend"]:
+    "local": in-process, or a pool of Conf.mem["nWorkers"] worker processes
+    "server": the MEM server of the user at Conf.mem["serverSocket"], see MEMServer
+    "stub": deterministic outputs without integration, see MEMStub
+    """
+    backend = conf.mem.get("backend", "local")
+    if backend == "server":
+        from TTH.MEAnalysis.MEMServer import MEMClient, default_socket, load_authkey
+        return MEMClient(
+            conf.mem.get("serverSocket", None) or default_socket(),
+            load_authkey(conf.mem.get("serverKeyFile", None)),
+            TFRegistry(load_tf_matrix(conf), conf.jets["pt"]).Fingerprint()
+        )
+    elif backend == "stub":
+        return MEMStub(conf)
+    elif backend != "local":
+        raise ValueError("unknown MEM backend: {0}".format(backend))
+    nworkers = conf.mem.get("nWorkers", 1)
+    if nworkers > 1:
+        return MEMPool(conf, nworkers)
+    return MEMRunner(conf)
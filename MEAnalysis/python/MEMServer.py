@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+MEM server integrating the MEMTasks of all the MEAnalysis jobs of a user on a host.
+
+The server listens on a Unix socket and runs the tasks in a pool of worker
+processes (MEMIntegrator.MEMPool), in the order in which they arrive from
+all the connected jobs, such that the cores are kept busy even if the jobs
+are single-threaded. A job connects with MEMClient (Conf.mem["backend"] =
+"server"), which sends the tasks of an event without waiting for the results
+of the previous events, see MELooper (pipelineEvents).
+
+The transfer functions are loaded by the server from its own configuration,
+a client with a different TFRegistry fingerprint is refused.
+
+Messages (pickled, multiprocessing.connection):
+client -> server: ("hello", tf_fingerprint), ("run", request, tasks), ("close", )
+server -> client: ("hello", ok, message), ("done", request, [(output tuple, (wall, cpu))]),
+    ("error", request, message)
+
+The server and the clients of a user share a secret key, from the
+environment variable TTHBB13_MEM_KEY or from the file Conf.mem["serverKeyFile"]
+(default ~/.tthbb13_mem_key, created by the server if missing). By default the
+socket is in a directory of the temporary directory accessible only to the
+user, see default_socket.
+
+Usage: python MEMServer.py [--socket path] [--workers N] [--stub]
+The configuration is loaded as in MEAnalysis_heppy.py, from the file in the
+environment variable ME_CONF or from MEAnalysis_cfg_heppy.
+"""
+import os
+import imp
+import stat
+import errno
+import socket
+import binascii
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+from TTH.MEAnalysis.TFClasses import TFRegistry, load_tf_matrix
+from TTH.MEAnalysis.MEMIntegrator import MEMPool, add_timing, output_from_tuple
+import TTH.MEAnalysis.MEMIntegrator as MEMIntegrator
+
+#The environment variable with the key of the server and the clients
+AUTHKEY_ENV = "TTHBB13_MEM_KEY"
+
+def default_socket():
+    """
+    Returns the socket path of the MEM server of this user, in the directory
+    tthbb13_mem_<uid> of the temporary directory, created accessible only
+    to the user.
+    """
+    d = os.path.join(tempfile.gettempdir(), "tthbb13_mem_{0}".format(os.getuid()))
+    try:
+        os.mkdir(d, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(d)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+        stat.S_IMODE(st.st_mode) & 0077):
+        raise Exception("{0} is not a directory accessible only to the user".format(d))
+    return os.path.join(d, "mem.sock")
+
+def default_keyfile():
+    return os.path.expanduser("~/.tthbb13_mem_key")
+
+def load_authkey(keyfile=None, create=False):
+    """
+    Returns the key shared by the server and the clients of this user, from
+    the environment variable TTHBB13_MEM_KEY or from keyfile (default
+    default_keyfile()), which must be readable only by the user.
+
+    create (bool): write a random key to keyfile if it does not exist
+    """
+    if os.environ.get(AUTHKEY_ENV, "") != "":
+        return os.environ[AUTHKEY_ENV]
+    keyfile = keyfile or default_keyfile()
+    if create and not os.path.exists(keyfile):
+        fd = os.open(keyfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        os.write(fd, binascii.hexlify(os.urandom(32)))
+        os.close(fd)
+        print "created the MEM server key", keyfile
+    if not os.path.isfile(keyfile):
+        raise Exception("no MEM server key: set {0} or start the server to create {1}".format(
+            AUTHKEY_ENV, keyfile
+        ))
+    if stat.S_IMODE(os.stat(keyfile).st_mode) & 0077:
+        raise Exception("{0} must be readable only by the user".format(keyfile))
+    return open(keyfile).read().strip()
+
+def socket_in_use(address):
+    """
+    Returns True if a server accepts connections on the Unix socket.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(address)
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+def _serve_task(task):
+    """
+    Runs a task in a worker of the pool, returns (output tuple, times) or
+    (None, error message).
+    """
+    try:
+        return MEMIntegrator._run_task(task)
+    except Exception as e:
+        return None, traceback.format_exc()
+
+class MEMServerPool(MEMPool):
+    """
+    The worker pool of the server, running the tasks with _serve_task.
+    """
+    def submit(self, tasks, callback=None):
+        return tasks, self.pool.map_async(_serve_task, tasks, chunksize=1, callback=callback)
+
+class MEMServer(object):
+    """
+    address (string): path of the Unix socket
+    nworkers (int): number of worker processes
+    authkey (string): shared key of the server and the clients, None for
+        multiprocessing.current_process().authkey
+    stub (bool): run MEMIntegrator.MEMStub in the workers, for tests
+    """
+    def __init__(self, conf, address, nworkers, authkey=None, stub=False):
+        self.address = address
+        self.stub = stub
+
+        #a socket left by a server which was killed, not one of a running server
+        if os.path.exists(address):
+            if socket_in_use(address):
+                raise Exception("a MEM server is already listening on {0}".format(address))
+            print "removing stale socket", address
+            os.remove(address)
+
+        if stub:
+            self.tf_fingerprint = None
+        else:
+            self.tf_fingerprint = TFRegistry(load_tf_matrix(conf), conf.jets["pt"]).Fingerprint()
+        self.pool = MEMServerPool(conf, nworkers, stub)
+        self.listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        self.closed = False
+        print "MEM server listening on {0} with {1} workers".format(address, nworkers)
+
+    def serve(self):
+        """
+        Accepts clients until interrupted, each is handled in its own thread.
+        """
+        try:
+            while not self.closed:
+                try:
+                    conn = self.listener.accept()
+                except (AuthenticationError, EOFError) as e:
+                    #a wrong key, or a connection closed before the
+                    #authentication (e.g. socket_in_use)
+                    print "refused client:", e
+                    continue
+                except IOError as e:
+                    #the listener was closed
+                    if self.closed:
+                        break
+                    print "refused client:", e
+                    continue
+                t = threading.Thread(target=self.handle, args=(conn, ))
+                t.daemon = True
+                t.start()
+        except KeyboardInterrupt:
+            print "MEM server stopped"
+        finally:
+            self.close()
+
+    def handle(self, conn):
+        """
+        Receives the requests of one client and queues their tasks in the pool.
+        The replies are sent by the pool threads when all the tasks of a
+        request are done, possibly not in the order of the requests.
+        """
+        lock = threading.Lock()
+        def send(msg):
+            with lock:
+                try:
+                    conn.send(msg)
+                except IOError:
+                    #the client is gone
+                    pass
+
+        try:
+            msg = conn.recv()
+            ok = msg[0] == "hello" and (self.stub or msg[1] == self.tf_fingerprint)
+            send(("hello", ok, "" if ok else "transfer functions differ from the server"))
+            if not ok:
+                return
+            while True:
+                msg = conn.recv()
+                if msg[0] == "close":
+                    break
+                request, tasks = msg[1], msg[2]
+                if len(tasks) == 0:
+                    send(("done", request, []))
+                    continue
+                self.pool.submit(tasks, callback=
+                    lambda outputs, request=request: send(self.reply(request, outputs))
+                )
+        except EOFError:
+            pass
+        finally:
+            conn.close()
+
+    @staticmethod
+    def reply(request, outputs):
+        errors = [times for (t, times) in outputs if t is None]
+        if len(errors) > 0:
+            return ("error", request, errors[0])
+        return ("done", request, outputs)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.listener.close()
+        self.pool.close()
+
+class MEMClient(object):
+    """
+    MEM runner sending the tasks to the server of the host.
+    The integration times measured in the server workers are accumulated
+    in timing, see MEMIntegrator.add_timing.
+    """
+    def __init__(self, address, authkey, tf_fingerprint):
+        self.address = address
+        self.timing = {}
+        self.conn = Client(address, family="AF_UNIX", authkey=authkey)
+        self.conn.send(("hello", tf_fingerprint))
+        msg = self.conn.recv()
+        if not msg[1]:
+            raise Exception("MEM server at {0}: {1}".format(address, msg[2]))
+        self.nrequests = 0
+        #replies received while waiting for another request
+        self.replies = {}
+
+    def submit(self, tasks):
+        request = self.nrequests
+        self.nrequests += 1
+        self.conn.send(("run", request, list(tasks)))
+        return request, tasks
+
+    def collect(self, handle):
+        request, tasks = handle
+        while not self.replies.has_key(request):
+            msg = self.conn.recv()
+            self.replies[msg[1]] = msg
+        msg = self.replies.pop(request)
+        if msg[0] == "error":
+            raise Exception("MEM server at {0} failed:\n{1}".format(self.address, msg[2]))
+        outputs = msg[2]
+        for task, (t, times) in zip(tasks, outputs):
+            add_timing(self.timing, task, *times)
+        return [output_from_tuple(t) for (t, times) in outputs]
+
+    def run_all(self, tasks):
+        return self.collect(self.submit(tasks))
+
+    def close(self):
+        try:
+            self.conn.send(("close", ))
+        except IOError:
+            pass
+        self.conn.close()
+
+def load_conf():
+    """
+    Returns the configuration with the transfer functions, as in MEAnalysis_heppy.py.
+    """
+    if os.environ.has_key("ME_CONF"):
+        meconf = imp.load_source("meconf", os.environ["ME_CONF"])
+        Conf = meconf.Conf
+    else:
+        from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+    conf = Conf()
+    load_tf_matrix(conf)
+    return conf
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="MEM server for the MEAnalysis jobs of this host")
+    parser.add_argument("--socket", default=None,
+        help="Unix socket, default Conf.mem['serverSocket'] or default_socket()"
+    )
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--stub", action="store_true", help="return MEMStub outputs, for tests")
+    args = parser.parse_args()
+
+    conf = load_conf()
+    server = MEMServer(
+        conf, args.socket or conf.mem.get("serverSocket", None) or default_socket(), args.workers,
+        load_authkey(conf.mem.get("serverKeyFile", None), create=True), args.stub
+    )
+    server.serve()
@@ -0,0 +1,163 @@
+"""
+Memory growth of the analyzers of a MEAnalysis job.
+
+Every N calls of an analyzer, the resident memory (RSS) of the process is
+measured before and after its process method (or submit and collect, see
+Timing.timed_methods), and the allocations made
+during the call are recorded: with tracemalloc (if the interpreter provides
+it) the allocated size per source line, otherwise the change in the number
+of live python objects per type, from the garbage collector.
+
+A stage is flagged as growing if the RSS growth summed over its sampled calls
+never decreased and is larger than a threshold. The report is printed at
+the end of the job and written to memory.txt in the output directory, see
+MELooper (memoryReportEvents).
+"""
+import gc
+import resource
+
+from TTH.MEAnalysis.Timing import timed_methods
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def rss_kb():
+    """
+    Returns the resident memory of the process in kB.
+    """
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    #the maximum RSS, in kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def object_counts():
+    """
+    Returns a dict type name -> number of live objects tracked by the gc.
+    """
+    counts = {}
+    for o in gc.get_objects():
+        t = type(o).__name__
+        counts[t] = counts.get(t, 0) + 1
+    return counts
+
+class StageMemory(object):
+    """
+    name (string): the analyzer name
+    ncalls (int): number of calls of the analyzer
+    growth (int): the total RSS growth in kB during the sampled calls
+    samples (list of (ncalls, growth)): growth after each sampled call
+    allocations (dict): source line (tracemalloc) or object type -> bytes or
+        number of objects allocated during the sampled calls
+    """
+    def __init__(self, name):
+        self.name = name
+        self.ncalls = 0
+        self.growth = 0
+        self.samples = []
+        self.allocations = {}
+
+    def add_sample(self, before, after, allocations):
+        self.growth += after - before
+        self.samples += [(self.ncalls, self.growth)]
+        for k, v in allocations.items():
+            self.allocations[k] = self.allocations.get(k, 0) + v
+
+    def is_growing(self, threshold_kb, min_samples=3):
+        """
+        Returns True if the growth of the stage never decreased and is larger
+        than threshold_kb.
+        """
+        if len(self.samples) < min_samples:
+            return False
+        growth = [g for (n, g) in self.samples]
+        monotonic = all([b >= a for (a, b) in zip(growth[:-1], growth[1:])])
+        return monotonic and self.growth > threshold_kb
+
+    def top_allocations(self, n):
+        return sorted(self.allocations.items(), key=lambda x: x[1], reverse=True)[:n]
+
+class MemoryMonitor(object):
+    """
+    Samples the memory of the watched analyzers every `every` calls.
+
+    every (int): sample each analyzer every this many calls
+    top (int): number of allocation sites or types in the report
+    threshold_kb (float): minimum growth of a flagged stage
+    use_tracemalloc (bool): use tracemalloc if available, otherwise gc object counts
+    """
+    def __init__(self, every, top=10, threshold_kb=1024, use_tracemalloc=True):
+        self.every = every
+        self.top = top
+        self.threshold_kb = threshold_kb
+        self.use_tracemalloc = use_tracemalloc and tracemalloc is not None
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.stages = []
+
+    def _snapshot(self):
+        if self.use_tracemalloc:
+            return tracemalloc.take_snapshot()
+        return object_counts()
+
+    def _allocations(self, before, after):
+        if self.use_tracemalloc:
+            return {
+                str(st.traceback): st.size_diff
+                for st in after.compare_to(before, "lineno") if st.size_diff > 0
+            }
+        return {
+            k: v - before.get(k, 0)
+            for (k, v) in after.items() if v > before.get(k, 0)
+        }
+
+    def watch(self, analyzer):
+        """
+        Wraps the methods of the analyzer called for each event
+        (Timing.timed_methods) to sample its memory. The calls are counted
+        by the last method, each method is sampled every N of its calls.
+        """
+        st = StageMemory(analyzer.name)
+        self.stages += [st]
+        methods = timed_methods(analyzer)
+        for method in methods:
+            func = getattr(analyzer, method)
+            def sampled(event, func=func, last=(method == methods[-1]), ncalls=[0]):
+                ncalls[0] += 1
+                if last:
+                    st.ncalls += 1
+                if ncalls[0] % self.every != 0:
+                    return func(event)
+                snap_before = self._snapshot()
+                before = rss_kb()
+                ret = func(event)
+                after = rss_kb()
+                snap_after = self._snapshot()
+                st.add_sample(before, after, self._allocations(snap_before, snap_after))
+                return ret
+            setattr(analyzer, method, sampled)
+
+    def growing(self):
+        return [st for st in self.stages if st.is_growing(self.threshold_kb)]
+
+    def report(self):
+        unit = "bytes" if self.use_tracemalloc else "objects"
+        lines = ["memory report, sampled every {0} calls, RSS {1} kB".format(self.every, rss_kb())]
+        lines += ["{0:<30} {1:>10} {2:>10} {3:>14} {4:>8}".format(
+            "stage", "calls", "samples", "growth [kB]", "growing"
+        )]
+        for st in self.stages:
+            lines += ["{0:<30} {1:>10} {2:>10} {3:>14} {4:>8}".format(
+                st.name, st.ncalls, len(st.samples), st.growth,
+                "YES" if st.is_growing(self.threshold_kb) else "no"
+            )]
+        for st in self.stages:
+            lines += ["", "{0}: top allocations ({1})".format(st.name, unit)]
+            for k, v in st.top_allocations(self.top):
+                lines += ["    {0:>12} {1}".format(v, k)]
+        return "\n".join(lines)
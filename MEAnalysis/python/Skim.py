@@ -0,0 +1,83 @@
+"""
+Two-phase workflow: skim the events to integrate, then run only the MEM.
+
+Phase 1 (Conf.general["workflow"] = "skim") runs the selection and the
+categorization up to MEAnalyzer and writes the full output tree without the
+MEM results (tree.root) and a compact skim (skim.root) with the events with
+cat_btag == "H" and the inputs of MEAnalyzer (the jets, leptons, MET, ME
+category and gen-level matching), see metree.getSkimTreeProducer.
+
+Phase 2 (workflow "mem") reads the skim with SkimEventAnalyzer, which
+restores these event attributes, and runs only MEAnalyzer. The output tree
+contains the event ids and the MEM results, see metree.getMEMTreeProducer.
+
+The MEM results are attached to the full tree of phase 1 as a friend tree
+with the same entries by mem_join.py.
+"""
+from PhysicsTools.HeppyCore.framework.analyzer import Analyzer
+from TTH.MEAnalysis.MECoreAnalyzers import FilterAnalyzer
+from TTH.MEAnalysis.VHbbTree import InputObject
+from TTH.MEAnalysis.metree import CORE_VARIABLES
+
+#The event attribute -> skim collection and the stored fields of its objects
+JET_FIELDS = ["pt", "eta", "phi", "mass", "btagFlag", "tf_eta_bin"]
+LEPTON_FIELDS = ["pt", "eta", "phi", "mass", "charge"]
+GEN_FIELDS = ["pt", "eta", "phi", "mass"]
+SKIM_COLLECTIONS = {
+    "good_jets": ("jets", JET_FIELDS),
+    "btagged_jets": ("bjets", JET_FIELDS),
+    "buntagged_jets": ("ujets", JET_FIELDS),
+    "wquark_candidate_jets": ("qjets", JET_FIELDS),
+    "good_leptons": ("leps", LEPTON_FIELDS),
+    "GenBQuarkFromH": ("GenBQuarkFromH", GEN_FIELDS),
+}
+
+#The gen-level matching used by Conf.mem["requireMatched"], see GenTTHAnalyzer
+MATCH_LABELS = ["wq", "wq_btag", "tb", "tb_btag", "hb", "hb_btag"]
+
+#The categories of MECategoryAnalyzer, by the stored number
+CATEGORIES = {-1: "NOCAT", 1: "cat1", 2: "cat2", 3: "cat3", 6: "cat6"}
+BTAG_CATEGORIES = {-1: "NOCAT", 0: "L", 1: "H"}
+
+class SkimFilterAnalyzer(FilterAnalyzer):
+    """
+    Passes the events for which the MEM is calculated (cat_btag == "H"),
+    to be written to the skim.
+    """
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        self.conf = cfg_ana._conf
+        super(SkimFilterAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+
+    def inputs(self):
+        return {}, CORE_VARIABLES + ["met_pt", "met_phi"]
+
+    def process(self, event):
+        self.counters["processing"].inc("processed")
+        passes = event.cat_btag == "H"
+        if passes:
+            self.counters["processing"].inc("passes")
+        return passes
+
+class SkimEventAnalyzer(Analyzer):
+    """
+    Restores the inputs of MEAnalyzer from the skim, instead of
+    VHbbTree.EventAnalyzer and the selection analyzers.
+    """
+    def inputs(self):
+        return (
+            {coll: fields for (coll, fields) in SKIM_COLLECTIONS.values()},
+            CORE_VARIABLES + ["met_pt", "met_phi", "cat", "cat_btag", "btag_LR_4b_2b"] +
+            ["nMatch_" + l for l in MATCH_LABELS]
+        )
+
+    def process(self, event):
+        inp = event.input
+        for name, (coll, fields) in SKIM_COLLECTIONS.items():
+            setattr(event, name, InputObject.make_array(event, coll, fields))
+        event.cat = CATEGORIES.get(int(inp.cat), "NOCAT")
+        event.cat_btag = BTAG_CATEGORIES.get(int(inp.cat_btag), "NOCAT")
+        event.catn = int(inp.cat)
+        event.cat_btag_n = int(inp.cat_btag)
+        event.btag_LR_4b_2b = inp.btag_LR_4b_2b
+        for l in MATCH_LABELS:
+            setattr(event, "nMatch_" + l, int(getattr(inp, "nMatch_" + l)))
@@ -0,0 +1,154 @@
+"""
+Startup profile of the MEAnalysis jobs.
+
+With --startup-profile on the command line of MEAnalysis_heppy.py or of the
+grid-control script, the wall time of every module import and of the
+initialisation steps (loading the configuration and the samples, creating the
+looper, and the steps deferred to the first event which needs them: the MEM
+integrator library, the transfer functions and the MEM runner) is recorded and
+printed at the end of the job.
+
+The steps are timed with stage(name), which does nothing without a profile,
+such that the modules can mark their initialisation unconditionally.
+"""
+import sys
+import time
+import __builtin__
+from contextlib import contextmanager
+
+from TTH.MEAnalysis.Timing import cpu_time
+
+#the profile of this job, see start
+profile = None
+
+def import_candidates(name, globals, level):
+    """
+    Returns the possible names of the module of an import statement, the
+    module within the package first for the relative imports.
+    """
+    if level == 0 or not globals or not globals.get("__name__"):
+        return [name]
+    package = globals.get("__package__")
+    if not package:
+        package = globals["__name__"]
+        if not "__path__" in globals:
+            package = package.rpartition(".")[0]
+    if level > 1:
+        package = package.rsplit(".", level - 1)[0]
+    if not package:
+        return [name]
+    relative = package + "." + name if name else package
+    #implicit relative import, the module of the package if it exists
+    if level < 0:
+        return [relative, name]
+    return [relative]
+
+def loaded_module(names):
+    """
+    Returns the first of the names which is a loaded module, or None.
+    """
+    for name in names:
+        if sys.modules.get(name, None) is not None:
+            return name
+    return None
+
+class StartupProfile(object):
+    """
+    Import and initialisation times since the start of the job.
+
+    imports: list of (module, wall time including its own imports, depth),
+        in the order in which the imports finish
+    stages: list of (name, start time since the start of the job, wall, cpu)
+    """
+    def __init__(self):
+        self.t0 = time.time()
+        self.imports = []
+        self.stages = []
+        self.depth = 0
+        self.active = False
+        self.orig_import = None
+        self.timed_import = None
+
+    def install(self):
+        """
+        Times the imports of the modules which are not yet loaded.
+        """
+        self.orig_import = __builtin__.__import__
+        orig_import = self.orig_import
+        def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+            candidates = import_candidates(name, globals, level)
+            if not self.active or loaded_module(candidates) is not None:
+                return orig_import(name, globals, locals, fromlist, level)
+            t0 = time.time()
+            self.depth += 1
+            try:
+                return orig_import(name, globals, locals, fromlist, level)
+            finally:
+                self.depth -= 1
+                self.imports += [(loaded_module(candidates) or name, time.time() - t0, self.depth)]
+        self.timed_import = timed_import
+        self.active = True
+        __builtin__.__import__ = timed_import
+
+    def uninstall(self):
+        self.active = False
+        #another hook may have been installed on top of this one (e.g. by ROOT)
+        if self.orig_import is not None and __builtin__.__import__ is self.timed_import:
+            __builtin__.__import__ = self.orig_import
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.time()
+        c0 = cpu_time()
+        try:
+            yield
+        finally:
+            self.stages += [(name, t0 - self.t0, time.time() - t0, cpu_time() - c0)]
+
+    def table(self, nimports=20):
+        """
+        Returns the report: the stages in order, the imports done directly
+        by the job and the slowest imports.
+        """
+        lines = ["{0:<40} {1:>10} {2:>10} {3:>10}".format("stage", "start [s]", "wall [s]", "cpu [s]")]
+        for (name, start, wall, cpu) in self.stages:
+            lines += ["{0:<40} {1:>10.3f} {2:>10.3f} {3:>10.3f}".format(name, start, wall, cpu)]
+        top = [(name, wall) for (name, wall, depth) in self.imports if depth == 0]
+        lines += ["", "{0:<40} {1:>10}".format("import (by the job)", "wall [s]")]
+        for (name, wall) in top:
+            lines += ["{0:<40} {1:>10.3f}".format(name, wall)]
+        lines += ["{0:<40} {1:>10.3f}".format("total", sum([w for (n, w) in top]))]
+        lines += ["", "{0:<40} {1:>10}".format("slowest imports (incl. their imports)", "wall [s]")]
+        for (name, wall, depth) in sorted(self.imports, key=lambda x: -x[1])[:nimports]:
+            lines += ["{0:<40} {1:>10.3f}".format(name, wall)]
+        return "\n".join(lines)
+
+def start(argv):
+    """
+    Starts the profile if --startup-profile is in argv, returns the profile or None.
+    """
+    global profile
+    if profile is None and "--startup-profile" in argv:
+        profile = StartupProfile()
+        profile.install()
+    return profile
+
+@contextmanager
+def stage(name):
+    """
+    Times the step with the profile of the job, if any.
+    """
+    if profile is None:
+        yield
+    else:
+        with profile.stage(name):
+            yield
+
+def report():
+    """
+    Prints the report of the profile, if any.
+    """
+    if profile is not None:
+        profile.uninstall()
+        print "startup profile:"
+        print profile.table()
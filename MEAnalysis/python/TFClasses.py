@@ -6,6 +6,7 @@ import re
 import os
 import ROOT
 import copy
+import hashlib
 
 class TF:
 
@@ -514,3 +515,83 @@ class function:
         
         # Exiting without problems
         return 0
+
+
+
+class TFRegistry:
+
+    # Holds the jet transfer functions and CDFs, compiled once from the TF
+    #   matrix and shared by all jets of all events.
+    #   TFs are keyed by (particle, i_eta, eval_gen), CDFs by (particle, i_eta).
+    #   eval_gen follows Make_Formula: True means [0] = reco, x = gen,
+    #   False means [0] = gen, x = reco.
+
+    def __init__(self, tf_matrix, pt_cutoff, particles = ['b', 'l'], n_eta_bins = 2):
+        self.tfs = {}
+        self.cdfs = {}
+        self.pt_cutoff = pt_cutoff
+
+        for particle in particles:
+            for i_eta in range( n_eta_bins ):
+                tf = tf_matrix[particle][i_eta]
+
+                for eval_gen in [True, False]:
+                    f1 = tf.Make_Formula( eval_gen )
+                    f1.SetName( 'tf_{0}_{1}_{2}'.format(
+                        particle, i_eta, 'reco' if eval_gen else 'gen' ) )
+                    self.tfs[ (particle, i_eta, eval_gen) ] = f1
+
+                # [0] is the gen-level value, x the pt cutoff, which is fixed by the jet selection
+                cdf = tf.Make_CDF()
+                cdf.SetName( 'cdf_{0}_{1}'.format( particle, i_eta ) )
+                cdf.SetParameter( 0, pt_cutoff )
+                self.cdfs[ (particle, i_eta) ] = cdf
+
+
+    @staticmethod
+    def Eta_Bin( eta ):
+        if abs(eta) > 1.0:
+            return 1
+        return 0
+
+
+    def Get_TF( self, particle, i_eta, eval_gen = False ):
+        return self.tfs[ (particle, i_eta, eval_gen) ]
+
+
+    def Get_CDF( self, particle, i_eta ):
+        return self.cdfs[ (particle, i_eta) ]
+
+
+    def Fingerprint( self ):
+
+        # Hash of the formulas and parameter values of all TFs and CDFs,
+        #   identifies the transfer functions e.g. for caching MEM results.
+        #   Parameter [0] is the evaluation variable, set by the user of the TF1.
+        h = hashlib.sha1()
+        h.update( repr( self.pt_cutoff ) )
+        for funcs in [ self.tfs, self.cdfs ]:
+            for key in sorted( funcs.keys() ):
+                f1 = funcs[key]
+                h.update( repr( key ) )
+                h.update( f1.GetTitle() )
+                h.update( repr( [ f1.GetParameter(i) for i in range( 1, f1.GetNpar() ) ] ) )
+        return h.hexdigest()
+
+
+def load_tf_matrix( conf ):
+
+    # Returns the TF matrix of the configuration, unpickled from
+    #   conf.general["transferFunctionsPickle"] on the first call and kept
+    #   as conf.tf_matrix, such that only the jobs which use the TFs load them.
+    if getattr( conf, 'tf_matrix', None ) is None:
+        import sys
+        import cPickle as pickle
+        from TTH.MEAnalysis import Startup
+        # The pickled classes refer to the module TFClasses
+        sys.modules.setdefault( 'TFClasses', sys.modules[__name__] )
+        with Startup.stage( 'transfer functions' ):
+            pi_file = open( conf.general["transferFunctionsPickle"], 'rb' )
+            conf.tf_matrix = pickle.load( pi_file )
+            pi_file.close()
+    return conf.tf_matrix
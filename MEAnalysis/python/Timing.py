@@ -0,0 +1,178 @@
+"""
+Wall and CPU time of the stages of a MEAnalysis job.
+
+The looper measures each analyzer (the time spent in its process method, or
+in submit and collect, see timed_methods) and the whole event loop,
+MEAnalyzer adds one stage per MEM configuration and hypothesis with the
+time of the integrations. The report is printed at the end of the job and
+written as the tree "timing" to tree.root, such that the reports of many
+jobs can be merged, e.g. with tthbb.py --action timing.
+
+With a worker pool (Conf.mem["nWorkers"] > 1), the CPU time of the
+integrations is measured in the workers and is not part of the CPU time of
+the MEAnalyzer stage.
+"""
+import os
+import time
+from array import array
+
+TIMING_TREE = "timing"
+
+def timed_methods(analyzer):
+    """
+    Returns the methods of the analyzer called for each event: submit and
+    collect for the analyzers processing an event in two steps (MEAnalyzer,
+    see MELooper pipelineEvents), of which process calls both, otherwise
+    process.
+    """
+    if hasattr(analyzer, "submit") and hasattr(analyzer, "collect"):
+        return ["submit", "collect"]
+    return ["process"]
+
+def cpu_time():
+    """
+    Returns the user + system CPU time of this process in seconds.
+    """
+    t = os.times()
+    return t[0] + t[1]
+
+class StageTiming(object):
+    """
+    name (string): e.g. the analyzer name
+    ncalls (int): number of processed events (integrations for the MEM stages)
+    npassed (int): number of events which passed the stage
+    wall, cpu (float): total wall and CPU time in seconds
+    """
+    def __init__(self, name, ncalls=0, npassed=0, wall=0.0, cpu=0.0):
+        self.name = name
+        self.ncalls = ncalls
+        self.npassed = npassed
+        self.wall = wall
+        self.cpu = cpu
+
+    def add(self, wall, cpu, passed=True, ncalls=1):
+        self.ncalls += ncalls
+        if passed:
+            self.npassed += ncalls
+        self.wall += wall
+        self.cpu += cpu
+
+    def merge(self, other):
+        self.ncalls += other.ncalls
+        self.npassed += other.npassed
+        self.wall += other.wall
+        self.cpu += other.cpu
+
+    def rate(self):
+        """
+        Returns the number of calls per second of wall time.
+        """
+        if self.wall <= 0:
+            return 0.0
+        return self.ncalls / self.wall
+
+class TimingReport(object):
+    """
+    The StageTimings of a job, in the order in which they were added.
+    """
+    def __init__(self):
+        self.stages = []
+        self.by_name = {}
+
+    def stage(self, name):
+        """
+        Returns the StageTiming with this name, created if needed.
+        """
+        if not self.by_name.has_key(name):
+            st = StageTiming(name)
+            self.stages += [st]
+            self.by_name[name] = st
+        return self.by_name[name]
+
+    def time_analyzer(self, analyzer):
+        """
+        Wraps the methods of the analyzer called for each event (timed_methods)
+        to measure its time. An event is counted by the last method, or by
+        the one which rejects it.
+        """
+        st = self.stage(analyzer.name)
+        methods = timed_methods(analyzer)
+        for method in methods:
+            func = getattr(analyzer, method)
+            def timed(event, func=func, last=(method == methods[-1])):
+                t0, c0 = time.time(), cpu_time()
+                ret = func(event)
+                counted = last or ret == False
+                st.add(time.time() - t0, cpu_time() - c0, ret != False, 1 if counted else 0)
+                return ret
+            setattr(analyzer, method, timed)
+
+    def add_stage(self, name, ncalls, wall, cpu):
+        """
+        Adds the time of a stage which is measured elsewhere, e.g. the MEM integrations.
+        """
+        self.stage(name).merge(StageTiming(name, ncalls, ncalls, wall, cpu))
+
+    def merge(self, other):
+        for st in other.stages:
+            self.stage(st.name).merge(st)
+
+    def table(self):
+        lines = ["{0:<40} {1:>10} {2:>10} {3:>12} {4:>12} {5:>12} {6:>10}".format(
+            "stage", "calls", "passed", "wall [s]", "cpu [s]", "wall/call [ms]", "calls/s"
+        )]
+        for st in self.stages:
+            lines += ["{0:<40} {1:>10} {2:>10} {3:>12.2f} {4:>12.2f} {5:>12.3f} {6:>10.1f}".format(
+                st.name, st.ncalls, st.npassed, st.wall, st.cpu,
+                1000.0 * st.wall / st.ncalls if st.ncalls > 0 else 0.0,
+                st.rate()
+            )]
+        return "\n".join(lines)
+
+    def write(self, tfile):
+        """
+        Creates the TTree with one entry per stage in tfile, it is written
+        with the other objects when the file is written.
+        """
+        import ROOT
+        tfile.cd()
+        tree = ROOT.TTree(TIMING_TREE, "wall and CPU time of the job stages")
+        name = ROOT.std.string()
+        ncalls = array("l", [0])
+        npassed = array("l", [0])
+        wall = array("d", [0])
+        cpu = array("d", [0])
+        tree.Branch("stage", name)
+        tree.Branch("ncalls", ncalls, "ncalls/L")
+        tree.Branch("npassed", npassed, "npassed/L")
+        tree.Branch("wall", wall, "wall/D")
+        tree.Branch("cpu", cpu, "cpu/D")
+        for st in self.stages:
+            name.replace(0, name.size(), st.name)
+            ncalls[0] = st.ncalls
+            npassed[0] = st.npassed
+            wall[0] = st.wall
+            cpu[0] = st.cpu
+            tree.Fill()
+        return tree
+
+    @staticmethod
+    def read(fn):
+        """
+        Reads the report from the timing tree of a file, None if there is none.
+        """
+        import ROOT
+        tf = ROOT.TFile.Open(fn)
+        if tf == None or tf.IsZombie():
+            return None
+        tree = tf.Get(TIMING_TREE)
+        if tree == None:
+            tf.Close()
+            return None
+        report = TimingReport()
+        for i in range(tree.GetEntries()):
+            tree.GetEntry(i)
+            st = report.stage(str(tree.stage))
+            st.merge(StageTiming(str(tree.stage), tree.ncalls, tree.npassed, tree.wall, tree.cpu))
+        tf.Close()
+        return report
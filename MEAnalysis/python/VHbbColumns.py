@@ -0,0 +1,215 @@
+"""
+Columnar access to the VHbb heppy trees.
+
+Instead of constructing one VHbbTree object per jet/lepton/gen particle by
+reading tree.Jet_pt[n]-style accessors field by field, the needed branches
+are read in chunks of N entries into numpy arrays. Jagged collections are
+stored as flat content arrays plus offsets, and the analyzers get lightweight
+per-event views on top of these arrays, see Columns.
+
+The EventView of the entry replaces the tree as event.input, and the
+looper's chain reads no branches (see MELooper), such that each entry is
+read only once.
+"""
+import numpy as np
+import ROOT
+from PhysicsTools.HeppyCore.framework.analyzer import Analyzer
+from TTH.MEAnalysis.VHbbTree import MET
+from TTH.MEAnalysis.Columns import as_column, Chunk
+
+#root_numpy is optional, without it the chunks are filled entry by entry
+try:
+    from root_numpy import root2array
+except ImportError:
+    root2array = None
+
+#Fields of the generator-level particle collections
+GEN_FIELDS = ["pdgId", "pt", "eta", "phi", "mass", "charge", "status"]
+
+#Collections read from the input tree: collection name -> object fields.
+#The branches are called <collection>_<field>, the multiplicity n<collection>.
+COLLECTIONS = {
+    "Jet": [
+        "pt", "eta", "phi", "mass", "id",
+        "btagCSV", "btagCMVA",
+        "mcFlavour", "mcMatchId", "hadronFlavour",
+        "mcPt", "mcEta", "mcPhi", "mcM",
+    ],
+    "selLeptons": [
+        "pt", "eta", "phi", "mass", "pdgId", "charge",
+        "tightId", "looseIdPOG", "relIso03", "relIso04", "dxy", "dz",
+    ],
+    "GenWZQuark": GEN_FIELDS,
+    "GenBQuarkFromTop": GEN_FIELDS,
+    "GenBQuarkFromH": GEN_FIELDS,
+    "GenLepFromTop": GEN_FIELDS,
+    "GenNuFromTop": GEN_FIELDS,
+}
+
+#Per-event scalar branches
+SCALARS = ["met_pt", "met_phi", "met_sumEt", "met_genPt", "met_genPhi"]
+
+class ChunkedTreeReader(object):
+    """
+    Reads the configured branches of a tree in chunks of chunk_size entries.
+    Uses a separate TChain from the one used by the looper, such that reading
+    ahead does not change the current entry of event.input.
+    """
+    def __init__(self, files, tree_name, collections, scalars, chunk_size=1000):
+        self.files = files
+        self.tree_name = tree_name
+        self.chunk_size = chunk_size
+
+        self.chain = ROOT.TChain(tree_name)
+        for fn in files:
+            self.chain.Add(fn)
+        self.nentries = self.chain.GetEntries()
+
+        #Only read branches which exist in the input (e.g. no gen-level in data)
+        available = set([b.GetName() for b in self.chain.GetListOfBranches()])
+        self.scalars = [s for s in scalars if s in available]
+        self.collections = {}
+        for name, fields in collections.items():
+            if not "n" + name in available:
+                continue
+            self.collections[name] = [
+                f for f in fields if "{0}_{1}".format(name, f) in available
+            ]
+        self.chunk = None
+
+        #Read only the needed branches also in the entry-by-entry fallback
+        self.chain.SetBranchStatus("*", 0)
+        for br in self.branches():
+            self.chain.SetBranchStatus(br, 1)
+
+    def branches(self):
+        brs = list(self.scalars)
+        for name, fields in self.collections.items():
+            brs += ["n" + name]
+            brs += ["{0}_{1}".format(name, f) for f in fields]
+        return brs
+
+    def get(self, entry):
+        """
+        Returns the EventView for a tree entry, reading a new chunk if needed.
+        """
+        if self.chunk is None or not self.chunk.contains(entry):
+            self.chunk = self.read(entry, min(entry + self.chunk_size, self.nentries))
+        return self.chunk.event(entry)
+
+    def read(self, start, stop):
+        if root2array is not None:
+            arr = root2array(
+                self.files, self.tree_name,
+                branches=self.branches(), start=start, stop=stop
+            )
+            scalars = {s: as_column(arr[s]) for s in self.scalars}
+            collections = {}
+            for name, fields in self.collections.items():
+                counts = arr["n" + name].astype(np.int64)
+                offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+                np.cumsum(counts, out=offsets[1:])
+                content = {}
+                for f in fields:
+                    br = arr["{0}_{1}".format(name, f)]
+                    if len(br) > 0:
+                        content[f] = as_column(np.concatenate(list(br)))
+                    else:
+                        content[f] = as_column([])
+                collections[name] = (offsets, content)
+            return Chunk(start, stop, scalars, collections)
+        return self.read_entries(start, stop)
+
+    def read_entries(self, start, stop):
+        """
+        Fallback without root_numpy: fills the chunk arrays entry by entry.
+        """
+        scalars = {s: [] for s in self.scalars}
+        counts = {name: [] for name in self.collections.keys()}
+        content = {
+            name: {f: [] for f in fields}
+            for name, fields in self.collections.items()
+        }
+        tree = self.chain
+        for entry in range(start, stop):
+            tree.GetEntry(entry)
+            for s in self.scalars:
+                scalars[s].append(getattr(tree, s))
+            for name, fields in self.collections.items():
+                n = int(getattr(tree, "n" + name))
+                counts[name].append(n)
+                for f in fields:
+                    buf = getattr(tree, "{0}_{1}".format(name, f))
+                    content[name][f].extend(buf[i] for i in range(n))
+
+        collections = {}
+        for name, fields in self.collections.items():
+            offsets = np.zeros(len(counts[name]) + 1, dtype=np.int64)
+            np.cumsum(counts[name], out=offsets[1:])
+            collections[name] = (
+                offsets,
+                {f: as_column(content[name][f]) for f in fields}
+            )
+        return Chunk(
+            start, stop,
+            {s: as_column(v) for (s, v) in scalars.items()},
+            collections
+        )
+
+class ColumnarEventAnalyzer(Analyzer):
+    """
+    Replaces VHbbTree.EventAnalyzer: fills event.Jet, event.selLeptons, the
+    generator-level collections and event.met from chunked columnar reads.
+
+    Configuration:
+    chunkSize (int): number of tree entries to read at once
+
+    It must be the first analyzer of the sequence, the analyzers after it
+    read the branches declared by all the analyzers from event.input.
+
+    Returns:
+    event.input (EventView): the per-event view, replacing the input tree if
+        all the analyzers declare their inputs
+    event.<collection> (list of ObjectView) for the collections in COLLECTIONS
+        and the declared ones
+    event.met (list of VHbbTree.MET)
+    event.columns (EventView): the same view, giving access to the whole
+        chunk as contiguous arrays via event.columns.chunk
+    """
+    #the looper does not read the entries of its chain, see MELooper
+    reads_input = True
+
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(ColumnarEventAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.chunk_size = getattr(cfg_ana, "chunkSize", 1000)
+        self.collections = COLLECTIONS
+        self.scalars = SCALARS
+        #event.input is replaced only if all the inputs are read, see set_inputs
+        self.replace_input = False
+
+    def inputs(self):
+        return {}, SCALARS
+
+    def set_inputs(self, collections, scalars):
+        """
+        Reads the branches declared by all the analyzers, see InputBranches.
+        """
+        self.collections = dict(collections)
+        self.scalars = sorted(set(SCALARS) | set(scalars))
+        self.replace_input = True
+
+    def beginLoop(self, setup):
+        super(ColumnarEventAnalyzer, self).beginLoop(setup)
+        self.reader = ChunkedTreeReader(
+            self.cfg_comp.files, self.cfg_comp.tree_name,
+            self.collections, self.scalars, self.chunk_size
+        )
+
+    def process(self, event):
+        cols = self.reader.get(event.iEv)
+        if self.replace_input:
+            event.input = cols
+        event.columns = cols
+        for name in set(COLLECTIONS.keys()) | set(self.collections.keys()):
+            setattr(event, name, cols.objects(name))
+        event.met = [MET(tree=cols)]
@@ -502,11 +502,39 @@ class MET:
     def make_array(event):
         return [MET(tree=event.input)]
 
+class InputObject:
+    """
+    An object of a collection of the input tree, with only the given fields
+    (see InputBranches), read from the branches <collection>_<field>.
+    """
+    def __init__(self, tree, collection, fields, n):
+        for f in fields:
+            setattr(self, f, getattr(tree, collection + "_" + f)[n])
+    @staticmethod
+    def make_array(event, collection, fields):
+        if not hasattr(event.input, "n" + collection):
+            return []
+        return [InputObject(event.input, collection, fields, i) for i in range(getattr(event.input, "n" + collection))]
+
+#The collections filled by EventAnalyzer
+EVENT_COLLECTIONS = ["GenLepFromTop", "GenBQuarkFromH", "selLeptons", "Jet", "GenWZQuark", "GenBQuarkFromTop", "GenNuFromTop"]
+
 from PhysicsTools.HeppyCore.framework.analyzer import Analyzer
 class EventAnalyzer(Analyzer):
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(EventAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        #collection -> fields declared by the analyzers, if None all the fields are read
+        self.collections = None
+    def inputs(self):
+        return {}, ["met_pt", "met_phi", "met_sumEt", "met_genPt", "met_genPhi"]
+    def set_inputs(self, collections, scalars):
+        self.collections = collections
     def process(self, event):
+        if not self.collections is None:
+            for name in EVENT_COLLECTIONS:
+                setattr(event, name, InputObject.make_array(event, name, self.collections.get(name, [])))
+            event.met = MET.make_array(event)
+            return
         #event.GenBQuarkFromHafterISR = GenBQuarkFromHafterISR.make_array(event)
         #event.hJidx_sortcsv = hJidx_sortcsv.make_array(event)
         #event.aJCidx = aJCidx.make_array(event)
@@ -0,0 +1,148 @@
+"""
+B-tagging likelihood of an event under the hypothesis that nB jets are b,
+nC jets are c and the remaining jets are light.
+
+The likelihood of one jet-flavour assignment is the product of the per-jet
+b/c/light probabilities. It only depends on which jets are in which group,
+not on the order inside a group, hence it is enough to enumerate the unordered
+assignments instead of all permutations of the jets.
+"""
+import itertools
+import numpy as np
+
+def likelihood_permutations(probs, nB, nC):
+    """
+    Reference implementation, enumerating all permutations of the jets.
+
+    probs: list of (p_b, p_c, p_l) per jet
+    nB, nC: number of jets assumed to be b and c
+
+    Returns the likelihood averaged over permutations and the best permutation.
+    """
+    perms = itertools.permutations(range(len(probs)))
+
+    P = 0.0
+    max_p = -1.0
+    nperms = 0
+    best_perm = None
+
+    nj = len(probs)
+    for perm in perms:
+        p = 1.0
+
+        for i in range(0, nB):
+            p *= probs[perm[i]][0]
+        for i in range(nB, min(nB + nC, nj)):
+            p *= probs[perm[i]][1]
+        for i in range(nB + nC, nj):
+            p *= probs[perm[i]][2]
+
+        if p > max_p:
+            best_perm = perm
+            max_p = p
+
+        P += p
+        nperms += 1
+    P = P / float(nperms)
+    assert nperms > 0
+    return P, best_perm
+
+def assignments(njets, nB, nC):
+    """
+    Yields the unordered assignments of njets jets to nB b, nC c and the
+    remaining light jets, as the permutation sorted(b) + sorted(c) + sorted(l).
+
+    This is the first permutation of the assignment reached by
+    itertools.permutations, and the assignments are yielded in that order.
+    """
+    nB = min(nB, njets)
+    nC = min(nC, njets - nB)
+    jets = range(njets)
+    for bs in itertools.combinations(jets, nB):
+        rest = [i for i in jets if i not in bs]
+        for cs in itertools.combinations(rest, nC):
+            ls = tuple([i for i in rest if i not in cs])
+            yield bs + cs + ls
+
+def likelihood(probs, nB, nC):
+    """
+    Same result as likelihood_permutations, enumerating only the unordered
+    assignments (at most C(6,4)*C(2,1) for 6 jets, instead of 6!).
+    Every assignment is realised by the same number of permutations,
+    therefore the average over permutations is the average over assignments.
+
+    The best permutation is returned in the canonical order of the best
+    assignment (sorted within the b, c and light groups).
+    """
+    nj = len(probs)
+    nB = min(nB, nj)
+    nC = min(nC, nj - nB)
+
+    P = 0.0
+    max_p = -1.0
+    nassign = 0
+    best_perm = None
+
+    for perm in assignments(nj, nB, nC):
+        p = 1.0
+        for i in range(0, nB):
+            p *= probs[perm[i]][0]
+        for i in range(nB, nB + nC):
+            p *= probs[perm[i]][1]
+        for i in range(nB + nC, nj):
+            p *= probs[perm[i]][2]
+
+        if p > max_p:
+            best_perm = perm
+            max_p = p
+
+        P += p
+        nassign += 1
+    assert nassign > 0
+    P = P / float(nassign)
+    return P, best_perm
+
+#(njets, nB, nC) -> (assignments as an int array [nassign, njets], flavour index per position)
+_assignment_tables = {}
+
+def assignment_table(njets, nB, nC):
+    key = (njets, nB, nC)
+    if not _assignment_tables.has_key(key):
+        perms = list(assignments(njets, nB, nC))
+        perms = np.array(perms, dtype=np.int64).reshape(len(perms), njets)
+        nb = min(nB, njets)
+        nc = min(nC, njets - nb)
+        flavours = np.array([0]*nb + [1]*nc + [2]*(njets - nb - nc), dtype=np.int64)
+        _assignment_tables[key] = (perms, flavours)
+    return _assignment_tables[key]
+
+def likelihood_batch(probs, njets, nB, nC):
+    """
+    Batched version of likelihood for a chunk of events.
+
+    probs: array [nevents, maxjets, 3] of (p_b, p_c, p_l), padded beyond njets
+    njets: array [nevents] of the number of jets used in each event
+
+    Returns:
+    P: array [nevents] of the averaged likelihoods
+    best_perm: int array [nevents, maxjets] with the best permutation, padded with -1
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    njets = np.asarray(njets, dtype=np.int64)
+    nev, maxjets = probs.shape[0], probs.shape[1]
+
+    P = np.zeros(nev, dtype=np.float64)
+    best_perm = -np.ones((nev, maxjets), dtype=np.int64)
+
+    for nj in np.unique(njets):
+        sel = np.nonzero(njets == nj)[0]
+        perms, flavours = assignment_table(int(nj), nB, nC)
+
+        #[nsel, nassign, nj]: probability of the jet at each position for its flavour
+        p = probs[sel][:, perms, flavours[np.newaxis, :]]
+        prod = p.prod(axis=2)
+
+        P[sel] = prod.mean(axis=1)
+        #argmax returns the first maximum, as the strict comparison above
+        best_perm[sel, :nj] = perms[prod.argmax(axis=1)]
+    return P, best_perm
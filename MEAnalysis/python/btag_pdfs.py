@@ -0,0 +1,250 @@
+"""
+Numpy lookup tables of the CSV discriminator PDFs used by BTagLRAnalyzer.
+
+The control plot histograms are converted once to bin edges and contents
+and saved as a versioned .npz snapshot next to the ROOT file, such that the
+jobs do not need to open and normalise the ROOT files at startup. Lookups are
+vectorised over all jets, reproducing TH1::FindBin and the treatment of
+csv = 1 (next-to-last bin) of the ROOT-based lookup.
+
+To create the snapshots for the default configuration, run
+python TTH/MEAnalysis/python/btag_pdfs.py
+"""
+import os
+import numpy as np
+
+#Increase if the snapshot layout or the conversion changes, older snapshots are then rebuilt
+SNAPSHOT_VERSION = 1
+
+FLAVOURS = ["b", "c", "l"]
+ETA_BINS = ["Bin0", "Bin1"]
+KINDS = ["old", "new_eta_1bin", "new_pt_eta_bin_3d"]
+
+class Axis(object):
+    """
+    Bin edges of a histogram axis, with vectorised TAxis::FindFixBin.
+    """
+    def __init__(self, edges, uniform):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.uniform = bool(uniform)
+        self.nbins = len(self.edges) - 1
+
+    def find_bin(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        xmin, xmax = self.edges[0], self.edges[-1]
+        if self.uniform:
+            #same arithmetic as ROOT for fixed bins, to agree at the bin edges
+            with np.errstate(invalid="ignore"):
+                inner = 1 + np.floor(self.nbins * (x - xmin) / (xmax - xmin))
+            inner = np.nan_to_num(inner).astype(np.int64)
+        else:
+            inner = np.searchsorted(self.edges, x, side="right")
+        with np.errstate(invalid="ignore"):
+            return np.where(x < xmin, 0, np.where(x < xmax, inner, self.nbins + 1))
+
+class Hist(object):
+    """
+    A 1D or 3D histogram: the axes and the bin contents, including under- and
+    overflow, in the order of the ROOT global bin number.
+    """
+    def __init__(self, axes, contents):
+        self.axes = axes
+        self.contents = np.asarray(contents, dtype=np.float64)
+
+    def find_bin(self, *xs):
+        """
+        Returns the ROOT global bin number for arrays of coordinates.
+        """
+        gbin = 0
+        stride = 1
+        for axis, x in zip(self.axes, xs):
+            gbin = gbin + stride * axis.find_bin(x)
+            stride *= axis.nbins + 2
+        return gbin
+
+    @staticmethod
+    def from_root(h):
+        axes = []
+        for ax in [h.GetXaxis(), h.GetYaxis(), h.GetZaxis()][:h.GetDimension()]:
+            n = ax.GetNbins()
+            xbins = ax.GetXbins()
+            if xbins.GetSize() == 0:
+                axes += [Axis(np.linspace(ax.GetXmin(), ax.GetXmax(), n + 1), True)]
+            else:
+                axes += [Axis([xbins[i] for i in range(n + 1)], False)]
+        ncells = 1
+        for axis in axes:
+            ncells *= axis.nbins + 2
+        contents = [h.GetBinContent(i) for i in range(ncells)]
+        return Hist(axes, contents)
+
+def snapshot_path(root_filename):
+    return "{0}.csvpdfs_v{1}.npz".format(os.path.splitext(root_filename)[0], SNAPSHOT_VERSION)
+
+def _source_stamp(root_filename):
+    st = os.stat(root_filename)
+    return np.array([st.st_mtime, st.st_size], dtype=np.float64)
+
+def save_snapshot(path, hists, stamp, normalise):
+    """
+    Writes the snapshot to a temporary file in the same directory, renamed
+    to path when complete, such that the jobs never read a partial snapshot.
+    """
+    arrs = {
+        "__version__": np.array(SNAPSHOT_VERSION),
+        "__source__": stamp,
+        "__normalise__": np.array(normalise),
+        "__names__": np.array(sorted(hists.keys())),
+    }
+    for name, h in hists.items():
+        arrs[name + ":contents"] = h.contents
+        for iax, axis in enumerate(h.axes):
+            arrs["{0}:edges{1}".format(name, iax)] = axis.edges
+            arrs["{0}:uniform{1}".format(name, iax)] = np.array(axis.uniform)
+    tmp = "{0}.tmp{1}".format(path, os.getpid())
+    try:
+        with open(tmp, "wb") as of:
+            np.savez(of, **arrs)
+        os.rename(tmp, path)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+
+def load_snapshot(path, names, stamp, normalise):
+    """
+    Returns the histograms from a snapshot, or None if the snapshot is missing,
+    cannot be read, has a different version or was made from a different ROOT file.
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        snap = np.load(path)
+        try:
+            return _read_snapshot(snap, names, stamp, normalise)
+        finally:
+            snap.close()
+    except Exception as e:
+        #e.g. a truncated file, it is rebuilt from the ROOT file
+        print "could not read CSV PDF snapshot", path, e
+        return None
+
+def _read_snapshot(snap, names, stamp, normalise):
+    if (int(snap["__version__"]) != SNAPSHOT_VERSION or
+        not np.array_equal(snap["__source__"], stamp) or
+        bool(snap["__normalise__"]) != normalise or
+        not set(names).issubset(set(snap["__names__"]))):
+        return None
+    hists = {}
+    for name in names:
+        axes = []
+        iax = 0
+        while "{0}:edges{1}".format(name, iax) in snap.files:
+            axes += [Axis(
+                snap["{0}:edges{1}".format(name, iax)],
+                snap["{0}:uniform{1}".format(name, iax)]
+            )]
+            iax += 1
+        hists[name] = Hist(axes, snap[name + ":contents"])
+    return hists
+
+def load_histograms(root_filename, names, normalise):
+    """
+    Loads the named histograms from the snapshot next to root_filename,
+    converting them from the ROOT file (and writing the snapshot) if needed.
+    If normalise, the histograms are scaled to unit integral as TH1::Scale does.
+    """
+    stamp = _source_stamp(root_filename)
+    path = snapshot_path(root_filename)
+    hists = load_snapshot(path, names, stamp, normalise)
+    if not hists is None:
+        return hists
+
+    print "converting CSV PDFs from", root_filename
+    import ROOT
+    tf = ROOT.TFile(root_filename)
+    hists = {}
+    for name in names:
+        h = tf.Get(name)
+        assert h != None, "histogram {0} not found in {1}".format(name, root_filename)
+        if normalise:
+            h.Scale(1.0 / h.Integral())
+        hists[name] = Hist.from_root(h)
+    tf.Close()
+
+    try:
+        save_snapshot(path, hists, stamp, normalise)
+    except (IOError, OSError) as e:
+        print "could not write CSV PDF snapshot", path, e
+    return hists
+
+class CSVPDFs(object):
+    """
+    CSV PDFs for each flavour (b, c, l) and kind:
+    old - 8TeV curves in 2 eta bins (controlPlotsFileOld)
+    new_eta_1bin - 13TeV curves in 2 eta bins (controlPlotsFile)
+    new_pt_eta_bin_3d - 13TeV curves binned in pt, |eta| and csv (controlPlotsFile)
+    """
+    def __init__(self, hists):
+        #(kind, flavour, eta bin or None) -> Hist
+        self.hists = hists
+
+    @staticmethod
+    def load(fn_old, fn_new):
+        hists = {}
+        names_old = {
+            ("old", x, b): "csv_{0}_{1}__csv_rec".format(x, b)
+            for x in FLAVOURS for b in ETA_BINS
+        }
+        names_new = {
+            ("new_eta_1bin", x, b): "csv_{0}_{1}__csv_rec".format(x, b)
+            for x in FLAVOURS for b in ETA_BINS
+        }
+        for x in FLAVOURS:
+            names_new[("new_pt_eta_bin_3d", x, None)] = "csv_{0}_pt_eta".format(x)
+
+        for (fn, names, normalise) in [(fn_old, names_old, False), (fn_new, names_new, True)]:
+            loaded = load_histograms(fn, names.values(), normalise)
+            for k, name in names.items():
+                hists[k] = loaded[name]
+        return CSVPDFs(hists)
+
+    def probs(self, kind, pt, eta, csv):
+        """
+        Returns an array [njets, 3] with the (b, c, l) PDF values of the jets
+        for arrays of jet pt, eta and csv.
+        """
+        pt = np.asarray(pt, dtype=np.float64)
+        abseta = np.abs(np.asarray(eta, dtype=np.float64))
+        csv = np.clip(np.asarray(csv, dtype=np.float64), 0.0, 1.0)
+        with np.errstate(invalid="ignore"):
+            high_eta = abseta > 1.0
+
+        ret = np.zeros((len(pt), len(FLAVOURS)), dtype=np.float64)
+        for ifl, flavour in enumerate(FLAVOURS):
+            if kind == "old" or kind == "new_eta_1bin":
+                for b, sel in [("Bin0", ~high_eta), ("Bin1", high_eta)]:
+                    h = self.hists[(kind, flavour, b)]
+                    nb = h.find_bin(csv[sel])
+                    #if csv = 1 -> goes into overflow and pdf = 0.0
+                    #as a solution, take the next-to-last bin
+                    nb = np.where(nb >= h.axes[0].nbins, nb - 1, nb)
+                    ret[sel, ifl] = h.contents[nb]
+            elif kind == "new_pt_eta_bin_3d":
+                h = self.hists[(kind, flavour, None)]
+                ret[:, ifl] = h.contents[h.find_bin(pt, abseta, csv)]
+            else:
+                raise KeyError("unknown CSV PDF kind {0}".format(kind))
+        return ret
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) == 3:
+        fn_old, fn_new = sys.argv[1:]
+    else:
+        from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+        conf = Conf()
+        fn_old = conf.general["controlPlotsFileOld"]
+        fn_new = conf.general["controlPlotsFile"]
+    CSVPDFs.load(fn_old, fn_new)
+    for fn in [fn_old, fn_new]:
+        print "snapshot", snapshot_path(fn)
@@ -0,0 +1,85 @@
+"""
+Lepton selection as boolean masks over lepton arrays.
+
+The mu/el x tight/loose x nominal/veto selections of Conf.leptons are
+evaluated with one numpy expression each on the flat arrays of the lepton
+fields, either of one event or of a whole chunk of events (see VHbbColumns).
+The lists of lepton objects are only created when they are accessed, see
+LeptonSelection.
+"""
+import numpy as np
+
+FLAVOURS = {"mu": 13, "el": 11}
+
+#The names of the selections, e.g. mu_tight, el_loose_veto
+SELECTIONS = [
+    l + "_" + a + b
+    for l in ["mu", "el"] for a in ["tight", "loose"] for b in ["", "_veto"]
+]
+
+def fields_needed(leptons_conf):
+    """
+    Returns the lepton fields used by the selection.
+    """
+    return ["pt", "eta", "pdgId", "tightId", "looseIdPOG"] + sorted(set(
+        [leptons_conf[l]["isotype"] for l in FLAVOURS.keys()]
+    ))
+
+def selection_masks(leptons_conf, fields):
+    """
+    Returns a dict selection name -> boolean mask over the leptons.
+
+    leptons_conf: Conf.leptons
+    fields (dict): field name -> flat array of the leptons, see fields_needed
+
+    A lepton passes l_a (e.g. mu_tight) if it has the flavour l, passes the
+    pt, eta and isolation cuts of Conf.leptons[l][a] and the id a.
+    It passes l_a_veto if it passes the cuts of Conf.leptons[l][a + "_veto"]
+    and the id a, but not l_a.
+    """
+    pt = np.asarray(fields["pt"], dtype=np.float64)
+    abseta = np.abs(np.asarray(fields["eta"], dtype=np.float64))
+    abspdg = np.abs(np.asarray(fields["pdgId"], dtype=np.int64))
+    ids = {
+        "tight": np.asarray(fields["tightId"]) != 0,
+        "loose": np.asarray(fields["looseIdPOG"]) != 0,
+    }
+
+    masks = {}
+    for l, pdg in FLAVOURS.items():
+        flavour = abspdg == pdg
+        iso = np.abs(np.asarray(fields[leptons_conf[l]["isotype"]], dtype=np.float64))
+        for a in ["tight", "loose"]:
+            for b in ["", "_veto"]:
+                cuts = leptons_conf[l][a + b]
+                m = (
+                    flavour & ids[a] & (pt > cuts["pt"])
+                    & (abseta < cuts["eta"]) & (iso < cuts["iso"])
+                )
+                if b == "_veto":
+                    m &= np.logical_not(masks[l + "_" + a])
+                masks[l + "_" + a + b] = m
+    return masks
+
+class LeptonSelection(object):
+    """
+    The selected leptons of one event. The lists of lepton objects are
+    created when accessed as attributes, e.g. sel.mu_tight.
+
+    leptons (list): the lepton objects of the event
+    masks (dict): selection name -> boolean mask over the leptons
+    """
+    def __init__(self, leptons, masks):
+        self.leptons = leptons
+        self.masks = masks
+        self.counts = {k: int(m.sum()) for (k, m) in masks.items()}
+
+    def __getattr__(self, name):
+        masks = self.__dict__["masks"]
+        if not masks.has_key(name):
+            raise AttributeError(name)
+        leptons = self.__dict__["leptons"]
+        coll = [leptons[i] for i in np.nonzero(masks[name])[0]]
+        #keep the list, such that it is created only once
+        self.__dict__[name] = coll
+        return coll
@@ -0,0 +1,115 @@
+"""
+Vectorised deltaR matching between two jagged collections, e.g. jets and
+generator-level quarks.
+
+The collections are given as flat eta, phi arrays of all the events with
+offsets, the objects of event n being [offsets[n], offsets[n+1]). All the
+pairs of the two collections in the same event are formed at once, such that
+no loop over the objects is done in python.
+"""
+import numpy as np
+
+def delta_phi(phi1, phi2):
+    """
+    Returns phi1 - phi2 in [-pi, pi), as TVector2::Phi_mpi_pi.
+    """
+    return np.mod(np.asarray(phi1) - np.asarray(phi2) + np.pi, 2.0 * np.pi) - np.pi
+
+def delta_r(eta1, phi1, eta2, phi2):
+    deta = np.asarray(eta1) - np.asarray(eta2)
+    dphi = delta_phi(phi1, phi2)
+    return np.sqrt(deta*deta + dphi*dphi)
+
+def _counts(offsets):
+    return np.diff(np.asarray(offsets, dtype=np.int64))
+
+def pairs(offsets1, offsets2):
+    """
+    Returns (i1, i2) of all the pairs of objects of the two collections in
+    the same event, as flat indices, ordered by event, i1 and i2.
+    """
+    offsets1 = np.asarray(offsets1, dtype=np.int64)
+    offsets2 = np.asarray(offsets2, dtype=np.int64)
+    counts1 = _counts(offsets1)
+    counts2 = _counts(offsets2)
+
+    #event of each object of the first collection
+    parents1 = np.repeat(np.arange(len(counts1)), counts1)
+    #number of partners of each object of the first collection
+    npartners = counts2[parents1]
+
+    i1 = np.repeat(np.arange(len(parents1)), npartners)
+    starts = np.zeros(len(npartners), dtype=np.int64)
+    np.cumsum(npartners[:-1], out=starts[1:])
+    local = np.arange(len(i1)) - np.repeat(starts, npartners)
+    i2 = offsets2[:-1][parents1][i1] + local
+    return i1, i2
+
+def match(offsets1, eta1, phi1, offsets2, eta2, phi2, cone, unique=False):
+    """
+    Matches each object of the first collection to the closest object of the
+    second collection in the same event, within deltaR < cone.
+
+    unique: if True, each object of the second collection is matched at most
+        once, assigning the pairs greedily by increasing deltaR in each event
+
+    Returns:
+    index (int array, one per object of the first collection): index of the
+        matched object inside its event in the second collection, -1 if none
+    dr (array, one per object of the first collection): deltaR of the match, -1 if none
+    counts (int array [nevents]): number of matched objects of the first collection
+    """
+    offsets1 = np.asarray(offsets1, dtype=np.int64)
+    offsets2 = np.asarray(offsets2, dtype=np.int64)
+    n1 = offsets1[-1]
+    nevents = len(offsets1) - 1
+    parents1 = np.repeat(np.arange(nevents), _counts(offsets1))
+
+    index = -np.ones(n1, dtype=np.int64)
+    dr = -np.ones(n1, dtype=np.float64)
+
+    i1, i2 = pairs(offsets1, offsets2)
+    d = delta_r(
+        np.asarray(eta1, dtype=np.float64)[i1], np.asarray(phi1, dtype=np.float64)[i1],
+        np.asarray(eta2, dtype=np.float64)[i2], np.asarray(phi2, dtype=np.float64)[i2]
+    )
+    inside = d < cone
+    i1, i2, d = i1[inside], i2[inside], d[inside]
+
+    if not unique:
+        #closest partner of each object, the first one in case of ties
+        order = np.lexsort((i2, d, i1))
+        i1, i2, d = i1[order], i2[order], d[order]
+        first = np.ones(len(i1), dtype=np.bool_)
+        first[1:] = i1[1:] != i1[:-1]
+        index[i1[first]] = i2[first] - offsets2[:-1][parents1[i1[first]]]
+        dr[i1[first]] = d[first]
+    else:
+        #greedy assignment: in each round, the closest free pair of each event
+        ev = parents1[i1]
+        order = np.lexsort((i2, i1, d, ev))
+        i1, i2, d, ev = i1[order], i2[order], d[order], ev[order]
+        used2 = np.zeros(offsets2[-1], dtype=np.bool_)
+        while len(i1) > 0:
+            first = np.ones(len(i1), dtype=np.bool_)
+            first[1:] = ev[1:] != ev[:-1]
+            index[i1[first]] = i2[first] - offsets2[:-1][ev[first]]
+            dr[i1[first]] = d[first]
+            used2[i2[first]] = True
+            free = (index[i1] < 0) & np.logical_not(used2[i2])
+            i1, i2, d, ev = i1[free], i2[free], d[free], ev[free]
+
+    counts = np.bincount(parents1[index >= 0], minlength=nevents).astype(np.int64)
+    return index, dr, counts
+
+def match_objects(objs1, objs2, cone, unique=False):
+    """
+    Matches two lists of objects with eta, phi attributes of a single event.
+    Returns (index, dr) as in match, one per object of objs1.
+    """
+    index, dr, counts = match(
+        [0, len(objs1)], [o.eta for o in objs1], [o.phi for o in objs1],
+        [0, len(objs2)], [o.eta for o in objs2], [o.phi for o in objs2],
+        cone, unique
+    )
+    return index, dr
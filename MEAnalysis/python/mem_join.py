@@ -0,0 +1,135 @@
+"""
+Attaches the MEM results of the "mem" pass of the two-phase workflow (see
+TTH.MEAnalysis.Skim) to the full trees of the "skim" pass.
+
+For each full tree file, a friend file is written with the tree "mem" with
+the same entries: the MEM branches (nmem_*, mem_*) of the event, matched by
+(run, lumi, evt), and mem_found = 1, or empty MEM collections and
+mem_found = 0 for the events which were not integrated.
+
+Usage: python mem_join.py --mem MEM_ttH/tree.root [...] Loop_ttH/tree.root [...]
+The friend of Loop_ttH/tree.root is Loop_ttH/tree_mem.root, used as
+    tree.AddFriend("mem", "Loop_ttH/tree_mem.root")
+"""
+import os
+import argparse
+from array import array
+import ROOT
+
+FRIEND_TREE = "mem"
+
+#ROOT leaf type -> (array type code, branch type code)
+LEAF_TYPES = {
+    "Float_t": ("f", "F"),
+    "Double_t": ("d", "D"),
+    "Int_t": ("i", "I"),
+    "Long64_t": ("l", "L"),
+}
+
+def is_mem_branch(name):
+    return name.startswith("mem_") or name.startswith("nmem_")
+
+def mem_index(fns, treename="tree"):
+    """
+    Returns the TChain of the MEM trees and the dict (run, lumi, evt) -> entry.
+    """
+    chain = ROOT.TChain(treename)
+    for fn in fns:
+        chain.Add(fn)
+    chain.SetBranchStatus("*", False)
+    for br in ["run", "lumi", "evt"]:
+        chain.SetBranchStatus(br, True)
+    index = {}
+    for i in range(chain.GetEntries()):
+        chain.GetEntry(i)
+        index[(int(chain.run), int(chain.lumi), int(chain.evt))] = i
+    chain.SetBranchStatus("*", True)
+    return chain, index
+
+def mem_buffers(chain):
+    """
+    Returns the list of (branch name, buffer, branch leaf list) of the MEM
+    branches, the buffers are attached to the chain. The count branches
+    (nmem_*) come first. The arrays are sized for the largest count in all
+    the trees of the chain. Empty if the chain has no entries.
+    """
+    if chain.GetEntries() == 0:
+        return []
+    chain.GetEntry(0)
+    ret = []
+    for br in chain.GetListOfBranches():
+        name = br.GetName()
+        if not is_mem_branch(name):
+            continue
+        leaf = br.GetLeaf(name)
+        code, rootcode = LEAF_TYPES[leaf.GetTypeName()]
+        count = leaf.GetLeafCount()
+        if count:
+            size = max(1, int(chain.GetMaximum(count.GetName())))
+            leaflist = "{0}[{1}]/{2}".format(name, count.GetName(), rootcode)
+        else:
+            size = leaf.GetLenStatic()
+            leaflist = "{0}/{1}".format(name, rootcode)
+        buf = array(code, [0] * size)
+        chain.SetBranchAddress(name, buf)
+        ret += [(name, buf, leaflist)]
+    return sorted(ret, key=lambda x: not x[0].startswith("nmem_"))
+
+def join(full_fn, out_fn, chain, index, buffers, treename="tree"):
+    """
+    Writes the friend tree of the tree in full_fn to out_fn.
+    Returns the number of entries and of the entries with MEM results.
+    """
+    tf = ROOT.TFile.Open(full_fn)
+    tree = tf.Get(treename)
+    tree.SetBranchStatus("*", False)
+    for br in ["run", "lumi", "evt"]:
+        tree.SetBranchStatus(br, True)
+
+    of = ROOT.TFile(out_fn, "RECREATE")
+    friend = ROOT.TTree(FRIEND_TREE, "MEM results of " + full_fn)
+    found = array("i", [0])
+    friend.Branch("mem_found", found, "mem_found/I")
+    for (name, buf, leaflist) in buffers:
+        friend.Branch(name, buf, leaflist)
+
+    nfound = 0
+    for i in range(tree.GetEntries()):
+        tree.GetEntry(i)
+        entry = index.get((int(tree.run), int(tree.lumi), int(tree.evt)), None)
+        if entry is None:
+            found[0] = 0
+            for (name, buf, leaflist) in buffers:
+                for j in range(len(buf)):
+                    buf[j] = 0
+        else:
+            found[0] = 1
+            nfound += 1
+            chain.GetEntry(entry)
+        friend.Fill()
+    of.Write()
+    of.Close()
+    ntot = tree.GetEntries()
+    tf.Close()
+    return ntot, nfound
+
+def friend_name(fn, suffix):
+    base, ext = os.path.splitext(fn)
+    return base + suffix + ext
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Attach the MEM results to the full trees as friends")
+    parser.add_argument("full", nargs="+", help="full trees of the skim pass")
+    parser.add_argument("--mem", nargs="+", required=True, help="output trees of the mem pass")
+    parser.add_argument("--suffix", default="_mem", help="the friend of x.root is x<suffix>.root")
+    args = parser.parse_args()
+
+    chain, index = mem_index(args.mem)
+    print "MEM results of {0} events".format(len(index))
+    buffers = mem_buffers(chain)
+    if len(buffers) == 0:
+        print "no MEM results in {0}, all the events get mem_found = 0".format(args.mem)
+    for fn in args.full:
+        out_fn = friend_name(fn, args.suffix)
+        ntot, nfound = join(fn, out_fn, chain, index, buffers)
+        print "{0}: {1} of {2} events with MEM results, written to {3}".format(fn, nfound, ntot, out_fn)
@@ -4,14 +4,32 @@ import PhysicsTools.HeppyCore.framework.config as cfg
 #Defines the output TTree branch structures
 from PhysicsTools.Heppy.analyzers.core.AutoFillTreeProducer import *
 
+#The event variables of the input tree copied to all the output trees,
+#read by every tree producer (input_scalars)
+CORE_VARIABLES = ["run", "lumi", "evt", "xsec", "nTrueInt", "puWeight", "genWeight"]
+
 #Override the default fillCoreVariables function, which
 #by default looks for FWLite variables
 #FIXME: this is a hack to run heppy on non-EDM formats. Better to propagate it to heppy
 def fillCoreVariables(self, tr, event, isMC):
-    for x in ["run", "lumi", "evt", "xsec", "nTrueInt", "puWeight", "genWeight"]:
+    for x in CORE_VARIABLES:
         tr.fill(x, getattr(event.input, x))
 AutoFillTreeProducer.fillCoreVariables = fillCoreVariables
 
+def treeProducerClass(conf):
+    """
+    Returns the output tree writer of Conf.general["treeWriter"]: "autofill"
+    (AutoFillTreeProducer) or "columnar" (ColumnarTreeProducer, writing
+    blocks of treeBlockSize events), both write the same trees.
+    """
+    writer = conf.general.get("treeWriter", "autofill")
+    if writer == "autofill":
+        return AutoFillTreeProducer
+    elif writer == "columnar":
+        from TTH.MEAnalysis.ColumnarTreeProducer import ColumnarTreeProducer
+        return ColumnarTreeProducer
+    raise ValueError("unknown tree writer: {0}".format(writer))
+
 #Specifies what to save for jets
 jetType = NTupleObjectType("jetType", variables = [
     NTupleVariable("pt", lambda x : x.pt),
@@ -60,16 +78,169 @@ memType = NTupleObjectType("memType", variables = [
     NTupleVariable("error_code", lambda x : x.error_code, type=int),
     NTupleVariable("efficiency", lambda x : x.efficiency),
     NTupleVariable("nperm", lambda x : x.num_perm, type=int),
+    NTupleVariable("calls", lambda x : x.calls, type=int),
+    NTupleVariable("nperm_pruned", lambda x : x.nperm_pruned, type=int),
 ])
 
 
-def getTreeProducer(conf):
+#The MEAnalyzer inputs stored in the skim, see TTH.MEAnalysis.Skim
+memJetType = NTupleObjectType("memJetType", variables = [
+    NTupleVariable("pt", lambda x : x.pt),
+    NTupleVariable("eta", lambda x : x.eta),
+    NTupleVariable("phi", lambda x : x.phi),
+    NTupleVariable("mass", lambda x : x.mass),
+    NTupleVariable("btagFlag", lambda x : x.btagFlag),
+    NTupleVariable("tf_eta_bin", lambda x : x.tf_eta_bin, type=int),
+])
+memLeptonType = NTupleObjectType("memLeptonType", variables = [
+    NTupleVariable("pt", lambda x : x.pt),
+    NTupleVariable("eta", lambda x : x.eta),
+    NTupleVariable("phi", lambda x : x.phi),
+    NTupleVariable("mass", lambda x : x.mass),
+    NTupleVariable("charge", lambda x : x.charge, type=int),
+])
+genParticleType = NTupleObjectType("genParticleType", variables = [
+    NTupleVariable("pt", lambda x : x.pt),
+    NTupleVariable("eta", lambda x : x.eta),
+    NTupleVariable("phi", lambda x : x.phi),
+    NTupleVariable("mass", lambda x : x.mass),
+])
+
+def memCollections(conf):
+    return {
+        "mem_results_tth" : NTupleCollection("mem_tth", memType, len(conf.mem["methodsToRun"]), help="MEM tth"),
+        "mem_results_ttbb" : NTupleCollection("mem_ttbb", memType, len(conf.mem["methodsToRun"]), help="MEM ttbb"),
+    }
+
+def categoryVariables():
+    return [
+        NTupleVariable("cat", lambda ev: ev.catn, type=int, help="ME category"),
+        NTupleVariable("cat_btag", lambda ev: ev.cat_btag_n, type=int, help="ME category (b-tag)"),
+    ]
+
+def getSkimTreeProducer(conf):
+    """
+    Writes the events passing the skim filter with the inputs of MEAnalyzer
+    to skim.root (the service skimfile), see TTH.MEAnalysis.Skim.
+    """
+    from TTH.MEAnalysis.Skim import MATCH_LABELS
+    return cfg.Analyzer(
+        class_object = treeProducerClass(conf),
+        blockSize = conf.general.get("treeBlockSize", 1000),
+        instance_label = "skim",
+        outservicename = "skimfile",
+        verbose = False,
+        vectorTree = True,
+        input_scalars = CORE_VARIABLES + ["met_pt", "met_phi"],
+        globalVariables = categoryVariables() + [
+            NTupleVariable("met_pt", lambda ev: ev.input.met_pt, help="MET pt"),
+            NTupleVariable("met_phi", lambda ev: ev.input.met_phi, help="MET phi"),
+            NTupleVariable("btag_LR_4b_2b", lambda ev: ev.btag_LR_4b_2b, help="b-tag likelihood ratio 4b vs 2b"),
+        ] + [
+            NTupleVariable(
+                "nMatch_" + l, lambda ev, l=l: getattr(ev, "nMatch_" + l, 0),
+                type=int, help="number of jets matched to the quarks " + l
+            ) for l in MATCH_LABELS
+        ],
+        globalObjects = {},
+        collections = {
+            "good_jets" : NTupleCollection("jets", memJetType, 9, help="Selected jets"),
+            "btagged_jets" : NTupleCollection("bjets", memJetType, 9, help="b-tagged jets"),
+            "buntagged_jets" : NTupleCollection("ujets", memJetType, 9, help="b-untagged jets"),
+            "wquark_candidate_jets" : NTupleCollection("qjets", memJetType, 9, help="W-quark candidate jets"),
+            "good_leptons" : NTupleCollection("leps", memLeptonType, 2, help="Selected leptons"),
+            "GenBQuarkFromH" : NTupleCollection("GenBQuarkFromH", genParticleType, 3, help="Generated b from higgs"),
+        }
+    )
+
+def getMEMTreeProducer(conf):
+    """
+    Writes the event ids and the MEM results of the events read from the
+    skim, see TTH.MEAnalysis.Skim.
+    """
+    return cfg.Analyzer(
+        class_object = treeProducerClass(conf),
+        blockSize = conf.general.get("treeBlockSize", 1000),
+        instance_label = "mem",
+        verbose = False,
+        vectorTree = True,
+        input_scalars = CORE_VARIABLES,
+        globalVariables = categoryVariables(),
+        globalObjects = {},
+        collections = memCollections(conf),
+    )
+
+#The outputs of the systematic variations, stored with the suffix _<variation>:
+#(branch, event attribute, type, set only if the variation passes the jet selection)
+variationOutputs = [
+    ("numJets", "numJets", int, False),
+    ("nBCSVM", "nBCSVM", int, False),
+    ("btag_LR_4b_2b", "btag_LR_4b_2b", float, True),
+    ("Wmass", "Wmass", float, True),
+    ("cat", "catn", int, False),
+    ("cat_btag", "cat_btag_n", int, False),
+]
+
+def variationValue(ev, variation, attr, needs_pass):
+    v = ev.variations[variation]
+    if needs_pass and not v.passes_jets:
+        return 0
+    return getattr(v, attr)
+
+def variationVariables(conf, mem):
+    """
+    Returns the variables of the systematic variations in Conf.general["systematics"],
+    see TTH.MEAnalysis.systematics.
+    """
+    ret = []
+    for variation in conf.general.get("systematics", []):
+        for (branch, attr, vtype, needs_pass) in variationOutputs:
+            ret += [NTupleVariable(
+                branch + "_" + variation,
+                lambda ev, variation=variation, attr=attr, needs_pass=needs_pass:
+                    variationValue(ev, variation, attr, needs_pass),
+                type=vtype, help=branch + " in the " + variation + " variation"
+            )]
+        if mem:
+            ret += [NTupleVariable(
+                "mem_integrated_" + variation,
+                lambda ev, variation=variation: int(getattr(ev.variations[variation], "mem_integrated", False)),
+                type=int, help="MEM integrated in the " + variation + " variation, otherwise the nominal results are stored"
+            )]
+    return ret
+
+def variationCollections(conf):
+    ret = {}
+    for variation in conf.general.get("systematics", []):
+        for hypo in ["tth", "ttbb"]:
+            ret["mem_results_{0}_{1}".format(hypo, variation)] = NTupleCollection(
+                "mem_{0}_{1}".format(hypo, variation), memType, len(conf.mem["methodsToRun"]),
+                help="MEM {0} in the {1} variation".format(hypo, variation)
+            )
+    return ret
+
+def getTreeProducer(conf, mem=True):
+    """
+    mem (bool): write the MEM results, False in the skim phase of the
+        two-phase workflow (see TTH.MEAnalysis.Skim)
+    """
     #Create the output TTree writer
     #Here we define all the variables that we want to save in the output TTree
     treeProducer = cfg.Analyzer(
-        class_object = AutoFillTreeProducer,
+        class_object = treeProducerClass(conf),
+        blockSize = conf.general.get("treeBlockSize", 1000),
         verbose = False,
         vectorTree = True,
+        #The branches of the input tree read by the producer, see InputBranches
+        input_scalars = CORE_VARIABLES + ["lheNj", "lheNb", "lheNc", "lheNg"],
+        input_collections = {
+            "Jet": ["pt", "eta", "phi", "mass", "id", "btagCSV", "mcFlavour", "mcMatchId",
+                "hadronFlavour", "mcPt", "mcEta", "mcPhi", "mcM"],
+            "selLeptons": ["pt", "eta", "phi", "mass", "pdgId"],
+            "GenBQuarkFromTop": ["pt", "eta", "phi", "mass", "pdgId"],
+            "GenBQuarkFromH": ["pt", "eta", "phi", "mass", "pdgId"],
+            "GenWZQuark": ["pt", "eta", "phi", "mass", "pdgId"],
+        },
         globalVariables = [
             NTupleVariable(
                 "Wmass", lambda ev: ev.Wmass,
@@ -319,8 +490,10 @@ def getTreeProducer(conf):
             "l_quarks_w" : NTupleCollection("GenQFromW", leptonType, 5, help=""),
             "good_jets" : NTupleCollection("jets", jetType, 9, help="Selected jets"),
             "good_leptons" : NTupleCollection("leps", leptonType, 2, help="Selected leptons"),
-            "mem_results_tth" : NTupleCollection("mem_tth", memType, len(conf.mem["methodsToRun"]), help="MEM tth"),
-            "mem_results_ttbb" : NTupleCollection("mem_ttbb", memType, len(conf.mem["methodsToRun"]), help="MEM ttbb"),
         }
     )
+    treeProducer.globalVariables += variationVariables(conf, mem)
+    if mem:
+        treeProducer.collections.update(memCollections(conf))
+        treeProducer.collections.update(variationCollections(conf))
     return treeProducer
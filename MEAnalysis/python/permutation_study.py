@@ -0,0 +1,124 @@
+"""
+Effect of the permutation pruning (Conf.mem["permutationPruning"]) on the MEM
+discriminant and the integration time.
+
+Compares the output trees of two runs on the same events, without and with
+the pruning, matched by (run, lumi, evt). The discriminant of each MEM method
+is p_tth / (p_tth + w * p_ttbb).
+
+Usage: python permutation_study.py reference.root pruned.root [-o study.root]
+"""
+import argparse
+import numpy as np
+
+BRANCHES = ["run", "lumi", "evt", "nmem_tth", "nmem_ttbb"] + [
+    "mem_{0}_{1}".format(hypo, v)
+    for hypo in ["tth", "ttbb"] for v in ["p", "time", "nperm_pruned"]
+]
+
+def discriminant(p_tth, p_ttbb, w):
+    den = p_tth + w * p_ttbb
+    return np.where(den > 0, p_tth / np.where(den > 0, den, 1.0), 0.0)
+
+def read_tree(fn, imem):
+    """
+    Returns a dict (run, lumi, evt) -> (p_tth, p_ttbb, time, nperm_pruned)
+    of the MEM method imem.
+    """
+    import ROOT
+    tf = ROOT.TFile.Open(fn)
+    tree = tf.Get("tree")
+    tree.SetBranchStatus("*", False)
+    for br in BRANCHES:
+        tree.SetBranchStatus(br, True)
+    ret = {}
+    for i in range(tree.GetEntries()):
+        tree.GetEntry(i)
+        if tree.nmem_tth <= imem or tree.nmem_ttbb <= imem:
+            continue
+        ret[(tree.run, tree.lumi, tree.evt)] = (
+            tree.mem_tth_p[imem], tree.mem_ttbb_p[imem],
+            tree.mem_tth_time[imem] + tree.mem_ttbb_time[imem],
+            tree.mem_tth_nperm_pruned[imem] + tree.mem_ttbb_nperm_pruned[imem],
+        )
+    tf.Close()
+    return ret
+
+def compare(ref, pruned, w, tolerance):
+    """
+    ref, pruned: the results of read_tree
+
+    Returns a dict of arrays over the common events: d_ref, d_pruned,
+    time_ref, time_pruned, nperm_pruned.
+    """
+    keys = sorted(set(ref.keys()).intersection(pruned.keys()))
+    a = np.array([ref[k] for k in keys], dtype=np.float64).reshape(-1, 4)
+    b = np.array([pruned[k] for k in keys], dtype=np.float64).reshape(-1, 4)
+    d_ref = discriminant(a[:, 0], a[:, 1], w)
+    d_pruned = discriminant(b[:, 0], b[:, 1], w)
+    return {
+        "d_ref": d_ref,
+        "d_pruned": d_pruned,
+        "changed": np.abs(d_pruned - d_ref) > tolerance,
+        "time_ref": a[:, 2],
+        "time_pruned": b[:, 2],
+        "nperm_pruned": b[:, 3],
+    }
+
+def summary(res):
+    n = len(res["d_ref"])
+    if n == 0:
+        return "no common events"
+    dd = np.abs(res["d_pruned"] - res["d_ref"])
+    t_ref = res["time_ref"].sum()
+    t_pruned = res["time_pruned"].sum()
+    lines = [
+        "events: {0}".format(n),
+        "mean |d_pruned - d_ref|: {0:.4f}, max: {1:.4f}".format(dd.mean(), dd.max()),
+        "events with a changed discriminant: {0} ({1:.1f}%)".format(
+            int(res["changed"].sum()), 100.0 * res["changed"].mean()
+        ),
+        "mean pruned assignments per event: {0:.1f}".format(res["nperm_pruned"].mean()),
+        "MEM time: reference {0:.1f}, pruned {1:.1f}, ratio {2:.3f}".format(
+            t_ref, t_pruned, t_pruned / t_ref if t_ref > 0 else 0.0
+        ),
+    ]
+    return "\n".join(lines)
+
+def write_histograms(res, fn):
+    import ROOT
+    tf = ROOT.TFile(fn, "RECREATE")
+    hists = [
+        ROOT.TH1D("d_ref", "discriminant, reference", 50, 0, 1),
+        ROOT.TH1D("d_pruned", "discriminant, pruned", 50, 0, 1),
+        ROOT.TH1D("d_diff", "discriminant, pruned - reference", 100, -1, 1),
+        ROOT.TH2D("d_pruned_vs_ref", "discriminant, pruned vs reference", 50, 0, 1, 50, 0, 1),
+        ROOT.TH1D("nperm_pruned", "pruned assignments", 50, 0, 200),
+    ]
+    for i in range(len(res["d_ref"])):
+        hists[0].Fill(res["d_ref"][i])
+        hists[1].Fill(res["d_pruned"][i])
+        hists[2].Fill(res["d_pruned"][i] - res["d_ref"][i])
+        hists[3].Fill(res["d_ref"][i], res["d_pruned"][i])
+        hists[4].Fill(res["nperm_pruned"][i])
+    for h in hists:
+        h.Write()
+    tf.Close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Effect of the MEM permutation pruning")
+    parser.add_argument("reference", help="output tree without pruning")
+    parser.add_argument("pruned", help="output tree with pruning")
+    parser.add_argument("--mem", type=int, default=0, help="index of the MEM method (Conf.mem methodsToRun)")
+    parser.add_argument("--weight", type=float, default=0.02, help="ttbb weight of the discriminant")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="minimum change of the discriminant")
+    parser.add_argument("-o", "--output", default="permutation_study.root")
+    args = parser.parse_args()
+
+    res = compare(
+        read_tree(args.reference, args.mem), read_tree(args.pruned, args.mem),
+        args.weight, args.tolerance
+    )
+    print summary(res)
+    write_histograms(res, args.output)
+    print "histograms written to", args.output
@@ -0,0 +1,104 @@
+"""
+Kinematic pre-selection of the jet-quark assignments integrated by the MEM.
+
+As integralOption1 of the old MEAnalysis (bin/MEAnalysis.cc), the assignments
+of the jets to the quarks which are not loosely compatible with the H, t and
+W masses are dropped before the integration. The integrator enumerates the
+permutations itself (MEM.Permutations.BTagged/QUntagged), therefore the
+assignments are enumerated here in the same way and the W-quark candidate
+jets which appear in no compatible assignment are not passed to the MEM.
+If no assignment is compatible, the hypothesis is not integrated.
+
+The four b-tagged jets are assigned to bLep, bHad, b1, b2 (b1, b2 from the
+Higgs or the gluon, unordered) and two of the W-quark candidates to q1, q2
+(unordered). The candidate masses are m(b1 b2) for the Higgs, m(q1 q2) for
+the W and m(bHad q1 q2) for the hadronic top.
+"""
+import itertools
+import numpy as np
+from TTH.MEAnalysis.FourVectors import cartesian, invariant_mass
+
+#indices of the b-tagged jets assigned to bLep, bHad, b1, b2, with b1 < b2
+B_ASSIGNMENTS = np.array([
+    p for p in itertools.permutations(range(4)) if p[2] < p[3]
+], dtype=np.int64)
+
+def assignments(nq):
+    """
+    Returns (b, q): arrays [n, 4] and [n, 2] of the jet indices of all the
+    assignments of 4 b-tagged jets and nq W-quark candidates. If nq < 2,
+    q is -1.
+    """
+    if nq < 2:
+        return B_ASSIGNMENTS, -np.ones((len(B_ASSIGNMENTS), 2), dtype=np.int64)
+    qpairs = np.array(list(itertools.combinations(range(nq), 2)), dtype=np.int64)
+    b = np.repeat(B_ASSIGNMENTS, len(qpairs), axis=0)
+    q = np.tile(qpairs, (len(B_ASSIGNMENTS), 1))
+    return b, q
+
+def candidate_masses(bjets, qjets):
+    """
+    bjets: array [4, 4] of pt, eta, phi, mass of the b-tagged jets
+    qjets: array [nq, 4] of the W-quark candidates
+
+    Returns (b, q, mH, mW, mT), the assignments and the Higgs, W and top
+    candidate masses of each. mW and mT are nan without two W-quark candidates.
+    """
+    bjets = np.asarray(bjets, dtype=np.float64).reshape(-1, 4)
+    qjets = np.asarray(qjets, dtype=np.float64).reshape(-1, 4)
+    b, q = assignments(len(qjets))
+    bpx, bpy, bpz, bE = cartesian(*bjets.T)
+
+    def mass(*parts):
+        return invariant_mass(*[sum([p[i] for p in parts]) for i in range(4)])
+
+    def p4(px, py, pz, E, idx):
+        return (px[idx], py[idx], pz[idx], E[idx])
+
+    mH = mass(p4(bpx, bpy, bpz, bE, b[:, 2]), p4(bpx, bpy, bpz, bE, b[:, 3]))
+    if len(qjets) < 2:
+        mW = np.nan * np.ones(len(b))
+        mT = np.nan * np.ones(len(b))
+    else:
+        qpx, qpy, qpz, qE = cartesian(*qjets.T)
+        q1 = p4(qpx, qpy, qpz, qE, q[:, 0])
+        q2 = p4(qpx, qpy, qpz, qE, q[:, 1])
+        mW = mass(q1, q2)
+        mT = mass(p4(bpx, bpy, bpz, bE, b[:, 1]), q1, q2)
+    return b, q, mH, mW, mT
+
+def in_window(m, window):
+    return (m > window[0]) & (m < window[1])
+
+def compatible(mH, mW, mT, windows, use_higgs=True, use_w=True):
+    """
+    Returns the mask of the assignments with the candidate masses inside the
+    windows (dict "higgs", "W", "top" -> (low, high)).
+
+    use_higgs: require the Higgs window (False for the ttbb hypothesis)
+    use_w: require the W and top windows (False if the W quarks are not
+        both reconstructed, e.g. mW is nan)
+    """
+    ok = np.ones(len(mH), dtype=np.bool_)
+    if use_higgs:
+        ok &= in_window(mH, windows["higgs"])
+    if use_w:
+        ok &= in_window(mW, windows["W"]) & in_window(mT, windows["top"])
+    return ok
+
+def prune(bjets, qjets, windows, use_higgs=True, use_w=True):
+    """
+    Returns (qused, npruned, ntotal): the indices of the W-quark candidates
+    which are in a compatible assignment, the number of incompatible and of
+    all the assignments.
+    """
+    b, q, mH, mW, mT = candidate_masses(bjets, qjets)
+    use_w = use_w and len(qjets) >= 2
+    ok = compatible(mH, mW, mT, windows, use_higgs, use_w)
+    if use_w:
+        qused = sorted(set(q[ok].flatten().tolist()))
+    elif ok.any():
+        qused = range(len(qjets))
+    else:
+        qused = []
+    return qused, int(len(ok) - ok.sum()), len(ok)
@@ -0,0 +1,109 @@
+"""
+Systematic variations of the jets, processed in the same pass as the nominal.
+
+For each variation in Conf.general["systematics"] (e.g. "JESUp"), JetAnalyzer
+creates a VariedEvent: a view of the event with its own jets, shifted from
+the nominal arrays with shift_jets. JetAnalyzer, BTagLRAnalyzer,
+WTagAnalyzer and MECategoryAnalyzer repeat their selection on each view,
+the attributes which are not set on the view are read from the nominal event.
+MEAnalyzer integrates only the variations for which the jet assignment or
+the ME category differs from the nominal, the others get the nominal MEM
+results (see assignment_key).
+
+The outputs are stored with the suffix _<variation>, see metree.
+
+The input trees have no per-jet uncertainties, the shifts are set by
+Conf.jets["systematicShifts"]:
+JES: pt and mass scaled by 1 +- JES
+JER: the difference to the matched generated jet (mcPt) scaled by 1 +- JER
+CSV: the b-tagging discriminators shifted by +- CSV
+"""
+import copy
+import numpy as np
+
+#variation name -> (kind, direction)
+VARIATIONS = {
+    "JESUp": ("JES", 1), "JESDown": ("JES", -1),
+    "JERUp": ("JER", 1), "JERDown": ("JER", -1),
+    "CSVUp": ("CSV", 1), "CSVDown": ("CSV", -1),
+}
+
+class VariedEvent(object):
+    """
+    The event in a systematic variation. Attributes set on the view belong
+    to the variation, all others are read from the nominal event.
+    """
+    def __init__(self, event, variation):
+        self.__dict__["nominal"] = event
+        self.__dict__["variation"] = variation
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__["nominal"], name)
+
+def shift_jets(kind, direction, shifts, pt, mass, btag, mcPt):
+    """
+    Returns the shifted (pt, mass, btag) arrays.
+
+    shifts (dict): kind -> size of the shift, Conf.jets["systematicShifts"]
+    btag: array [njets, nalgos] of the b-tagging discriminators
+    mcPt: pt of the matched generated jets, <= 0 if not matched
+    """
+    pt = np.asarray(pt, dtype=np.float64)
+    mass = np.asarray(mass, dtype=np.float64)
+    btag = np.asarray(btag, dtype=np.float64).reshape(len(pt), -1)
+    s = direction * shifts[kind]
+    if kind == "JES":
+        return pt * (1.0 + s), mass * (1.0 + s), btag
+    elif kind == "JER":
+        mcPt = np.asarray(mcPt, dtype=np.float64)
+        matched = mcPt > 0
+        new_pt = np.where(matched, np.maximum(mcPt + (1.0 + s) * (pt - mcPt), 0.0), pt)
+        scale = np.where(pt > 0, new_pt / np.where(pt > 0, pt, 1.0), 1.0)
+        return new_pt, mass * scale, btag
+    elif kind == "CSV":
+        #negative values flag jets without a discriminator
+        shifted = np.clip(btag + s, 0.0, 1.0)
+        return pt, mass, np.where(btag >= 0, shifted, btag)
+    raise ValueError("unknown systematic: {0}".format(kind))
+
+def vary_jets(jets, variation, shifts, btag_algos):
+    """
+    Returns copies of the jets in the variation, the other attributes are
+    shared with the nominal jets.
+    """
+    if len(jets) == 0:
+        return []
+    kind, direction = VARIATIONS[variation]
+    pt, mass, btag = shift_jets(
+        kind, direction, shifts,
+        [j.pt for j in jets], [j.mass for j in jets],
+        [[getattr(j, a) for a in btag_algos] for j in jets],
+        [j.mcPt for j in jets]
+    )
+    ret = []
+    for i, j in enumerate(jets):
+        jv = copy.copy(j)
+        jv.pt = float(pt[i])
+        jv.mass = float(mass[i])
+        for ia, a in enumerate(btag_algos):
+            setattr(jv, a, float(btag[i, ia]))
+        ret += [jv]
+    return ret
+
+def variations(event):
+    """
+    Returns the (name, VariedEvent) of the event, in the configured order,
+    none if JetAnalyzer did not run (e.g. on a skim).
+    """
+    return [(name, event.variations[name]) for name in getattr(event, "variation_names", [])]
+
+def assignment_key(event):
+    """
+    Returns what determines the MEM inputs apart from the jet kinematics:
+    the ME category and the input jets used as b quarks and W quarks.
+    """
+    return (
+        event.cat, event.cat_btag,
+        tuple(sorted([j.jet_index for j in event.btagged_jets])),
+        tuple(sorted([j.jet_index for j in event.wquark_candidate_jets])),
+    )
@@ -0,0 +1,35 @@
+"""
+Invariant masses of jet pairs for the W-tagging.
+
+The masses of all pairs i<j of jets are computed from the pt, eta, phi, mass
+arrays in one expression, following the arithmetic of TLorentzVector, and the
+pairs are ordered by the distance to the W mass, see
+WTagAnalyzer.find_best_pair.
+"""
+import numpy as np
+from TTH.MEAnalysis.FourVectors import cartesian, invariant_mass
+
+MW = 80.0
+
+#njets -> (i, j) of all pairs i<j, in the order of a double loop
+_pair_tables = {}
+
+def pair_indices(njets):
+    if not _pair_tables.has_key(njets):
+        _pair_tables[njets] = np.triu_indices(njets, 1)
+    return _pair_tables[njets]
+
+def pair_masses(pt, eta, phi, mass):
+    """
+    Returns (i, j, m): the indices and invariant masses of all jet pairs i<j,
+    in the order of a double loop over the jets.
+    """
+    i, j = pair_indices(len(pt))
+    px, py, pz, E = cartesian(pt, eta, phi, mass)
+    return i, j, invariant_mass(px[i] + px[j], py[i] + py[j], pz[i] + pz[j], E[i] + E[j])
+
+def sort_pairs(m):
+    """
+    Returns the order of all the pairs by |m - mW|, keeping the pair order for ties.
+    """
+    return np.argsort(np.abs(m - MW), kind="mergesort")
@@ -0,0 +1,173 @@
+#Benchmark of the output tree writers (Conf.general["treeWriter"]): the tree
+#of metree.getTreeProducer is filled with the same synthetic events by
+#AutoFillTreeProducer and by ColumnarTreeProducer. Prints the events/s of
+#each writer and checks that the trees have the same branches and entries
+#(test/test_tree_writers.py checks all the entries).
+#Run with: python test/benchmark_tree_writers.py [--events N] [--block-size N]
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import ROOT
+
+import PhysicsTools.HeppyCore.framework.config as cfg
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.metree import getTreeProducer, CORE_VARIABLES
+
+WRITERS = ["autofill", "columnar"]
+
+class Synthetic(object):
+    """
+    An object of which every attribute is a random number, fixed on the
+    first access.
+    """
+    def __init__(self, rng, **kwargs):
+        self.__dict__["_rng"] = rng
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        v = round(self._rng.uniform(-1.0, 300.0), 3)
+        setattr(self, name, v)
+        return v
+
+class BenchmarkSetup(object):
+    """
+    The looper setup without services, the producers write their own tree.root.
+    """
+    services = {}
+
+def make_events(conf, ana, n, seed):
+    """
+    Returns n events with the attributes read by the variables of the tree
+    producer ana. All the attributes are accessed once, such that the
+    writers read stored values.
+    """
+    rng = random.Random(seed)
+    events = []
+    for i in range(n):
+        ev = Synthetic(rng, input=Synthetic(rng, run=1, lumi=1 + i / 100, evt=i))
+        for cn, c in ana.collections.items():
+            #also more objects than stored
+            setattr(ev, cn, [Synthetic(rng) for j in range(rng.randint(0, c.maxlen + 1))])
+        ev.nu_top = [Synthetic(rng) for j in range(rng.randint(0, 2))]
+        ev.lep_top = [Synthetic(rng) for j in range(rng.randint(0, 2))]
+        ev.variations = {
+            v: Synthetic(rng, passes_jets=rng.random() > 0.3, mem_integrated=rng.random() > 0.5)
+            for v in conf.general.get("systematics", [])
+        }
+
+        for x in CORE_VARIABLES:
+            getattr(ev.input, x)
+        for v in ana.globalVariables:
+            v.function(ev)
+        for cn, c in ana.collections.items():
+            for o in getattr(ev, cn):
+                for v in c.objectType.allVars(True):
+                    v.function(o)
+        events += [ev]
+    return events
+
+def run_writer(writer, conf, events, outdir, block_size):
+    """
+    Fills the tree with the writer, returns the tree file and the time in seconds.
+    """
+    conf.general["treeWriter"] = writer
+    conf.general["treeBlockSize"] = block_size
+    ana = getTreeProducer(conf)
+    comp = cfg.Component("benchmark", files=[])
+    comp.isMC = True
+    producer = ana.class_object(ana, comp, outdir)
+    setup = BenchmarkSetup()
+    producer.beginLoop(setup)
+
+    t0 = time.time()
+    for event in events:
+        producer.process(event)
+    producer.endLoop(setup)
+    dt = time.time() - t0
+
+    producer.write(setup)
+    fn = producer.file.GetName()
+    producer.file.Close()
+    return fn, dt
+
+def leaves(tree):
+    ret = []
+    for leaf in tree.GetListOfLeaves():
+        count = leaf.GetLeafCount()
+        ret += [(
+            leaf.GetName(), leaf.GetBranch().GetTitle(), leaf.GetTypeName(),
+            leaf.GetLenStatic(), count.GetName() if count else ""
+        )]
+    return ret
+
+def compare(fn1, fn2, nmax):
+    """
+    Returns (same branches, number of entries, number of compared entries
+    with a different value, up to nmax entries compared).
+    """
+    tf1 = ROOT.TFile(fn1)
+    tf2 = ROOT.TFile(fn2)
+    t1 = tf1.Get("tree")
+    t2 = tf2.Get("tree")
+    same_branches = leaves(t1) == leaves(t2)
+    nentries = t1.GetEntries()
+    ndiff = 0
+    if t2.GetEntries() != nentries:
+        ndiff = abs(t2.GetEntries() - nentries)
+    elif same_branches:
+        l1 = list(t1.GetListOfLeaves())
+        l2 = list(t2.GetListOfLeaves())
+        for i in range(min(nentries, nmax)):
+            t1.GetEntry(i)
+            t2.GetEntry(i)
+            for a, b in zip(l1, l2):
+                if a.GetLen() != b.GetLen() or any(
+                    a.GetValue(j) != b.GetValue(j) for j in range(a.GetLen())
+                ):
+                    ndiff += 1
+                    break
+    tf1.Close()
+    tf2.Close()
+    return same_branches, nentries, ndiff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the output tree writers")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--block-size", type=int, default=1000)
+    parser.add_argument("--systematics", nargs="*", default=[], help="e.g. JESUp JESDown")
+    parser.add_argument("--check", type=int, default=1000, help="number of entries compared")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    conf = Conf()
+    conf.general["systematics"] = args.systematics
+    events = make_events(conf, getTreeProducer(conf), args.events, args.seed)
+
+    outdir = tempfile.mkdtemp()
+    try:
+        files = {}
+        times = {}
+        for writer in WRITERS:
+            files[writer], times[writer] = run_writer(writer, conf, events, outdir, args.block_size)
+
+        print "{0:<10} {1:>8} {2:>10} {3:>10}".format("writer", "events", "time [s]", "events/s")
+        for writer in WRITERS:
+            print "{0:<10} {1:>8} {2:>10.3f} {3:>10.1f}".format(
+                writer, len(events), times[writer], len(events) / max(times[writer], 1e-9)
+            )
+        print "speedup: {0:.2f}".format(times["autofill"] / max(times["columnar"], 1e-9))
+
+        same_branches, nentries, ndiff = compare(files["autofill"], files["columnar"], args.check)
+        print "same branches: {0}, entries: {1}, differing entries: {2} of {3} compared".format(
+            same_branches, nentries, ndiff, min(nentries, args.check)
+        )
+    finally:
+        shutil.rmtree(outdir)
+    if not same_branches or ndiff > 0 or nentries != len(events):
+        sys.exit(1)
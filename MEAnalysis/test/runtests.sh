@@ -4,4 +4,26 @@ echo "TTH/MEAnalysis runtests.sh " $LOCAL_TEST_DIR
 cd $CMSSW_BASE/src/TTH/MEAnalysis
 $CMSSW_BASE/bin/$SCRAM_ARCH/MEAnalysis test/me_tthbb.py
 $CMSSW_BASE/bin/$SCRAM_ARCH/MEAnalysis test/me_ttbar.py
+python test/test_columns.py
+python test/test_btag_likelihood.py
+python test/test_btag_pdfs.py
+python test/test_mem_cache.py
+python test/test_input_branches.py
+python test/test_timing.py
+python test/test_memory.py
+python test/test_permutation_pruning.py
+python test/test_mem_backends.py
+python test/test_mem_join.py
+python test/test_tree_writers.py
+python test/test_wmass.py
+python test/test_event_index.py
+python test/test_four_vectors.py
+python test/test_matching.py
+python test/test_systematics.py
+python test/test_adaptive_mem.py
+python test/test_preselection.py
+python test/test_lepton_selection.py
+python test/test_tf_registry.py
+python test/test_mem_pool.py
+python test/test_checkpoint.py
 exit 0
@@ -0,0 +1,123 @@
+#Test of the adaptive MEM integration (MEAnalyzer.refine, is_decided) with
+#outputs whose relative error decreases with the number of points: the
+#undecided integrations are repeated with a growing calls_factor up to
+#maxFactor, the decided ones are not, and the number of points of the last
+#integration is stored in the calls of the results (calls in memType).
+#Run with: python test/test_adaptive_mem.py
+import math
+import unittest
+
+from TTH.MEAnalysis.MECoreAnalyzers import MEAnalyzer
+from TTH.MEAnalysis.MEMIntegrator import MEM, MEMTask, output_from_tuple
+
+ADAPTIVE = {
+    "enabled": True,
+    "startFactor": 0.25,
+    "step": 2.0,
+    "maxFactor": 2.0,
+    "precision": 0.04,
+    "weight": 0.02,
+}
+
+class Object:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class Runner:
+    """
+    Returns the probabilities of PROBS with the relative error
+    error * sqrt(0.25 / calls_factor), records the calls_factor of the runs.
+    """
+    def __init__(self, probs):
+        self.probs = probs
+        self.factors = []
+    def run_all(self, tasks):
+        self.factors += [sorted(set([(t.confname, t.calls_factor) for t in tasks]))]
+        ret = []
+        for t in tasks:
+            p, error = self.probs[(t.hypo, t.confname)]
+            ret += [output_from_tuple((p, p * error * math.sqrt(0.25 / t.calls_factor), 1.0, 0.0, 0, 1.0, 1))]
+        return ret
+
+def make_analyzer(probs):
+    analyzer = MEAnalyzer.__new__(MEAnalyzer)
+    analyzer.adaptive = ADAPTIVE
+    analyzer.mem_runner = Runner(probs)
+    analyzer.configs = {"default": Object(n_max_calls=4000), "missedwq": Object(n_max_calls=2000)}
+    analyzer.memkeys = ["default", "missedwq"]
+    analyzer.conf = Object(mem={"calcME": False})
+    return analyzer
+
+def integrate(analyzer):
+    """
+    Runs the tasks of both configurations from startFactor and stores the
+    results in an event, as MEAnalyzer.collect.
+    """
+    tasks = [
+        MEMTask(confname, hypo, MEM.FinalState.LH, (), (), (0.0, 0.0), (), ADAPTIVE["startFactor"])
+        for confname in analyzer.memkeys
+        for hypo in [MEM.Hypothesis.TTH, MEM.Hypothesis.TTBB]
+    ]
+    res, factors = {}, {}
+    analyzer.run_tasks(tasks, res, factors)
+    analyzer.refine(tasks, res, factors, ADAPTIVE["startFactor"])
+    event = Object()
+    analyzer.store(event, res, factors, {})
+    return event
+
+class AdaptiveMEMTest(unittest.TestCase):
+
+    def test_is_decided(self):
+        analyzer = make_analyzer({})
+        r = lambda p, e: Object(p=p, p_err=p * e)
+        #no probability, small errors, discriminant far from 0.5
+        self.assertTrue(analyzer.is_decided(r(0.0, 0.5), r(1.0, 0.5)))
+        self.assertTrue(analyzer.is_decided(r(1.0, 0.01), r(1.0, 0.03)))
+        self.assertTrue(analyzer.is_decided(r(1e-3, 0.5), r(1.0, 0.5)))
+        #d = 0.5: d(1-d) sqrt(e1^2 + e2^2) = 0.25 * 0.1414 * sqrt(2)
+        self.assertFalse(analyzer.is_decided(r(0.02, 0.1414), r(1.0, 0.1414)))
+        self.assertTrue(analyzer.is_decided(r(0.02, 0.1), r(1.0, 0.1)))
+
+    def test_budget_grows(self):
+        #default: d = 0.5 with 20% errors at startFactor, decided at factor 1.0
+        #missedwq: decided at startFactor (p_tth << w p_ttbb)
+        analyzer = make_analyzer({
+            (MEM.Hypothesis.TTH, "default"): (0.02, 0.2),
+            (MEM.Hypothesis.TTBB, "default"): (1.0, 0.2),
+            (MEM.Hypothesis.TTH, "missedwq"): (1e-5, 0.2),
+            (MEM.Hypothesis.TTBB, "missedwq"): (1.0, 0.2),
+        })
+        event = integrate(analyzer)
+        self.assertEqual(analyzer.mem_runner.factors[1:], [[("default", 0.5)], [("default", 1.0)]])
+        self.assertEqual([r.calls for r in event.mem_results_tth], [4000, 500])
+        self.assertEqual([r.calls for r in event.mem_results_ttbb], [4000, 500])
+        self.assertAlmostEqual(event.mem_results_tth[0].p_err / event.mem_results_tth[0].p, 0.1)
+
+    def test_budget_cap(self):
+        #never decided, stops at maxFactor
+        analyzer = make_analyzer({
+            (MEM.Hypothesis.TTH, "default"): (0.02, 10.0),
+            (MEM.Hypothesis.TTBB, "default"): (1.0, 10.0),
+            (MEM.Hypothesis.TTH, "missedwq"): (0.02, 10.0),
+            (MEM.Hypothesis.TTBB, "missedwq"): (1.0, 10.0),
+        })
+        event = integrate(analyzer)
+        self.assertEqual(analyzer.mem_runner.factors[1:], [
+            [("default", f), ("missedwq", f)] for f in [0.5, 1.0, 2.0]
+        ])
+        self.assertEqual([r.calls for r in event.mem_results_tth], [8000, 4000])
+
+    def test_disabled(self):
+        analyzer = make_analyzer({
+            (MEM.Hypothesis.TTH, "default"): (0.02, 10.0),
+            (MEM.Hypothesis.TTBB, "default"): (1.0, 10.0),
+            (MEM.Hypothesis.TTH, "missedwq"): (0.02, 10.0),
+            (MEM.Hypothesis.TTBB, "missedwq"): (1.0, 10.0),
+        })
+        analyzer.adaptive = dict(ADAPTIVE, enabled=False)
+        event = integrate(analyzer)
+        self.assertEqual(len(analyzer.mem_runner.factors), 1)
+        self.assertEqual([r.calls for r in event.mem_results_tth], [1000, 500])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#Regression test of the subset-based b-tag likelihood against the
+#permutation-based implementation which was used in BTagLRAnalyzer.
+#Run with: python test/test_btag_likelihood.py
+import random
+import unittest
+import numpy as np
+
+import TTH.MEAnalysis.btag_likelihood as btag_likelihood
+
+#(nB, nC) hypotheses evaluated by BTagLRAnalyzer
+HYPOTHESES = [(4, 0), (2, 0), (4, 1), (2, 2), (2, 1)]
+
+def random_probs(njets, rnd):
+    return [(rnd.random(), rnd.random(), rnd.random()) for i in range(njets)]
+
+def groups(perm, njets, nB, nC):
+    """
+    Returns the b, c and light groups of a permutation as sets.
+    """
+    nB = min(nB, njets)
+    nC = min(nC, njets - nB)
+    return (
+        set(perm[0:nB]),
+        set(perm[nB:nB+nC]),
+        set(perm[nB+nC:njets])
+    )
+
+class BTagLikelihoodTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rnd = random.Random(12345)
+
+    def test_assignment_count(self):
+        self.assertEqual(len(list(btag_likelihood.assignments(6, 4, 0))), 15)
+        self.assertEqual(len(list(btag_likelihood.assignments(6, 4, 1))), 30)
+        self.assertEqual(len(list(btag_likelihood.assignments(6, 2, 2))), 90)
+        self.assertEqual(len(list(btag_likelihood.assignments(4, 4, 1))), 1)
+
+    def test_same_as_permutations(self):
+        for njets in [4, 5, 6]:
+            for itrial in range(50):
+                probs = random_probs(njets, self.rnd)
+                for nB, nC in HYPOTHESES:
+                    P_ref, perm_ref = btag_likelihood.likelihood_permutations(probs, nB, nC)
+                    P, perm = btag_likelihood.likelihood(probs, nB, nC)
+                    self.assertAlmostEqual(P, P_ref, delta=1e-12 * max(P_ref, 1e-300))
+                    self.assertEqual(
+                        groups(perm, njets, nB, nC),
+                        groups(perm_ref, njets, nB, nC)
+                    )
+
+    def test_tied_probabilities(self):
+        #all jets equal: the first permutation is the best one in both cases
+        probs = [(0.5, 0.2, 0.3)] * 6
+        for nB, nC in HYPOTHESES:
+            P_ref, perm_ref = btag_likelihood.likelihood_permutations(probs, nB, nC)
+            P, perm = btag_likelihood.likelihood(probs, nB, nC)
+            self.assertAlmostEqual(P, P_ref, places=15)
+            self.assertEqual(tuple(perm), tuple(perm_ref))
+
+    def test_batch(self):
+        maxjets = 6
+        njets = np.array([self.rnd.choice([4, 5, 6]) for i in range(200)])
+        probs = np.zeros((len(njets), maxjets, 3))
+        for iev, nj in enumerate(njets):
+            probs[iev, :nj, :] = random_probs(nj, self.rnd)
+
+        for nB, nC in HYPOTHESES:
+            P, best = btag_likelihood.likelihood_batch(probs, njets, nB, nC)
+            for iev, nj in enumerate(njets):
+                P_ref, perm_ref = btag_likelihood.likelihood_permutations(
+                    [tuple(x) for x in probs[iev, :nj]], nB, nC
+                )
+                self.assertAlmostEqual(P[iev], P_ref, delta=1e-12 * max(P_ref, 1e-300))
+                self.assertEqual(
+                    groups(list(best[iev, :nj]), nj, nB, nC),
+                    groups(perm_ref, nj, nB, nC)
+                )
+                self.assertTrue(np.all(best[iev, nj:] == -1))
+
+if __name__ == "__main__":
+    unittest.main()
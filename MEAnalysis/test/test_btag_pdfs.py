@@ -0,0 +1,54 @@
+#Test of the CSV PDF snapshots (TTH.MEAnalysis.btag_pdfs): a written
+#snapshot is read back, a snapshot which cannot be read or was made from
+#another ROOT file is a miss.
+#Run with: python test/test_btag_pdfs.py
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import TTH.MEAnalysis.btag_pdfs as btag_pdfs
+from TTH.MEAnalysis.btag_pdfs import Axis, Hist
+
+STAMP = np.array([1234.0, 5678.0])
+
+def make_hists():
+    return {
+        "csv_b_Bin0": Hist([Axis(np.linspace(0.0, 1.0, 11), True)], np.arange(12.0)),
+        "csv_l_Bin0": Hist([Axis([0.0, 0.2, 0.5, 1.0], False)], np.arange(5.0)),
+    }
+
+class BTagPDFSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "pdfs.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        btag_pdfs.save_snapshot(self.path, make_hists(), STAMP, True)
+        #only the snapshot is left in the directory
+        self.assertEqual(os.listdir(self.tmpdir), ["pdfs.npz"])
+        hists = btag_pdfs.load_snapshot(self.path, ["csv_l_Bin0"], STAMP, True)
+        self.assertEqual(hists.keys(), ["csv_l_Bin0"])
+        self.assertEqual(list(hists["csv_l_Bin0"].contents), range(5))
+        self.assertEqual(list(hists["csv_l_Bin0"].find_bin([-0.1, 0.3, 1.0])), [0, 2, 4])
+
+    def test_miss(self):
+        btag_pdfs.save_snapshot(self.path, make_hists(), STAMP, True)
+        self.assertEqual(btag_pdfs.load_snapshot(self.path, ["csv_b_Bin0"], STAMP + 1, True), None)
+        self.assertEqual(btag_pdfs.load_snapshot(self.path, ["csv_b_Bin0"], STAMP, False), None)
+        self.assertEqual(btag_pdfs.load_snapshot(self.path, ["csv_c_Bin0"], STAMP, True), None)
+
+        #a truncated snapshot, e.g. from a job killed while writing
+        data = open(self.path, "rb").read()
+        of = open(self.path, "wb")
+        of.write(data[:len(data) / 2])
+        of.close()
+        self.assertEqual(btag_pdfs.load_snapshot(self.path, ["csv_b_Bin0"], STAMP, True), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+#Test of the checkpointing of MELooper: a job killed after a checkpoint and
+#resumed in the same output directory (or from checkpointDir, with the output
+#directory lost) writes the same tree entries, counters and averages as an
+#uninterrupted job.
+#Run with: python test/test_checkpoint.py
+import os
+import shutil
+import tempfile
+import traceback
+import unittest
+from array import array
+
+import ROOT
+import PhysicsTools.HeppyCore.framework.config as cfg
+from PhysicsTools.HeppyCore.framework.analyzer import Analyzer
+from PhysicsTools.HeppyCore.framework.services.tfile import TFileService
+from PhysicsTools.HeppyCore.framework.chain import Chain as Events
+from PhysicsTools.HeppyCore.statistics.average import Average
+from TTH.MEAnalysis.MELooper import MELooper, CHECKPOINT_FILE
+
+NENTRIES = 25
+
+def write_input(fn):
+    tf = ROOT.TFile(fn, "RECREATE")
+    tree = ROOT.TTree("tree", "checkpoint test")
+    evt = array("i", [0])
+    x = array("f", [0])
+    tree.Branch("evt", evt, "evt/I")
+    tree.Branch("x", x, "x/F")
+    for i in range(NENTRIES):
+        evt[0] = 100 + i
+        x[0] = (7 * i) % 11
+        tree.Fill()
+    tree.Write()
+    tf.Close()
+
+class CountingAnalyzer(Analyzer):
+    """
+    Passes the events with x > 3, kills the job at the entry crashAt.
+    """
+    def beginLoop(self, setup):
+        super(CountingAnalyzer, self).beginLoop(setup)
+        self.counters.addCounter("processing")
+        self.counters["processing"].register("processed")
+        self.counters["processing"].register("passes")
+        self.averages.add("x", Average("x"))
+
+    def process(self, event):
+        if event.iEv == getattr(self.cfg_ana, "crashAt", -1):
+            #as a killed batch job, nothing is written or closed
+            os._exit(1)
+        self.counters["processing"].inc("processed")
+        self.averages["x"].add(event.input.x)
+        if event.input.x <= 3:
+            return False
+        self.counters["processing"].inc("passes")
+        return True
+
+class TreeWriter(Analyzer):
+    """
+    Writes evt and x of the passing events to the output file.
+    """
+    def beginLoop(self, setup):
+        super(TreeWriter, self).beginLoop(setup)
+        setup.services["outputfile"].file.cd()
+        self.tree = ROOT.TTree("tree", "passing events")
+        self.evt = array("i", [0])
+        self.x = array("f", [0])
+        self.tree.Branch("evt", self.evt, "evt/I")
+        self.tree.Branch("x", self.x, "x/F")
+
+    def process(self, event):
+        self.evt[0] = event.input.evt
+        self.x[0] = event.input.x
+        self.tree.Fill()
+
+def make_looper(name, fn, crash_at=-1, **kwargs):
+    config = cfg.Config(
+        components = [cfg.Component("test", files=[fn], tree_name="tree")],
+        sequence = cfg.Sequence([
+            cfg.Analyzer(CountingAnalyzer, "counting", crashAt=crash_at),
+            cfg.Analyzer(TreeWriter, "writer"),
+        ]),
+        services = [cfg.Service(TFileService, "outputfile",
+            name="outputfile", fname="tree.root", option="recreate"
+        )],
+        events_class = Events
+    )
+    return MELooper(name, config, nEvents=NENTRIES, checkpointEvents=4, **kwargs)
+
+def read_output(outdir):
+    """
+    Returns the (evt, x) of the output tree.
+    """
+    tf = ROOT.TFile(os.path.join(outdir, "tree.root"))
+    tree = tf.Get("tree")
+    ret = []
+    for i in range(tree.GetEntries()):
+        tree.GetEntry(i)
+        ret += [(tree.evt, tree.x)]
+    tf.Close()
+    return ret
+
+def results(looper):
+    """
+    Returns the counts and the average of the counting analyzer.
+    """
+    counting = looper.analyzers[0]
+    counter = counting.counters["processing"]
+    return [counter[c][1] for c in ["processed", "passes"]], counting.averages["x"].average()
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = self.path("input.root")
+        write_input(self.fn)
+
+        looper = make_looper(self.path("ref"), self.fn)
+        looper.loop()
+        looper.write()
+        self.ref_results = results(looper)
+        self.ref_entries = read_output(self.path("ref"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, fn):
+        return os.path.join(self.tmpdir, fn)
+
+    def run_killed(self, name, crash_at, **kwargs):
+        """
+        Runs the job in a child process which exits at the entry crash_at.
+        """
+        pid = os.fork()
+        if pid == 0:
+            try:
+                make_looper(name, self.fn, crash_at=crash_at, **kwargs).loop()
+            except Exception:
+                traceback.print_exc()
+            os._exit(2)
+        status = os.waitpid(pid, 0)[1]
+        self.assertEqual(os.WEXITSTATUS(status), 1)
+
+    def resume(self, name, **kwargs):
+        looper = make_looper(name, self.fn, **kwargs)
+        self.assertTrue(looper.resume_state is not None)
+        #checkpointed after the entries 3 and 7, the entries 8 and 9 are redone
+        self.assertEqual(looper.resume_state["entry"], 7)
+        looper.loop()
+        looper.write()
+        return looper
+
+    def test_reference(self):
+        self.assertEqual(self.ref_results[0], [NENTRIES, len(self.ref_entries)])
+        self.assertEqual([e[0] for e in self.ref_entries],
+            [100 + i for i in range(NENTRIES) if (7 * i) % 11 > 3]
+        )
+
+    def test_resume(self):
+        name = self.path("job")
+        self.run_killed(name, 10)
+        self.assertTrue(os.path.isfile(os.path.join(name, CHECKPOINT_FILE)))
+
+        looper = self.resume(name)
+        self.assertEqual(read_output(name), self.ref_entries)
+        self.assertEqual(results(looper)[0], self.ref_results[0])
+        self.assertAlmostEqual(results(looper)[1][0], self.ref_results[1][0])
+        #the job is done, the checkpoint and the moved files are removed
+        left = [fn for fn in os.listdir(name) if ".ckpt_" in fn or fn == CHECKPOINT_FILE]
+        self.assertEqual(left, [])
+
+    def test_resume_twice(self):
+        #the resumed job is killed again before its first checkpoint
+        name = self.path("job")
+        self.run_killed(name, 10)
+        self.run_killed(name, 9)
+        looper = self.resume(name)
+        self.assertEqual(read_output(name), self.ref_entries)
+        self.assertEqual(results(looper)[0], self.ref_results[0])
+
+    def test_checkpoint_dir(self):
+        #the output directory is lost, the job resumes from the saved copies
+        name = self.path("job")
+        ckpt = self.path("ckpt")
+        self.run_killed(name, 10, checkpointDir=ckpt)
+        self.assertTrue(os.path.isfile(os.path.join(ckpt, CHECKPOINT_FILE)))
+        shutil.rmtree(name)
+
+        looper = self.resume(name, checkpointDir=ckpt)
+        self.assertEqual(read_output(name), self.ref_entries)
+        self.assertEqual(results(looper)[0], self.ref_results[0])
+        self.assertFalse(os.path.isfile(os.path.join(ckpt, CHECKPOINT_FILE)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#Test of the columnar storage of the input entries (TTH.MEAnalysis.Columns):
+#the offsets and per-event slices of the jagged collections, and the
+#per-event views which replace the input tree. Does not need ROOT.
+#Run with: python test/test_columns.py
+import unittest
+import numpy as np
+
+from TTH.MEAnalysis.Columns import as_column, JaggedArray, Chunk, EventView
+
+#jets per event, with empty events at the start, middle and end
+COUNTS = [0, 3, 1, 0, 2, 0]
+
+def make_chunk(start=10):
+    """
+    Returns a chunk of the entries [start, start + len(COUNTS)), where the
+    jet pt is 10 * event + jet index.
+    """
+    pt = [10.0 * i + j for (i, n) in enumerate(COUNTS) for j in range(n)]
+    offsets = JaggedArray.from_counts(None, COUNTS).offsets
+    return Chunk(
+        start, start + len(COUNTS),
+        {"met_pt": as_column([1.5 * i for i in range(len(COUNTS))]), "run": as_column([1] * len(COUNTS))},
+        {"Jet": (offsets, {"pt": as_column(pt), "id": as_column([1] * len(pt))})}
+    )
+
+class JaggedArrayTest(unittest.TestCase):
+
+    def test_offsets(self):
+        arr = JaggedArray.from_counts(np.arange(6.0), COUNTS)
+        self.assertEqual(list(arr.offsets), [0, 0, 3, 4, 4, 6, 6])
+        self.assertEqual(list(arr.counts), COUNTS)
+        self.assertEqual(list(arr.starts), [0, 0, 3, 4, 4, 6])
+        self.assertEqual(list(arr.stops), [0, 3, 4, 4, 6, 6])
+        self.assertEqual(len(arr), len(COUNTS))
+
+    def test_slices(self):
+        arr = JaggedArray.from_counts(np.arange(6.0), COUNTS)
+        self.assertEqual([list(arr[i]) for i in range(len(arr))], [[], [0, 1, 2], [3], [], [4, 5], []])
+        self.assertEqual(list(arr.local_index()), [0, 1, 2, 0, 0, 1])
+        self.assertEqual(list(arr.parents()), [1, 1, 1, 2, 4, 4])
+
+    def test_empty(self):
+        arr = JaggedArray.from_counts(np.zeros(0), [0, 0])
+        self.assertEqual(list(arr.offsets), [0, 0, 0])
+        self.assertEqual(len(arr[1]), 0)
+        self.assertEqual(len(arr.local_index()), 0)
+
+class ChunkTest(unittest.TestCase):
+
+    def test_chunk(self):
+        chunk = make_chunk()
+        self.assertEqual(len(chunk), 6)
+        self.assertTrue(chunk.contains(10) and chunk.contains(15))
+        self.assertFalse(chunk.contains(9) or chunk.contains(16))
+        self.assertEqual(list(chunk.jagged("Jet", "pt")[4]), [40.0, 41.0])
+
+    def test_types(self):
+        self.assertEqual(as_column([True, False]).dtype, np.int64)
+        self.assertEqual(as_column(np.array([1.0], dtype=np.float32)).dtype, np.float64)
+
+    def test_event_view(self):
+        chunk = make_chunk()
+        ev = chunk.event(14)
+        self.assertTrue(isinstance(ev, EventView))
+        self.assertEqual(ev.met_pt, 6.0)
+        #the branches of the input tree
+        self.assertEqual(ev.nJet, 2)
+        self.assertEqual(list(ev.Jet_pt), [40.0, 41.0])
+        self.assertEqual(chunk.event(13).nJet, 0)
+        self.assertEqual(len(chunk.event(13).Jet_pt), 0)
+        self.assertRaises(AttributeError, getattr, ev, "Jet_eta")
+        self.assertRaises(AttributeError, getattr, ev, "nselLeptons")
+        self.assertFalse(hasattr(ev, "xsec"))
+
+    def test_objects(self):
+        chunk = make_chunk()
+        jets = chunk.event(11).objects("Jet")
+        self.assertEqual([j.pt for j in jets], [10.0, 11.0, 12.0])
+        #attributes set by the analyzers are kept on the object
+        jets[0].btagFlag = 1.0
+        self.assertEqual(jets[0].btagFlag, 1.0)
+        self.assertFalse(hasattr(jets[1], "btagFlag"))
+        self.assertEqual(chunk.event(11).objects("selLeptons"), [])
+
+if __name__ == "__main__":
+    unittest.main()
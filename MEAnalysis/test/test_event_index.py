@@ -0,0 +1,72 @@
+#Test of the (run, lumi, event) index of the input files
+#(TTH.MEAnalysis.EventIndex): the entries of a whitelist in the chain of the
+#files, with events listed twice, missing from the input or duplicated in
+#the input, and the rebuild of a saved index when a file changed.
+#Run with: python test/test_event_index.py
+import os
+import shutil
+import tempfile
+import unittest
+from array import array
+
+import ROOT
+from TTH.MEAnalysis.EventIndex import EventIndex, read_ids
+
+def write_ids(fn, ids):
+    """
+    Writes the tree "tree" with the branches run, lumi, evt of the ids.
+    """
+    tf = ROOT.TFile(fn, "RECREATE")
+    tree = ROOT.TTree("tree", "event ids")
+    bufs = {}
+    for name in ["run", "lumi", "evt"]:
+        bufs[name] = array("i", [0])
+        tree.Branch(name, bufs[name], "{0}/I".format(name))
+    for (run, lumi, evt) in ids:
+        bufs["run"][0], bufs["lumi"][0], bufs["evt"][0] = run, lumi, evt
+        tree.Fill()
+    tree.Write()
+    tf.Close()
+
+class EventIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = [os.path.join(self.tmpdir, "tree{0}.root".format(i)) for i in range(2)]
+        write_ids(self.files[0], [(1, 1, 10), (1, 1, 11), (1, 2, 20)])
+        #the event (1, 1, 11) is also in the second file
+        write_ids(self.files[1], [(1, 2, 21), (1, 1, 11), (2, 1, 5)])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_ids(self):
+        ids = read_ids(self.files[1])
+        self.assertEqual(ids.tolist(), [[1, 2, 21], [1, 1, 11], [2, 1, 5]])
+
+    def test_chain_entries(self):
+        index = EventIndex.build(self.files)
+        self.assertEqual(index.find((1, 2, 21)), (self.files[1], 0))
+        self.assertEqual(index.find((1, 1, 11)), (self.files[0], 1))
+        self.assertEqual(index.find((3, 1, 1)), None)
+        entries = index.chain_entries([(2, 1, 5), (1, 2, 20), (3, 1, 1), (2, 1, 5), (1, 1, 11)])
+        #listed twice: once, missing: skipped, duplicated in the input: both entries
+        self.assertEqual(entries, [1, 2, 4, 5])
+        self.assertEqual(index.chain_entries([]), [])
+
+    def test_for_files(self):
+        index_file = os.path.join(self.tmpdir, "index.npz")
+        index = EventIndex.for_files(self.files, index_file)
+        self.assertTrue(os.path.isfile(index_file))
+        self.assertEqual(EventIndex.for_files(self.files, index_file).ids.tolist(), index.ids.tolist())
+
+        #the same file names with other content, the index is rebuilt
+        write_ids(self.files[0], [(7, 1, 1), (7, 1, 2), (7, 1, 3), (7, 1, 4)])
+        st = os.stat(self.files[0])
+        os.utime(self.files[0], (st.st_atime, st.st_mtime + 10))
+        index = EventIndex.for_files(self.files, index_file)
+        self.assertEqual(index.chain_entries([(7, 1, 3), (2, 1, 5)]), [2, 6])
+        self.assertEqual(EventIndex.load(index_file).ids.tolist(), index.ids.tolist())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#Test of the numpy four-vectors (TTH.MEAnalysis.FourVectors) against
+#ROOT.TLorentzVector: the cartesian components of SetPtEtaPhiM, the
+#invariant mass and the sum of the vectors, and the MET correction of
+#JetAnalyzer, which used one TLorentzVector per jet.
+#Run with: python test/test_four_vectors.py
+import random
+import unittest
+
+import ROOT
+from TTH.MEAnalysis.FourVectors import FourVectorArray, cartesian, invariant_mass
+from TTH.MEAnalysis.MECoreAnalyzers import JetAnalyzer
+
+class Jet:
+    def __init__(self, rng):
+        self.pt = rng.uniform(20.0, 300.0)
+        self.eta = rng.uniform(-2.5, 2.5)
+        self.phi = rng.uniform(-3.14, 3.14)
+        self.mass = rng.uniform(0.0, 30.0)
+        self.mcPt = self.pt * rng.uniform(0.7, 1.3)
+        self.mcEta = self.eta + rng.uniform(-0.05, 0.05)
+        self.mcPhi = self.phi + rng.uniform(-0.05, 0.05)
+        self.mcM = self.mass * rng.uniform(0.7, 1.3)
+
+def lvec(pt, eta, phi, mass):
+    lv = ROOT.TLorentzVector()
+    lv.SetPtEtaPhiM(pt, eta, phi, mass)
+    return lv
+
+def lorentz_met_correction(jets):
+    """
+    The MET correction of JetAnalyzer with TLorentzVectors.
+    """
+    sum_dEx = 0
+    sum_dEy = 0
+    for jet in jets:
+        Prec = lvec(jet.pt, jet.eta, jet.phi, jet.mass)
+        Pgen = lvec(jet.mcPt, jet.mcEta, jet.mcPhi, jet.mcM)
+        Erec = Prec.E()
+        Egen = Pgen.E()
+        sum_dEx += (Erec-Egen) * Prec.Px()/Prec.P()
+        sum_dEy += (Erec-Egen) * Prec.Py()/Prec.P()
+    return sum_dEx, sum_dEy
+
+class FourVectorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(1)
+
+    def assertClose(self, a, b):
+        self.assertAlmostEqual(a, b, delta=1e-9 * max(1.0, abs(b)))
+
+    def test_cartesian(self):
+        jets = [Jet(self.rng) for i in range(20)]
+        px, py, pz, E = cartesian(
+            [j.pt for j in jets], [j.eta for j in jets], [j.phi for j in jets], [j.mass for j in jets]
+        )
+        for i, j in enumerate(jets):
+            lv = lvec(j.pt, j.eta, j.phi, j.mass)
+            for a, b in zip([px[i], py[i], pz[i], E[i]], [lv.Px(), lv.Py(), lv.Pz(), lv.E()]):
+                self.assertClose(a, b)
+            self.assertClose(invariant_mass(px[i], py[i], pz[i], E[i]), lv.M())
+
+    def test_sum(self):
+        for n in [1, 2, 5]:
+            jets = [Jet(self.rng) for i in range(n)]
+            p4 = FourVectorArray.from_objects(jets)
+            total = p4.sum()
+            ref = ROOT.TLorentzVector()
+            for j in jets:
+                ref += lvec(j.pt, j.eta, j.phi, j.mass)
+            self.assertEqual(len(total), 1)
+            for a, b in zip(
+                [total.px[0], total.py[0], total.pz[0], total.E[0], total.mass[0], total.pt[0], total.eta[0], total.phi[0]],
+                [ref.Px(), ref.Py(), ref.Pz(), ref.E(), ref.M(), ref.Pt(), ref.Eta(), ref.Phi()]
+            ):
+                self.assertClose(a, b)
+
+    def test_negative_mass(self):
+        #m^2 < 0 as TLorentzVector::M
+        lv = ROOT.TLorentzVector(3.0, 4.0, 0.0, 4.0)
+        self.assertClose(invariant_mass(3.0, 4.0, 0.0, 4.0), lv.M())
+        self.assertTrue(lv.M() < 0)
+
+    def test_met_correction(self):
+        analyzer = JetAnalyzer.__new__(JetAnalyzer)
+        for n in [0, 1, 4, 9]:
+            jets = [Jet(self.rng) for i in range(n)]
+            dx, dy = analyzer.met_correction(jets)
+            rdx, rdy = lorentz_met_correction(jets)
+            self.assertClose(dx, rdx)
+            self.assertClose(dy, rdy)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#Test of the input branch activation (TTH.MEAnalysis.InputBranches): with
+#only the branches declared by the tree producers enabled, the event
+#variables copied to the output trees (metree.CORE_VARIABLES) must still
+#be read from the input tree, and reading a branch which is not declared
+#must raise instead of returning a stale value.
+#Run with: python test/test_input_branches.py
+import unittest
+from array import array
+
+import ROOT
+from TTH.MEAnalysis import InputBranches
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.metree import CORE_VARIABLES, fillCoreVariables
+from TTH.MEAnalysis.metree import getTreeProducer, getSkimTreeProducer, getMEMTreeProducer
+
+#the values of the core variables in the synthetic tree
+VALUES = {
+    "run": 1, "lumi": 1201, "evt": 120035,
+    "xsec": 0.5085, "nTrueInt": 21.0, "puWeight": 0.9, "genWeight": -1.0,
+}
+
+def make_tree():
+    """
+    Returns a tree with one entry of the core variables and a branch
+    which is not declared by any analyzer.
+    """
+    tree = ROOT.TTree("tree", "synthetic tree")
+    tree.SetDirectory(0)
+    buffers = {}
+    for x in CORE_VARIABLES:
+        if x in ["run", "lumi", "evt"]:
+            buffers[x] = array("i", [VALUES[x]])
+            tree.Branch(x, buffers[x], x + "/I")
+        else:
+            buffers[x] = array("f", [VALUES[x]])
+            tree.Branch(x, buffers[x], x + "/F")
+    buffers["undeclared"] = array("f", [1.0])
+    tree.Branch("undeclared", buffers["undeclared"], "undeclared/F")
+    tree.Fill()
+    return tree, buffers
+
+class Analyzer:
+    def __init__(self, cfg_ana):
+        self.cfg_ana = cfg_ana
+
+class Event:
+    def __init__(self, tree):
+        self.input = tree
+
+class Chain:
+    """
+    As the heppy Chain: reads the entry and returns the tree.
+    """
+    def __init__(self, tree):
+        self.chain = tree
+    def __len__(self):
+        return self.chain.GetEntries()
+    def __getitem__(self, iEv):
+        self.chain.GetEntry(iEv)
+        return self.chain
+
+class Filled:
+    def __init__(self):
+        self.values = {}
+    def fill(self, name, value):
+        self.values[name] = value
+
+class InputBranchesTest(unittest.TestCase):
+
+    def check_producer(self, producer):
+        tree, buffers = make_tree()
+        inputs = InputBranches.analyzer_inputs(Analyzer(producer))
+        self.assertNotEqual(inputs, None)
+        enabled = InputBranches.activate(
+            tree, InputBranches.branch_names(*InputBranches.merge([inputs]))
+        )
+        self.assertEqual(sorted(set(CORE_VARIABLES) & set(enabled)), sorted(CORE_VARIABLES))
+        self.assertFalse("undeclared" in enabled)
+
+        tree.GetEntry(0)
+        tr = Filled()
+        fillCoreVariables(None, tr, Event(tree), True)
+        for x in CORE_VARIABLES:
+            self.assertAlmostEqual(tr.values[x], VALUES[x], places=4)
+
+    def test_declared_input(self):
+        tree, buffers = make_tree()
+        enabled = InputBranches.activate(tree, ["run", "evt"])
+        events = InputBranches.DeclaredEvents(Chain(tree), enabled)
+        self.assertEqual(len(events), 1)
+        tree_input = events[0]
+        self.assertEqual(tree_input.run, VALUES["run"])
+        self.assertEqual(tree_input.evt, VALUES["evt"])
+        self.assertRaises(AttributeError, getattr, tree_input, "xsec")
+        self.assertRaises(AttributeError, getattr, tree_input, "undeclared")
+        #the other attributes are those of the tree
+        self.assertEqual(tree_input.GetEntries(), 1)
+
+    def test_tree_producer(self):
+        self.check_producer(getTreeProducer(Conf()))
+
+    def test_skim_tree_producer(self):
+        self.check_producer(getSkimTreeProducer(Conf()))
+
+    def test_mem_tree_producer(self):
+        self.check_producer(getMEMTreeProducer(Conf()))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#Test of the lepton selection masks (TTH.MEAnalysis.lepton_selection)
+#against the per-object cuts of the previous LeptonAnalyzer, on random
+#leptons of both flavours around the pt, eta and isolation cuts of Conf,
+#for the nominal and veto selections.
+#Run with: python test/test_lepton_selection.py
+import random
+import unittest
+
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.lepton_selection import fields_needed, selection_masks, LeptonSelection, SELECTIONS
+
+class Lepton:
+    def __init__(self, rng):
+        self.pt = rng.choice([5.0, 12.0, 20.0, 25.0, 35.0])
+        self.eta = rng.choice([-2.6, -2.3, 0.0, 2.15, 2.45])
+        self.pdgId = rng.choice([-13, 13, -11, 11, 15])
+        self.tightId = rng.choice([0, 1])
+        self.looseIdPOG = rng.choice([0, 1])
+        self.relIso03 = rng.choice([0.02, 0.05, 0.11, 0.13, 0.18, 0.3])
+
+def loop_selection(leptons_conf, leptons):
+    """
+    The selections of the previous LeptonAnalyzer, one lepton at a time.
+    """
+    ret = {}
+    flavours = {"mu": 13, "el": 11}
+    for a in ["tight", "loose"]:
+        for b in ["", "_veto"]:
+            for l in ["mu", "el"]:
+                cuts = leptons_conf[l][a + b]
+                iso = leptons_conf[l]["isotype"]
+                leps = [
+                    x for x in leptons
+                    if abs(x.pdgId) == flavours[l] and x.pt > cuts["pt"]
+                    and abs(x.eta) < cuts["eta"] and abs(getattr(x, iso)) < cuts["iso"]
+                ]
+                if b == "_veto":
+                    leps = [x for x in leps if not x in ret[l + "_" + a]]
+                if a == "tight":
+                    leps = [x for x in leps if x.tightId]
+                else:
+                    leps = [x for x in leps if x.looseIdPOG]
+                ret[l + "_" + a + b] = leps
+    return ret
+
+class LeptonSelectionTest(unittest.TestCase):
+
+    def test_masks(self):
+        conf = Conf()
+        rng = random.Random(1)
+        for nleps in [0, 1, 3, 8, 40]:
+            for k in range(10):
+                leptons = [Lepton(rng) for i in range(nleps)]
+                fields = {
+                    f: [getattr(x, f) for x in leptons]
+                    for f in fields_needed(conf.leptons)
+                }
+                masks = selection_masks(conf.leptons, fields)
+                self.assertEqual(sorted(masks.keys()), sorted(SELECTIONS))
+                sel = LeptonSelection(leptons, masks)
+                ref = loop_selection(conf.leptons, leptons)
+                for name in SELECTIONS:
+                    self.assertEqual(getattr(sel, name), ref[name])
+                    self.assertEqual(sel.counts[name], len(ref[name]))
+
+    def test_veto(self):
+        #a tight muon is not a tight veto muon, a muon failing the tight
+        #isolation but passing the loose one is
+        conf = Conf()
+        mu = lambda iso: dict(pt=35.0, eta=0.0, pdgId=13, tightId=1, looseIdPOG=1, relIso03=iso)
+        leptons = [mu(0.05), mu(0.15)]
+        fields = {f: [x[f] for x in leptons] for f in fields_needed(conf.leptons)}
+        masks = selection_masks(conf.leptons, fields)
+        self.assertEqual(list(masks["mu_tight"]), [True, False])
+        self.assertEqual(list(masks["mu_tight_veto"]), [False, True])
+        self.assertEqual(list(masks["el_tight"]), [False, False])
+
+if __name__ == "__main__":
+    unittest.main()
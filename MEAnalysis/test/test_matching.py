@@ -0,0 +1,116 @@
+#Test of the vectorised deltaR matching (TTH.MEAnalysis.matching) against a
+#loop over all the pairs of objects of each event: the closest partner of
+#each object, the greedy assignment by increasing deltaR with unique=True,
+#empty collections and the wrap-around of phi at +-pi.
+#Run with: python test/test_matching.py
+import math
+import random
+import unittest
+
+from TTH.MEAnalysis.matching import match, match_objects
+
+def loop_delta_r(eta1, phi1, eta2, phi2):
+    dphi = phi1 - phi2
+    while dphi >= math.pi:
+        dphi -= 2.0 * math.pi
+    while dphi < -math.pi:
+        dphi += 2.0 * math.pi
+    return math.sqrt((eta1 - eta2)**2 + dphi**2)
+
+def loop_match(objs1, objs2, cone, unique):
+    """
+    Returns (index, dr) of the objects of one event, (eta, phi) tuples.
+    """
+    index = [-1] * len(objs1)
+    dr = [-1.0] * len(objs1)
+    pairs = []
+    for i, (eta1, phi1) in enumerate(objs1):
+        for j, (eta2, phi2) in enumerate(objs2):
+            d = loop_delta_r(eta1, phi1, eta2, phi2)
+            if d < cone:
+                pairs += [(d, i, j)]
+    if not unique:
+        for (d, i, j) in pairs:
+            if index[i] < 0 or d < dr[i]:
+                index[i], dr[i] = j, d
+    else:
+        used = set([])
+        for (d, i, j) in sorted(pairs):
+            if index[i] < 0 and not j in used:
+                index[i], dr[i] = j, d
+                used.add(j)
+    return index, dr
+
+def flatten(events):
+    offsets = [0]
+    for objs in events:
+        offsets += [offsets[-1] + len(objs)]
+    eta = [o[0] for objs in events for o in objs]
+    phi = [o[1] for objs in events for o in objs]
+    return offsets, eta, phi
+
+class MatchingTest(unittest.TestCase):
+
+    def check(self, events1, events2, cone, unique):
+        index, dr, counts = match(*(flatten(events1) + flatten(events2) + (cone, unique)))
+        k = 0
+        for objs1, objs2 in zip(events1, events2):
+            ref_index, ref_dr = loop_match(objs1, objs2, cone, unique)
+            n = len(objs1)
+            self.assertEqual(list(index[k:k+n]), ref_index)
+            for a, b in zip(dr[k:k+n], ref_dr):
+                self.assertAlmostEqual(a, b, places=9)
+            k += n
+        self.assertEqual(list(counts), [
+            len([i for i in loop_match(o1, o2, cone, unique)[0] if i >= 0])
+            for o1, o2 in zip(events1, events2)
+        ])
+
+    def random_events(self, rng, nevents, nmax):
+        return [
+            [(rng.uniform(-2.5, 2.5), rng.uniform(-math.pi, math.pi)) for i in range(rng.randint(0, nmax))]
+            for ev in range(nevents)
+        ]
+
+    def test_random(self):
+        rng = random.Random(1)
+        for unique in [False, True]:
+            events1 = self.random_events(rng, 200, 8)
+            events2 = self.random_events(rng, 200, 6)
+            self.check(events1, events2, 1.0, unique)
+
+    def test_greedy(self):
+        #both jets are closest to quark 0, with unique=True the closer jet
+        #takes it and the other jet gets quark 1
+        jets = [[(0.0, 0.0), (0.15, 0.0)]]
+        quarks = [[(0.1, 0.0), (0.4, 0.0)]]
+        index, dr, counts = match(*(flatten(jets) + flatten(quarks) + (0.5, False)))
+        self.assertEqual(list(index), [0, 0])
+        index, dr, counts = match(*(flatten(jets) + flatten(quarks) + (0.5, True)))
+        self.assertEqual(list(index), [1, 0])
+        self.assertAlmostEqual(dr[0], 0.4)
+        self.check(jets, quarks, 0.5, True)
+
+    def test_empty(self):
+        events1 = [[], [(0.0, 1.0)], [], [(1.0, 2.0), (0.0, 0.0)]]
+        events2 = [[(0.0, 1.0)], [], [], [(0.0, 0.1)]]
+        for unique in [False, True]:
+            self.check(events1, events2, 0.3, unique)
+            index, dr, counts = match([0], [], [], [0], [], [], 0.3, unique)
+            self.assertEqual((len(index), len(dr), len(counts)), (0, 0, 0))
+        index, dr = match_objects([], [], 0.3)
+        self.assertEqual(len(index), 0)
+
+    def test_phi_wrap(self):
+        #the objects are 0.1 apart across phi = +-pi
+        jets = [[(0.0, math.pi - 0.05)], [(0.0, -math.pi + 0.02)]]
+        quarks = [[(0.0, -math.pi + 0.05)], [(0.0, math.pi - 0.08)]]
+        for unique in [False, True]:
+            index, dr, counts = match(*(flatten(jets) + flatten(quarks) + (0.3, unique)))
+            self.assertEqual(list(index), [0, 0])
+            self.assertAlmostEqual(dr[0], 0.1)
+            self.assertAlmostEqual(dr[1], 0.1)
+            self.check(jets, quarks, 0.3, unique)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#Test of the MEM backends (TTH.MEAnalysis.MEMIntegrator.make_runner): the
+#stub and the MEM server with stub workers must return the same outputs,
+#also with several requests in flight.
+#Run with: python test/test_mem_backends.py
+import os
+import stat
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+
+from TTH.MEAnalysis.MEMIntegrator import MEM, MEMTask, MEMStub, MEMOUTPUT_FIELDS, output_to_tuple
+from TTH.MEAnalysis.MEMServer import MEMServer, MEMClient, load_authkey, socket_in_use, AUTHKEY_ENV
+
+AUTHKEY = "test_mem_backends"
+
+def make_tasks(n):
+    tasks = []
+    for i in range(n):
+        jets = tuple([
+            (50.0 + 10*i + j, 0.1*j, 0.5*j, 5.0, 1 if j < 4 else 0, 0)
+            for j in range(6)
+        ])
+        for hypo in [MEM.Hypothesis.TTH, MEM.Hypothesis.TTBB]:
+            tasks += [MEMTask(
+                "default", hypo, MEM.FinalState.LH, jets,
+                ((40.0, 0.3, 1.0, 0.0, -1), ), (30.0, 2.0), ()
+            )]
+    return tasks
+
+class MEMBackendsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.address = os.path.join(self.tmpdir, "mem.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stub(self):
+        tasks = make_tasks(3)
+        stub = MEMStub()
+        r1 = [output_to_tuple(r) for r in stub.run_all(tasks)]
+        r2 = [output_to_tuple(r) for r in MEMStub().run_all(tasks)]
+        self.assertEqual(r1, r2)
+        #the hypotheses differ
+        self.assertNotEqual(r1[0], r1[1])
+        #more points, smaller error
+        r3 = stub.run(tasks[0]._replace(calls_factor=4.0))
+        self.assertAlmostEqual(r3.p_err / r1[0][1], 0.5)
+        self.assertEqual(sum([n for (n, wall, cpu) in stub.timing.values()]), len(tasks) + 1)
+
+    def test_server(self):
+        server = MEMServer(None, self.address, 2, AUTHKEY, stub=True)
+        t = threading.Thread(target=server.serve)
+        t.daemon = True
+        t.start()
+
+        tasks = make_tasks(4)
+        expected = [output_to_tuple(r) for r in MEMStub().run_all(tasks)]
+
+        client = MEMClient(self.address, AUTHKEY, "any")
+        #all the events are submitted before collecting
+        handles = [client.submit(tasks[i:i+2]) for i in range(0, len(tasks), 2)]
+        handles += [client.submit([])]
+        outputs = []
+        for h in reversed(handles):
+            outputs = client.collect(h) + outputs
+        self.assertEqual([output_to_tuple(r) for r in outputs], expected)
+        self.assertEqual(sum([n for (n, wall, cpu) in client.timing.values()]), len(tasks))
+        client.close()
+        server.close()
+
+    def test_socket_in_use(self):
+        #a socket left by a killed server is removed
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(self.address)
+        s.close()
+        self.assertTrue(os.path.exists(self.address))
+        self.assertFalse(socket_in_use(self.address))
+        server = MEMServer(None, self.address, 1, AUTHKEY, stub=True)
+        t = threading.Thread(target=server.serve)
+        t.daemon = True
+        t.start()
+
+        #the socket of a running server is not
+        self.assertTrue(socket_in_use(self.address))
+        self.assertRaises(Exception, MEMServer, None, self.address, 1, AUTHKEY, True)
+        #the server survives the probes
+        client = MEMClient(self.address, AUTHKEY, "any")
+        self.assertEqual(len(client.run_all(make_tasks(1))), 2)
+        client.close()
+        server.close()
+
+    def test_authkey(self):
+        env = os.environ.pop(AUTHKEY_ENV, None)
+        try:
+            keyfile = os.path.join(self.tmpdir, "key")
+            self.assertRaises(Exception, load_authkey, keyfile)
+            key = load_authkey(keyfile, create=True)
+            self.assertEqual(stat.S_IMODE(os.stat(keyfile).st_mode), 0600)
+            self.assertEqual(load_authkey(keyfile), key)
+            self.assertNotEqual(load_authkey(os.path.join(self.tmpdir, "key2"), create=True), key)
+            os.environ[AUTHKEY_ENV] = "from the environment"
+            self.assertEqual(load_authkey(keyfile), "from the environment")
+        finally:
+            os.environ.pop(AUTHKEY_ENV, None)
+            if env is not None:
+                os.environ[AUTHKEY_ENV] = env
+
+if __name__ == "__main__":
+    unittest.main()
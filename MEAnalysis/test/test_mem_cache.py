@@ -0,0 +1,97 @@
+#Test of the MEM result cache (TTH.MEAnalysis.MEMCache): the tasks of an
+#event built by MEAnalyzer.configure_mem must hit the cache in a second run,
+#also if the W-quark candidates (a set) are iterated in another order.
+#Run with: python test/test_mem_cache.py
+import os
+import shutil
+import tempfile
+import unittest
+
+from TTH.MEAnalysis.MECoreAnalyzers import MEAnalyzer
+from TTH.MEAnalysis.MEMIntegrator import MEM, MEMTask, output_to_tuple, output_from_tuple
+from TTH.MEAnalysis.MEMCache import MEMCache, CachedRunner, task_key
+
+class Object:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def jet(pt, eta, phi, btag):
+    return Object(pt=pt, eta=eta, phi=phi, mass=5.0, btagFlag=btag, tf_eta_bin=0)
+
+class Candidates:
+    """
+    The W-quark candidates, iterated in a given order as a set may be.
+    """
+    def __init__(self, jets):
+        self.jets = jets
+    def __iter__(self):
+        return iter(self.jets)
+    def __len__(self):
+        return len(self.jets)
+
+class Runner:
+    """
+    Returns outputs which depend only on the task inputs, without integrating.
+    """
+    def run_all(self, tasks):
+        return [output_from_tuple((
+            1e-20 * sum([j[0] * (i + 1) for (i, j) in enumerate(t.jets)]),
+            1e-22, 1.0, 0.0, 0, 1.0, len(t.jets)
+        )) for t in tasks]
+
+def cat1_event(wquark_jets):
+    event = Object(cat="cat1")
+    event.btagged_jets = [
+        jet(100.0, 0.0, 0.0, 1), jet(80.0, 0.5, 1.2, 1),
+        jet(70.0, -0.3, 2.6, 1), jet(60.0, 1.0, -2.0, 1),
+    ]
+    event.wquark_candidate_jets = Candidates(wquark_jets)
+    event.good_leptons = [Object(pt=40.0, eta=0.3, phi=1.0, mass=0.0, charge=-1)]
+    event.input = Object(met_pt=30.0, met_phi=2.0)
+    return event
+
+def event_tasks(event):
+    analyzer = MEAnalyzer.__new__(MEAnalyzer)
+    tasks = []
+    for hypo in [MEM.Hypothesis.TTH, MEM.Hypothesis.TTBB]:
+        mem_cfg = Object(mem_assumptions=set([]))
+        jets, leptons, met, vars_to_integrate = analyzer.configure_mem(event, mem_cfg)
+        tasks += [MEMTask(
+            "default", hypo, MEM.FinalState.LH, jets, leptons, met, vars_to_integrate
+        )]
+    return tasks
+
+class MEMCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, "cache.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_candidate_order(self):
+        qjets = [jet(45.0, 0.2, -1.2, 0), jet(40.0, -0.4, 1.9, 0), jet(31.0, 2.0, 1.5, 0)]
+        tasks1 = event_tasks(cat1_event(qjets))
+        tasks2 = event_tasks(cat1_event([qjets[2], qjets[0], qjets[1]]))
+        self.assertEqual(
+            [task_key(t, "tf") for t in tasks1],
+            [task_key(t, "tf") for t in tasks2]
+        )
+
+        cache = MEMCache(self.fn)
+        runner = CachedRunner(Runner(), cache, "tf")
+        r1 = [output_to_tuple(r) for r in runner.run_all(tasks1)]
+        self.assertEqual((runner.nhits, runner.nmisses), (0, 2))
+        cache.close()
+
+        #the second run with the other order
+        cache = MEMCache(self.fn)
+        runner = CachedRunner(Runner(), cache, "tf")
+        r2 = [output_to_tuple(r) for r in runner.run_all(tasks2)]
+        self.assertEqual((runner.nhits, runner.nmisses), (2, 0))
+        self.assertEqual(r1, r2)
+        cache.close()
+
+if __name__ == "__main__":
+    unittest.main()
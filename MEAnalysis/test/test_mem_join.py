@@ -0,0 +1,154 @@
+#Test of the two-phase workflow (TTH.MEAnalysis.Skim, mem_join): the MEM
+#inputs restored from a skim must be those written to it, and the joined
+#MEM results must land on the entries with the same (run, lumi, evt), with
+#mem_found = 0 and zeros for the events which were not integrated.
+#Run with: python test/test_mem_join.py
+import os
+import shutil
+import tempfile
+import unittest
+from array import array
+
+import ROOT
+from TTH.MEAnalysis.Skim import SkimEventAnalyzer, SKIM_COLLECTIONS, MATCH_LABELS
+from TTH.MEAnalysis.mem_join import mem_index, mem_buffers, join
+
+def write_tree(fn, scalars, arrays, rows):
+    """
+    Writes the tree "tree" with one entry per row (dict of branch -> value).
+    scalars (dict): branch name -> "I" or "F"
+    arrays (dict): branch name -> count branch, float arrays of the
+        heppy vector trees, e.g. jets_pt[njets]
+    """
+    tf = ROOT.TFile(fn, "RECREATE")
+    tree = ROOT.TTree("tree", "synthetic tree")
+    bufs = {}
+    for name, code in scalars.items():
+        bufs[name] = array(code.lower(), [0])
+        tree.Branch(name, bufs[name], "{0}/{1}".format(name, code))
+    for name, count in sorted(arrays.items()):
+        bufs[name] = array("f", [0] * 10)
+        tree.Branch(name, bufs[name], "{0}[{1}]/F".format(name, count))
+    for row in rows:
+        for name in scalars.keys():
+            bufs[name][0] = row.get(name, 0)
+        for name in arrays.keys():
+            for (i, v) in enumerate(row.get(name, [])):
+                bufs[name][i] = v
+        tree.Fill()
+    tree.Write()
+    tf.Close()
+
+EVENT_ID = {"run": "I", "lumi": "I", "evt": "I"}
+
+def skim_row(evt, njets):
+    row = {"run": 1, "lumi": 10, "evt": evt, "cat": 1, "cat_btag": 1, "btag_LR_4b_2b": 0.75}
+    for l in MATCH_LABELS:
+        row["nMatch_" + l] = 2
+    for (coll, fields) in SKIM_COLLECTIONS.values():
+        n = njets if coll != "leps" else 1
+        row["n" + coll] = n
+        for f in fields:
+            row[coll + "_" + f] = [100.0 * evt + 10.0 * i + fields.index(f) for i in range(n)]
+    return row
+
+def write_skim(fn, rows):
+    scalars = dict(EVENT_ID)
+    scalars.update({"cat": "I", "cat_btag": "I", "btag_LR_4b_2b": "F"})
+    arrays = {}
+    for l in MATCH_LABELS:
+        scalars["nMatch_" + l] = "I"
+    for (coll, fields) in SKIM_COLLECTIONS.values():
+        scalars["n" + coll] = "I"
+        for f in fields:
+            arrays[coll + "_" + f] = "n" + coll
+    write_tree(fn, scalars, arrays, rows)
+
+def write_mem(fn, rows):
+    scalars = dict(EVENT_ID)
+    scalars["nmem_tth"] = "I"
+    write_tree(fn, scalars, {"mem_tth_p": "nmem_tth"}, rows)
+
+class Event:
+    def __init__(self, tree):
+        self.input = tree
+
+def read_friend(fn):
+    """
+    Returns the list of (mem_found, nmem_tth, mem_tth_p) of the friend tree.
+    """
+    tf = ROOT.TFile(fn)
+    tree = tf.Get("mem")
+    ret = []
+    for i in range(tree.GetEntries()):
+        tree.GetEntry(i)
+        ret += [(
+            tree.mem_found, tree.nmem_tth,
+            [round(tree.mem_tth_p[j], 3) for j in range(tree.nmem_tth)]
+        )]
+    tf.Close()
+    return ret
+
+class MEMJoinTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        #the full tree of the skim pass, the event 2 is not integrated
+        self.full = os.path.join(self.tmpdir, "tree.root")
+        write_tree(self.full, EVENT_ID, {}, [{"run": 1, "lumi": 10, "evt": evt} for evt in [1, 2, 3]])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, fn):
+        return os.path.join(self.tmpdir, fn)
+
+    def test_skim(self):
+        write_skim(self.path("skim.root"), [skim_row(1, 4), skim_row(3, 6)])
+        analyzer = SkimEventAnalyzer.__new__(SkimEventAnalyzer)
+        tf = ROOT.TFile(self.path("skim.root"))
+        tree = tf.Get("tree")
+        tree.GetEntry(1)
+        event = Event(tree)
+        analyzer.process(event)
+        self.assertEqual((event.cat, event.cat_btag), ("cat1", "H"))
+        self.assertAlmostEqual(event.btag_LR_4b_2b, 0.75, places=5)
+        self.assertEqual(event.nMatch_wq, 2)
+        self.assertEqual(len(event.good_jets), 6)
+        self.assertEqual(len(event.good_leptons), 1)
+        self.assertEqual([j.pt for j in event.btagged_jets], [300.0 + 10.0 * i for i in range(6)])
+        self.assertEqual(event.wquark_candidate_jets[2].phi, 322.0)
+        tf.Close()
+
+    def test_join(self):
+        #the first file has at most one MEM result per event, the second three
+        write_mem(self.path("mem1.root"), [{"run": 1, "lumi": 10, "evt": 1, "nmem_tth": 1, "mem_tth_p": [0.5]}])
+        write_mem(self.path("mem2.root"), [{"run": 1, "lumi": 10, "evt": 3, "nmem_tth": 3, "mem_tth_p": [1.0, 2.0, 3.0]}])
+        chain, index = mem_index([self.path("mem1.root"), self.path("mem2.root")])
+        buffers = mem_buffers(chain)
+        self.assertEqual([b[0] for b in buffers], ["nmem_tth", "mem_tth_p"])
+        self.assertEqual(len(buffers[1][1]), 3)
+
+        ntot, nfound = join(self.full, self.path("friend.root"), chain, index, buffers)
+        self.assertEqual((ntot, nfound), (3, 2))
+        self.assertEqual(read_friend(self.path("friend.root")), [
+            (1, 1, [0.5]),
+            (0, 0, []),
+            (1, 3, [1.0, 2.0, 3.0]),
+        ])
+
+    def test_no_mem(self):
+        write_mem(self.path("mem.root"), [])
+        chain, index = mem_index([self.path("mem.root")])
+        buffers = mem_buffers(chain)
+        self.assertEqual(buffers, [])
+        ntot, nfound = join(self.full, self.path("friend.root"), chain, index, buffers)
+        self.assertEqual((ntot, nfound), (3, 0))
+        tf = ROOT.TFile(self.path("friend.root"))
+        tree = tf.Get("mem")
+        self.assertEqual(tree.GetEntries(), 3)
+        self.assertEqual(tree.GetEntries("mem_found == 0"), 3)
+        tf.Close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#Test of the process pool of the MEM integrations (MEMIntegrator.MEMPool)
+#with stub workers (MEMStub): the outputs are returned in the order of the
+#tasks, equal to those of the in-process runner, also with several batches
+#in flight collected in another order, and the times of all the tasks are
+#accumulated.
+#Run with: python test/test_mem_pool.py
+import unittest
+
+from TTH.MEAnalysis.MEMIntegrator import MEM, MEMTask, MEMStub, MEMPool, output_to_tuple
+
+def make_tasks(n, offset=0.0):
+    tasks = []
+    for i in range(n):
+        #events with 4 to 8 jets
+        jets = tuple([
+            (offset + 50.0 + 10*i + j, 0.1*j, 0.5*j, 5.0, 1 if j < 4 else 0, 0)
+            for j in range(4 + i % 5)
+        ])
+        for confname in ["default", "missedwq"]:
+            for hypo in [MEM.Hypothesis.TTH, MEM.Hypothesis.TTBB]:
+                tasks += [MEMTask(
+                    confname, hypo, MEM.FinalState.LH, jets,
+                    ((40.0, 0.3, 1.0, 0.0, -1), ), (30.0, 2.0), (), 0.25 * (1 + i % 3)
+                )]
+    return tasks
+
+class MEMPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = MEMPool(None, 3, stub=True)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_order(self):
+        tasks = make_tasks(25)
+        serial = [output_to_tuple(r) for r in MEMStub().run_all(tasks)]
+        self.assertEqual(len(set(serial)), len(tasks))
+        for k in range(2):
+            self.assertEqual([output_to_tuple(r) for r in self.pool.run_all(tasks)], serial)
+
+        timing = self.pool.timing
+        self.assertEqual(sorted(timing.keys()), sorted(set([(t.confname, t.hypo) for t in tasks])))
+        self.assertEqual(sum([n for (n, wall, cpu) in timing.values()]), 2 * len(tasks))
+
+    def test_in_flight(self):
+        batches = [make_tasks(n, 1000.0 * n) for n in [7, 1, 12]]
+        handles = [self.pool.submit(tasks) for tasks in batches]
+        for tasks, handle in reversed(zip(batches, handles)):
+            self.assertEqual(
+                [output_to_tuple(r) for r in self.pool.collect(handle)],
+                [output_to_tuple(r) for r in MEMStub().run_all(tasks)]
+            )
+        self.assertEqual(self.pool.run_all([]), [])
+
+if __name__ == "__main__":
+    unittest.main()
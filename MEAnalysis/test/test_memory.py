@@ -0,0 +1,134 @@
+#Test of the memory instrumentation (TTH.MEAnalysis.Memory) on a synthetic
+#tree: a leaking analyzer must be flagged, a clean one must not.
+#Run with: python test/test_memory.py
+import os
+import shutil
+import tempfile
+import unittest
+from array import array
+
+import ROOT
+from TTH.MEAnalysis.Memory import MemoryMonitor
+
+NEVENTS = 300
+
+def make_tree(fn, nevents):
+    """
+    Writes a tree with the Jet_pt, Jet_eta branches of the VHbb trees.
+    """
+    rnd = ROOT.TRandom3(123)
+    tf = ROOT.TFile(fn, "RECREATE")
+    tree = ROOT.TTree("tree", "synthetic tree")
+    nJet = array("i", [0])
+    pt = array("f", [0] * 20)
+    eta = array("f", [0] * 20)
+    tree.Branch("nJet", nJet, "nJet/I")
+    tree.Branch("Jet_pt", pt, "Jet_pt[nJet]/F")
+    tree.Branch("Jet_eta", eta, "Jet_eta[nJet]/F")
+    for i in range(nevents):
+        nJet[0] = rnd.Integer(10)
+        for j in range(nJet[0]):
+            pt[j] = rnd.Exp(50.0)
+            eta[j] = rnd.Uniform(-2.5, 2.5)
+        tree.Fill()
+    tree.Write()
+    tf.Close()
+
+class Event:
+    def __init__(self, tree):
+        self.input = tree
+        self.jets = [(tree.Jet_pt[j], tree.Jet_eta[j]) for j in range(tree.nJet)]
+
+class CleanAnalyzer:
+    name = "clean"
+    def process(self, event):
+        #temporary objects, freed after the call
+        tmp = [list(event.jets) for i in range(100)]
+        return len(tmp) > 0
+
+class LeakingAnalyzer:
+    name = "leaking"
+    def __init__(self):
+        self.kept = []
+    def process(self, event):
+        #keeps about 100 kB per event
+        self.kept += [[float(pt) for (pt, eta) in event.jets] + [0.0] * 12800]
+        return True
+
+class TwoStepAnalyzer:
+    """
+    Processes the events in two steps as MEAnalyzer, leaking in collect.
+    """
+    name = "twostep"
+    def __init__(self):
+        self.kept = []
+    def process(self, event):
+        self.submit(event)
+        return self.collect(event)
+    def submit(self, event):
+        event.pending = [float(pt) for (pt, eta) in event.jets]
+        return True
+    def collect(self, event):
+        self.kept += [event.pending + [0.0] * 12800]
+        return True
+
+class MemoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, "tree.root")
+        make_tree(self.fn, NEVENTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_growing_stage(self):
+        monitor = MemoryMonitor(every=10, threshold_kb=1024, use_tracemalloc=False)
+        analyzers = [CleanAnalyzer(), LeakingAnalyzer()]
+        for a in analyzers:
+            monitor.watch(a)
+
+        tf = ROOT.TFile(self.fn)
+        tree = tf.Get("tree")
+        for i in range(tree.GetEntries()):
+            tree.GetEntry(i)
+            event = Event(tree)
+            for a in analyzers:
+                a.process(event)
+        tf.Close()
+
+        self.assertEqual([st.name for st in monitor.growing()], ["leaking"])
+        for st in monitor.stages:
+            self.assertEqual(st.ncalls, NEVENTS)
+            self.assertEqual(len(st.samples), NEVENTS / 10)
+
+        #the kept lists are the largest allocation of the leaking analyzer
+        leaking = monitor.stages[1]
+        self.assertEqual(leaking.top_allocations(1)[0][0], "list")
+        self.assertTrue("leaking" in monitor.report())
+
+    def test_two_step(self):
+        #the events are submitted in batches before collecting, as in MELooper
+        monitor = MemoryMonitor(every=10, threshold_kb=1024, use_tracemalloc=False)
+        analyzer = TwoStepAnalyzer()
+        monitor.watch(analyzer)
+
+        tf = ROOT.TFile(self.fn)
+        tree = tf.Get("tree")
+        for ibatch in range(0, tree.GetEntries(), 20):
+            events = []
+            for i in range(ibatch, min(ibatch + 20, tree.GetEntries())):
+                tree.GetEntry(i)
+                events += [Event(tree)]
+                analyzer.submit(events[-1])
+            for event in events:
+                analyzer.collect(event)
+        tf.Close()
+
+        st = monitor.stages[0]
+        self.assertEqual([st.name for st in monitor.growing()], ["twostep"])
+        self.assertEqual(st.ncalls, NEVENTS)
+        self.assertEqual(len(st.samples), 2 * NEVENTS / 10)
+
+if __name__ == "__main__":
+    unittest.main()
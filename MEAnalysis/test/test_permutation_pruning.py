@@ -0,0 +1,78 @@
+#Test of the pruning of the jet-quark assignments (MEAnalyzer.prune_assignments,
+#TTH.MEAnalysis.permutations) on a cat1 event: the W-quark candidate which
+#is in no assignment compatible with the W and top masses must be dropped.
+#Run with: python test/test_permutation_pruning.py
+import unittest
+
+from TTH.MEAnalysis.MECoreAnalyzers import MEAnalyzer
+from TTH.MEAnalysis.MEMIntegrator import MEM
+
+PRUNING = {
+    "enabled": True,
+    "higgs": (50.0, 200.0),
+    "W": (60.0, 100.0),
+    "top": (100.0, 250.0),
+}
+
+class Jet:
+    def __init__(self, pt, eta, phi, mass):
+        self.pt = pt
+        self.eta = eta
+        self.phi = phi
+        self.mass = mass
+
+class Event:
+    pass
+
+class MEMConfig:
+    def __init__(self, mem_assumptions):
+        self.mem_assumptions = mem_assumptions
+
+def cat1_event():
+    """
+    Returns a cat1 event with 4 b-tagged jets and 3 W-quark candidates, of
+    which the softest one forms no W or top candidate in the mass windows.
+    """
+    event = Event()
+    event.cat = "cat1"
+    event.btagged_jets = [
+        Jet(100.0, 0.0, 0.0, 5.0),
+        Jet(80.0, 0.5, 1.2, 5.0),
+        Jet(70.0, -0.3, 2.6, 5.0),
+        Jet(60.0, 1.0, -2.0, 5.0),
+    ]
+    event.wquark_jets = [
+        Jet(45.0, 0.2, -1.2, 2.0),
+        Jet(40.0, -0.4, 1.9, 2.0),
+        Jet(31.0, 2.0, 1.5, 2.0),
+    ]
+    #as in WTagAnalyzer, the candidates are a set
+    event.wquark_candidate_jets = set(event.wquark_jets)
+    return event
+
+def make_analyzer():
+    analyzer = MEAnalyzer.__new__(MEAnalyzer)
+    analyzer.pruning = PRUNING
+    return analyzer
+
+class PermutationPruningTest(unittest.TestCase):
+
+    def test_cat1(self):
+        event = cat1_event()
+        wquark_jets, npruned = make_analyzer().prune_assignments(
+            event, MEM.FinalState.LH, MEM.Hypothesis.TTH, MEMConfig(set([]))
+        )
+        self.assertEqual(wquark_jets, event.wquark_jets[:2])
+        self.assertEqual(npruned, 24)
+
+    def test_missed_wq(self):
+        #without the W and top windows all the candidates are kept
+        event = cat1_event()
+        wquark_jets, npruned = make_analyzer().prune_assignments(
+            event, MEM.FinalState.LH, MEM.Hypothesis.TTH, MEMConfig(set(["missed_wq"]))
+        )
+        self.assertEqual(wquark_jets, event.wquark_jets)
+        self.assertEqual(npruned, 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+#Test of the preselection on the raw input branches (PreselectionAnalyzer) on
+#a tree of six synthetic events: the events failing the trigger, lepton and
+#jet requirements are rejected in this order, and the processing counter
+#counts the events passing each step.
+#Run with: python test/test_preselection.py
+import shutil
+import tempfile
+import unittest
+from array import array
+
+import ROOT
+import PhysicsTools.HeppyCore.framework.config as cfg
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.MECoreAnalyzers import PreselectionAnalyzer
+
+TRIGGER_BITS = ["HLT_a", "HLT_b"]
+
+#the leptons pass with pt > 20 and |eta| < 2.5, the jets with pt > 30 and
+#|eta| < 2.5, at least 4 jets
+EVENTS = [
+    #no trigger
+    {"HLT_a": 0, "HLT_b": 0, "selLeptons": [(40.0, 0.0)], "Jet": [(50.0, 0.0)] * 4},
+    #no lepton
+    {"HLT_a": 1, "HLT_b": 0, "selLeptons": [], "Jet": [(50.0, 0.0)] * 4},
+    #the leptons fail the pt or the eta cut
+    {"HLT_a": 0, "HLT_b": 1, "selLeptons": [(15.0, 0.0), (50.0, 2.6)], "Jet": [(50.0, 0.0)] * 4},
+    #one of 4 jets fails the pt cut
+    {"HLT_a": 1, "HLT_b": 0, "selLeptons": [(25.0, 1.0)], "Jet": [(50.0, 0.0)] * 3 + [(25.0, 0.0)]},
+    #4 of 5 jets pass
+    {"HLT_a": 1, "HLT_b": 0, "selLeptons": [(25.0, 1.0)], "Jet": [(50.0, 0.0)] * 4 + [(50.0, 2.7)]},
+    {"HLT_a": 1, "HLT_b": 1, "selLeptons": [(25.0, -2.4)], "Jet": [(31.0, -2.4)] * 4},
+]
+
+def write_events(fn, events):
+    tf = ROOT.TFile(fn, "RECREATE")
+    tree = ROOT.TTree("tree", "preselection")
+    bufs = {}
+    for b in TRIGGER_BITS:
+        bufs[b] = array("f", [0])
+        tree.Branch(b, bufs[b], b + "/F")
+    for coll in ["selLeptons", "Jet"]:
+        bufs["n" + coll] = array("i", [0])
+        tree.Branch("n" + coll, bufs["n" + coll], "n{0}/I".format(coll))
+        for f in ["pt", "eta"]:
+            name = "{0}_{1}".format(coll, f)
+            bufs[name] = array("f", [0] * 10)
+            tree.Branch(name, bufs[name], "{0}[n{1}]/F".format(name, coll))
+    for ev in events:
+        for b in TRIGGER_BITS:
+            bufs[b][0] = ev[b]
+        for coll in ["selLeptons", "Jet"]:
+            bufs["n" + coll][0] = len(ev[coll])
+            for (i, (pt, eta)) in enumerate(ev[coll]):
+                bufs[coll + "_pt"][i] = pt
+                bufs[coll + "_eta"][i] = eta
+        tree.Fill()
+    tree.Write()
+    tf.Close()
+
+class Event:
+    def __init__(self, tree):
+        self.input = tree
+
+class Setup:
+    services = {}
+
+class PreselectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = self.tmpdir + "/tree.root"
+        write_events(self.fn, EVENTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_preselection(self, trigger_bits):
+        """
+        Returns the decisions of the analyzer and its processing counts.
+        """
+        conf = Conf()
+        conf.general["triggerBits"] = trigger_bits
+        ana = cfg.Analyzer(PreselectionAnalyzer, "preselection", _conf=conf)
+        comp = cfg.Component("test", files=[self.fn])
+        analyzer = PreselectionAnalyzer(ana, comp, self.tmpdir)
+        analyzer.beginLoop(Setup())
+
+        tf = ROOT.TFile(self.fn)
+        tree = tf.Get("tree")
+        decisions = []
+        for i in range(tree.GetEntries()):
+            tree.GetEntry(i)
+            decisions += [analyzer.process(Event(tree))]
+        tf.Close()
+        counter = analyzer.counters["processing"]
+        counts = [counter[c][1] for c in ["processed", "trigger", "leptons", "jets", "passes"]]
+        return decisions, counts
+
+    def test_trigger(self):
+        decisions, counts = self.run_preselection(TRIGGER_BITS)
+        self.assertEqual(decisions, [False, False, False, False, True, True])
+        self.assertEqual(counts, [6, 5, 3, 2, 2])
+
+    def test_no_trigger(self):
+        #without trigger bits the first event passes
+        decisions, counts = self.run_preselection([])
+        self.assertEqual(decisions, [True, False, False, False, True, True])
+        self.assertEqual(counts, [6, 6, 4, 3, 3])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+#Test of the systematic variations of the jets (TTH.MEAnalysis.systematics):
+#the JES, JER and CSV shifts of shift_jets, and the reuse of the nominal MEM
+#results by MEAnalyzer for the variations with the same assignment_key,
+#the other variations being integrated.
+#Run with: python test/test_systematics.py
+import unittest
+import numpy as np
+
+from TTH.MEAnalysis import systematics
+from TTH.MEAnalysis.systematics import shift_jets, vary_jets, VariedEvent, assignment_key
+from TTH.MEAnalysis.MECoreAnalyzers import MEAnalyzer
+from TTH.MEAnalysis.MEMIntegrator import MEM, MEMTask, output_from_tuple
+
+SHIFTS = {"JES": 0.1, "JER": 0.2, "CSV": 0.05}
+
+class Object:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class Counter:
+    def inc(self, name, n=1):
+        pass
+
+class Runner:
+    """
+    Returns p = sum of the jet pt of each task, without integrating.
+    """
+    def __init__(self):
+        self.tasks = []
+    def submit(self, tasks):
+        self.tasks += tasks
+        return tasks
+    def collect(self, tasks):
+        return [output_from_tuple((sum([j[0] for j in t.jets]), 0.0, 1.0, 0.0, 0, 1.0, 1)) for t in tasks]
+
+class Analyzer(MEAnalyzer):
+    """
+    MEAnalyzer with one default integration per hypothesis of the b-tagged
+    jets, instead of the MEM configurations.
+    """
+    def __init__(self):
+        self.mem_runner = Runner()
+        self.counters = {"processing": Counter()}
+        self.conf = Object(general={"verbosity": []}, mem={"calcME": False})
+        self.adaptive = {"enabled": False}
+        self.configs = {"default": Object(n_max_calls=1000)}
+        self.memkeys = ["default"]
+
+    def prepare(self, event, factor):
+        jets = tuple([(j.pt, j.eta, j.phi, j.mass, 1, 0) for j in event.btagged_jets])
+        tasks = [
+            MEMTask("default", hypo, MEM.FinalState.LH, jets, (), (0.0, 0.0), ())
+            for hypo in [MEM.Hypothesis.TTH, MEM.Hypothesis.TTBB]
+        ]
+        return tasks, {}, {}
+
+def jet(index, pt):
+    return Object(jet_index=index, pt=pt, eta=0.0, phi=0.0, mass=10.0, btagCSV=0.9, mcPt=pt)
+
+def make_event():
+    event = Object(cat="cat1", cat_btag="H", good_leptons=[], input=Object(met_pt=20.0, met_phi=0.0))
+    event.btagged_jets = [jet(0, 100.0), jet(1, 80.0), jet(2, 60.0), jet(3, 50.0)]
+    event.wquark_candidate_jets = set([jet(4, 40.0), jet(5, 30.0)])
+    event.variation_names = ["JESUp", "JESDown", "CSVUp"]
+    event.variations = {}
+    for name in event.variation_names:
+        ev = VariedEvent(event, name)
+        ev.btagged_jets = vary_jets(event.btagged_jets, name, SHIFTS, ["btagCSV"])
+        event.variations[name] = ev
+    return event
+
+class SystematicsTest(unittest.TestCase):
+
+    def test_jes(self):
+        pt, mass, btag = shift_jets("JES", 1, SHIFTS, [100.0, 50.0], [10.0, 5.0], [0.9, -10.0], [0.0, 40.0])
+        self.assertTrue(np.allclose(pt, [110.0, 55.0]))
+        self.assertTrue(np.allclose(mass, [11.0, 5.5]))
+        self.assertEqual(btag.tolist(), [[0.9], [-10.0]])
+        pt, mass, btag = shift_jets("JES", -1, SHIFTS, [100.0], [10.0], [0.9], [0.0])
+        self.assertTrue(np.allclose(pt, [90.0]))
+        self.assertTrue(np.allclose(mass, [9.0]))
+
+    def test_jer(self):
+        #the second jet is not matched (mcPt <= 0) and is not shifted, the
+        #third one would get a negative pt
+        pt, mass, btag = shift_jets(
+            "JER", 1, SHIFTS, [100.0, 50.0, 10.0], [10.0, 5.0, 2.0], [0.5, 0.5, 0.5], [90.0, -1.0, 60.0]
+        )
+        self.assertTrue(np.allclose(pt, [102.0, 50.0, 0.0]))
+        self.assertTrue(np.allclose(mass, [10.2, 5.0, 0.0]))
+        pt, mass, btag = shift_jets("JER", -1, SHIFTS, [100.0, 50.0], [10.0, 5.0], [0.5, 0.5], [90.0, 0.0])
+        self.assertTrue(np.allclose(pt, [98.0, 50.0]))
+        self.assertTrue(np.allclose(mass, [9.8, 5.0]))
+
+    def test_csv(self):
+        #clipped to [0, 1], the negative values (no discriminator) are kept
+        btag = [[0.98, 0.5], [0.02, -10.0], [-1.0, 0.3]]
+        pt, mass, up = shift_jets("CSV", 1, SHIFTS, [50.0, 40.0, 30.0], [5.0, 4.0, 3.0], btag, [0.0] * 3)
+        self.assertTrue(np.allclose(up, [[1.0, 0.55], [0.07, -10.0], [-1.0, 0.35]]))
+        pt, mass, down = shift_jets("CSV", -1, SHIFTS, [50.0, 40.0, 30.0], [5.0, 4.0, 3.0], btag, [0.0] * 3)
+        self.assertTrue(np.allclose(down, [[0.93, 0.45], [0.0, -10.0], [-1.0, 0.25]]))
+        self.assertEqual(pt.tolist(), [50.0, 40.0, 30.0])
+        self.assertRaises(ValueError, shift_jets, "XYZ", 1, {"XYZ": 0.1}, [1.0], [1.0], [0.5], [0.0])
+
+    def test_vary_jets(self):
+        jets = [jet(0, 100.0)]
+        varied = vary_jets(jets, "JESUp", SHIFTS, ["btagCSV"])
+        self.assertAlmostEqual(varied[0].pt, 110.0)
+        self.assertEqual(varied[0].jet_index, 0)
+        self.assertEqual(jets[0].pt, 100.0)
+        self.assertEqual(vary_jets([], "JESUp", SHIFTS, ["btagCSV"]), [])
+
+    def test_mem_reuse(self):
+        event = make_event()
+        #the JES variations change the kinematics only, CSVUp changes the category
+        event.variations["CSVUp"].cat_btag = "L"
+        self.assertEqual(assignment_key(event.variations["JESUp"]), assignment_key(event))
+        self.assertNotEqual(assignment_key(event.variations["CSVUp"]), assignment_key(event))
+
+        analyzer = Analyzer()
+        analyzer.submit(event)
+        analyzer.collect(event)
+
+        self.assertTrue(event.mem_integrated)
+        self.assertFalse(event.variations["JESUp"].mem_integrated)
+        self.assertFalse(event.variations["JESDown"].mem_integrated)
+        self.assertTrue(event.variations["CSVUp"].mem_integrated)
+        #nominal and CSVUp are integrated, 2 hypotheses each
+        self.assertEqual(len(analyzer.mem_runner.tasks), 4)
+
+        self.assertEqual(event.mem_results_tth[0].p, 290.0)
+        self.assertTrue(event.mem_results_tth_JESUp is event.mem_results_tth)
+        self.assertTrue(event.mem_results_ttbb_JESDown is event.mem_results_ttbb)
+        self.assertFalse(event.mem_results_tth_CSVUp is event.mem_results_tth)
+        #the jets of CSVUp have the nominal kinematics
+        self.assertEqual(event.mem_results_tth_CSVUp[0].p, 290.0)
+
+    def test_mem_jet_assignment(self):
+        #a variation with other b-tagged jets is integrated with its own jets
+        event = make_event()
+        ev = event.variations["JESUp"]
+        ev.btagged_jets = ev.btagged_jets[:3] + [jet(4, 44.0)]
+        analyzer = Analyzer()
+        analyzer.submit(event)
+        analyzer.collect(event)
+        self.assertTrue(ev.mem_integrated)
+        self.assertAlmostEqual(event.mem_results_tth_JESUp[0].p, 1.1 * 240.0 + 44.0)
+        self.assertTrue(event.mem_results_tth_JESDown is event.mem_results_tth)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#Test of the shared jet transfer functions (TFClasses.TFRegistry): the jets
+#selected by JetAnalyzer in the same eta bin share the same TF1 objects, and
+#the TFs and CDFs have the values of the TF1s which were built per jet with
+#Make_Formula and Make_CDF.
+#Run with: python test/test_tf_registry.py
+import copy
+import unittest
+
+import ROOT
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.TFClasses import TFRegistry, load_tf_matrix
+from TTH.MEAnalysis.MECoreAnalyzers import JetAnalyzer
+
+class Object:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def make_jet(pt, eta):
+    return Object(pt=pt, eta=eta, phi=0.5, mass=10.0, btagCSV=0.5, mcFlavour=5,
+        mcPt=pt * 0.9, mcEta=eta, mcPhi=0.5, mcM=10.0
+    )
+
+class TFRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = Conf()
+        #the TF matrix before the registry is built, for the per-jet TF1s
+        self.tf_matrix = copy.deepcopy(load_tf_matrix(self.conf))
+        self.analyzer = JetAnalyzer.__new__(JetAnalyzer)
+        self.analyzer.conf = self.conf
+        self.analyzer.tf_registry = None
+
+    def select(self, jets):
+        event = Object(Jet=jets, met=[Object(px=10.0, py=5.0, genPt=11.0, genPhi=0.4)])
+        self.analyzer.select(event)
+        return event
+
+    def test_shared(self):
+        jets = [make_jet(120.0, 0.3), make_jet(80.0, -0.8), make_jet(60.0, 1.5), make_jet(40.0, -2.2)]
+        event1 = self.select(jets)
+        event2 = self.select([make_jet(50.0, 0.1), make_jet(45.0, 2.0)])
+        barrel = [j for j in event1.good_jets + event2.good_jets if j.tf_eta_bin == 0]
+        endcap = [j for j in event1.good_jets + event2.good_jets if j.tf_eta_bin == 1]
+        self.assertEqual((len(barrel), len(endcap)), (3, 3))
+        for group in [barrel, endcap]:
+            for attr in ["tf_b", "tf_l", "tf_b_lost", "tf_l_lost"]:
+                self.assertTrue(all([getattr(j, attr) is getattr(group[0], attr) for j in group]))
+        self.assertFalse(barrel[0].tf_b is endcap[0].tf_b)
+        self.assertFalse(barrel[0].tf_b is barrel[0].tf_l)
+
+    def test_values(self):
+        registry = TFRegistry(load_tf_matrix(self.conf), self.conf.jets["pt"])
+        for particle in ["b", "l"]:
+            for i_eta in range(2):
+                tf = self.tf_matrix[particle][i_eta]
+                f1 = tf.Make_Formula(False)
+                shared = registry.Get_TF(particle, i_eta, False)
+                cdf = tf.Make_CDF()
+                cdf.SetParameter(0, self.conf.jets["pt"])
+                shared_cdf = registry.Get_CDF(particle, i_eta)
+                for gen in [40.0, 90.0, 200.0]:
+                    f1.SetParameter(0, gen)
+                    shared.SetParameter(0, gen)
+                    for reco in [35.0, 85.0, 210.0]:
+                        self.assertAlmostEqual(shared.Eval(reco), f1.Eval(reco), places=12)
+                    self.assertAlmostEqual(shared_cdf.Eval(gen), cdf.Eval(gen), places=12)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+#Test of the timing of the analyzers (TTH.MEAnalysis.Timing): the wrapped
+#analyzers count their calls and passed events, the analyzers processing the
+#events in two steps are timed in submit and collect and each event is
+#counted once, and the reports of several jobs are merged per stage.
+#Run with: python test/test_timing.py
+import time
+import unittest
+
+from TTH.MEAnalysis.Timing import TimingReport
+
+class OneStepAnalyzer:
+    name = "onestep"
+    def process(self, event):
+        time.sleep(0.001)
+        return event % 2 == 0
+
+class TwoStepAnalyzer:
+    name = "twostep"
+    def process(self, event):
+        if self.submit(event) == False:
+            return False
+        return self.collect(event)
+    def submit(self, event):
+        time.sleep(0.001)
+        return event % 3 != 0
+    def collect(self, event):
+        time.sleep(0.001)
+        return True
+
+class TimingTest(unittest.TestCase):
+
+    def test_analyzers(self):
+        report = TimingReport()
+        analyzer = OneStepAnalyzer()
+        report.time_analyzer(analyzer)
+        for ev in range(30):
+            self.assertEqual(analyzer.process(ev), ev % 2 == 0)
+
+        onestep = report.stage("onestep")
+        self.assertEqual((onestep.ncalls, onestep.npassed), (30, 15))
+        self.assertTrue(onestep.wall >= 0.001 * 30)
+        self.assertTrue(onestep.rate() > 0)
+
+    def test_two_step(self):
+        report = TimingReport()
+        analyzer = TwoStepAnalyzer()
+        report.time_analyzer(analyzer)
+
+        #in batches as MELooper (pipelineEvents), the last event alone
+        for i in range(0, 29, 7):
+            submitted = [ev for ev in range(i, min(i + 7, 29)) if analyzer.submit(ev) != False]
+            for ev in submitted:
+                analyzer.collect(ev)
+        analyzer.process(29)
+
+        twostep = report.stage("twostep")
+        self.assertEqual((twostep.ncalls, twostep.npassed), (30, 20))
+        #the sleeps of 10 rejected and 20 passed events
+        self.assertTrue(twostep.wall >= 0.001 * (10 + 2 * 20))
+
+    def test_merge(self):
+        reports = []
+        for i in range(2):
+            report = TimingReport()
+            report.stage("events").add(1.0, 0.5, True, 10)
+            report.add_stage("mem_default_tth", 4, 2.0, 1.5)
+            reports += [report]
+        reports[1].add_stage("mem_missedwq_tth", 1, 1.0, 1.0)
+
+        merged = TimingReport()
+        for report in reports:
+            merged.merge(report)
+        self.assertEqual([st.name for st in merged.stages], ["events", "mem_default_tth", "mem_missedwq_tth"])
+        mem = merged.stage("mem_default_tth")
+        self.assertEqual((mem.ncalls, mem.npassed), (8, 8))
+        self.assertAlmostEqual(mem.wall, 4.0)
+        self.assertAlmostEqual(mem.cpu, 3.0)
+        self.assertEqual(merged.stage("events").ncalls, 20)
+        self.assertTrue("mem_missedwq_tth" in merged.table())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#Test of the output tree writers (Conf.general["treeWriter"]): the trees
+#written by AutoFillTreeProducer and ColumnarTreeProducer from the same
+#synthetic events must have the same branches (names, leaf lists, types and
+#counts) and the same values in every entry, also when the last block is
+#not full and with the branches of the systematic variations.
+#Run with: python test/test_tree_writers.py
+import shutil
+import tempfile
+import unittest
+
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.metree import getTreeProducer
+from TTH.MEAnalysis.ColumnarTreeProducer import attribute_name, values_getter
+from benchmark_tree_writers import make_events, run_writer, compare
+
+class Object(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class TreeWritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def check_writers(self, systematics, nevents, block_size):
+        conf = Conf()
+        conf.general["systematics"] = systematics
+        events = make_events(conf, getTreeProducer(conf), nevents, 1)
+        files = {}
+        for writer in ["autofill", "columnar"]:
+            files[writer] = run_writer(writer, conf, events, self.outdir, block_size)[0]
+        same_branches, nentries, ndiff = compare(files["autofill"], files["columnar"], nevents)
+        self.assertTrue(same_branches)
+        self.assertEqual(nentries, nevents)
+        self.assertEqual(ndiff, 0)
+
+    def test_nominal(self):
+        self.check_writers([], 250, 64)
+
+    def test_systematics(self):
+        self.check_writers(["JESUp", "JESDown"], 100, 1000)
+
+    def test_getter(self):
+        self.assertEqual(attribute_name(lambda x : x.pt), "pt")
+        self.assertEqual(attribute_name(lambda x : x.pt * 2), None)
+        self.assertEqual(attribute_name(lambda ev: len(ev.jets)), None)
+        obj = Object(pt=10.0, eta=1.5, jets=[1, 2])
+        getter = values_getter([lambda x : x.pt, lambda x : x.eta])
+        self.assertEqual(getter(obj), (10.0, 1.5))
+        getter = values_getter([lambda x : x.pt, lambda ev: len(ev.jets)])
+        self.assertEqual(getter(obj), (10.0, 2))
+        self.assertEqual(values_getter([lambda x : x.eta])(obj), (1.5, ))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#Test of the W-candidate pair masses (TTH.MEAnalysis.wmass,
+#WTagAnalyzer.find_best_pair): the masses and the order of the pairs must be
+#those of the double loop over the jets with TLorentzVector, sorted by
+#|m - 80|.
+#Run with: python test/test_wmass.py
+import random
+import unittest
+import numpy as np
+
+import ROOT
+import TTH.MEAnalysis.wmass as wmass
+from TTH.MEAnalysis.MECoreAnalyzers import WTagAnalyzer
+
+class Jet:
+    def __init__(self, pt, eta, phi, mass):
+        self.pt = pt
+        self.eta = eta
+        self.phi = phi
+        self.mass = mass
+
+def lorentz_pairs(jets):
+    """
+    Returns [(mass, jet1, jet2)] of the pairs i<j, sorted by |m - 80|.
+    """
+    ms = []
+    for i in range(len(jets)):
+        for j in range(i + 1, len(jets)):
+            lv1, lv2 = ROOT.TLorentzVector(), ROOT.TLorentzVector()
+            lv1.SetPtEtaPhiM(jets[i].pt, jets[i].eta, jets[i].phi, jets[i].mass)
+            lv2.SetPtEtaPhiM(jets[j].pt, jets[j].eta, jets[j].phi, jets[j].mass)
+            ms += [((lv1 + lv2).M(), jets[i], jets[j])]
+    return sorted(ms, key=lambda x: abs(x[0] - 80.0))
+
+def random_jets(rng, n):
+    return [
+        Jet(rng.uniform(20.0, 200.0), rng.uniform(-2.4, 2.4),
+            rng.uniform(-3.14, 3.14), rng.uniform(0.0, 20.0))
+        for i in range(n)
+    ]
+
+class WMassTest(unittest.TestCase):
+
+    def setUp(self):
+        self.analyzer = WTagAnalyzer.__new__(WTagAnalyzer)
+
+    def test_find_best_pair(self):
+        rng = random.Random(1)
+        for n in [2, 3, 5, 8]:
+            for k in range(20):
+                jets = random_jets(rng, n)
+                pairs = self.analyzer.find_best_pair(jets)
+                ref = lorentz_pairs(jets)
+                self.assertEqual(len(pairs), n * (n - 1) / 2)
+                for (m, j1, j2), (rm, rj1, rj2) in zip(pairs, ref):
+                    self.assertAlmostEqual(m, rm, delta=1e-6 * rm)
+                    self.assertTrue(j1 is rj1 and j2 is rj2)
+
+    def test_sort_pairs(self):
+        #ties keep the order of the double loop
+        m = np.array([90.0, 70.0, 80.0, 85.0, 75.0])
+        self.assertEqual(list(wmass.sort_pairs(m)), [2, 3, 4, 0, 1])
+
+    def test_pair_masses(self):
+        jets = [Jet(50.0, 0.0, 0.0, 0.0), Jet(50.0, 0.0, 3.14159265, 0.0), Jet(30.0, 1.0, 1.0, 5.0)]
+        i, j, m = wmass.pair_masses(
+            [x.pt for x in jets], [x.eta for x in jets],
+            [x.phi for x in jets], [x.mass for x in jets]
+        )
+        self.assertEqual((list(i), list(j)), ([0, 0, 1], [1, 2, 2]))
+        #back-to-back massless jets
+        self.assertAlmostEqual(m[0], 100.0, places=4)
+
+if __name__ == "__main__":
+    unittest.main()